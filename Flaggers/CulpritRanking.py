@@ -0,0 +1,59 @@
+import numpy as np
+
+# criteria culprits are ranked by, in the order their culprits are reported
+CRITERIA = ('mean', 'max', 'median')
+
+
+def _quantile(ordered, counts, q):
+    # linear interpolation between the closest ranks, computed like np.percentile so values match pandas quantile
+    virtual = (counts - 1) * q
+    lower = np.floor(virtual).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    gamma = virtual - lower
+    rows = np.arange(len(counts))
+    a = ordered[rows, lower]
+    b = ordered[rows, upper]
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+
+def get_window_stats(windows):
+    """
+    Mean, median, 99th percentile and max of every series in windows, a list of 1-d arrays. The series are stacked
+    into one NaN padded matrix, sorted once along the time axis and every statistic is taken from that matrix, each
+    equal to what the pandas method of the same name returns for the series. Every series needs at least one sample.
+
+    Returns a dict of arrays aligned with windows.
+    """
+    counts = np.array([len(values) for values in windows], dtype=np.int64)
+    matrix = np.full((len(windows), counts.max() if len(windows) else 0), np.nan)
+    for i, values in enumerate(windows):
+        matrix[i, :counts[i]] = values
+    # rows of the same length are summed without padding so that the sums round like the sum of each series
+    sums = np.empty(len(windows))
+    for length in np.unique(counts):
+        rows = counts == length
+        sums[rows] = matrix[rows, :length].sum(axis=1)
+    ordered = np.sort(matrix, axis=1)
+    rows = np.arange(len(windows))
+    return {
+        'mean': sums / counts,
+        # the middle sample, or the mean of the two middle samples (for an odd count both are the same sample)
+        'median': (ordered[rows, (counts - 1) // 2] + ordered[rows, counts // 2]) / 2,
+        'p99': _quantile(ordered, counts, 0.99),
+        'max': ordered[rows, counts - 1],
+    }
+
+
+def rank_culprits(_pods, top_k=1):
+    """
+    The top_k pods of _pods, a list of [pod, window samples], by each of CRITERIA. Ties go to the pod listed first.
+
+    Returns (criterion, pod, stats) tuples, where stats holds the window statistics of the pod, grouped by criterion.
+    """
+    stats = get_window_stats([np.asarray(win_df, dtype=float) for _, win_df in _pods])
+    ranked = []
+    for criterion in CRITERIA:
+        for i in np.argsort(-stats[criterion], kind='stable')[:top_k]:
+            ranked.append((criterion, _pods[i][0], {name: values[i] for name, values in stats.items()}))
+    return ranked
@@ -1,30 +1,75 @@
-
+import numpy as np
 import pandas as pd
 import datetime
 
-from Flaggers.utils import search_lb, search_rb, get_windows
-
-
-def get_pods_windows( metric, win_st_ts, win_end_ts):
-    if metric is None:
-        return None
-    if metric['timestamp'].iloc[0] > win_end_ts or metric['timestamp'].iloc[-1] < win_st_ts:
-        return None
-    l_idx = search_lb(metric['timestamp'], win_st_ts)
-    r_idx = search_rb(metric['timestamp'], win_end_ts)
-    win_df = metric['values'].iloc[l_idx:r_idx + 1]
-    return win_df
-
-
-def get_culprits(_pods, win_start, win_end):
+from Flaggers.CulpritRanking import rank_culprits
+from Flaggers.utils import get_windows_batch
+from profiling import profiled
+
+
+def get_pods_windows_batch(pods, metric, windows):
+    """
+    The samples of every pod in every window, from the last sample at or before the window start (or the first sample)
+    to the first sample after its end, with the bounds of all pods and windows found at once. Pods in one MetricStore
+    share its time axis, so each window is located on that axis once and turned into per pod sample indices with a
+    running count of the samples every pod has.
+
+    Returns one [[pod, window samples], ...] list per window, pods without samples in the window are left out.
+    """
+    windows_pods = [[] for _ in windows]
+    if len(windows) == 0:
+        return windows_pods
+    starts = np.array([win[0] for win in windows])
+    ends = np.array([win[1] for win in windows])
+    # pods normally share one store, group them in case they do not
+    stores = {}
+    for position, pod in enumerate(pods):
+        stores.setdefault(id(pod.metric_store), (pod.metric_store, []))[1].append((position, pod))
+    for metric_store, store_pods in stores.values():
+        present = metric_store.present(metric)
+        store_pods = [(position, pod) for position, pod in store_pods if present[pod.row]]
+        if len(store_pods) == 0:
+            continue
+        values = metric_store.matrix(metric)[[pod.row for _, pod in store_pods]]
+        valid = ~np.isnan(values)
+        # counts[i, j] is the number of samples pod i has at or before step j, with a leading 0 for "before the axis"
+        counts = np.zeros((len(store_pods), values.shape[1] + 1), dtype=np.int64)
+        np.cumsum(valid, axis=1, out=counts[:, 1:])
+        axis = metric_store.timestamps
+        up_to_start = counts[:, np.searchsorted(axis, starts, side='right')]
+        before_start = counts[:, np.searchsorted(axis, starts, side='left')]
+        up_to_end = counts[:, np.searchsorted(axis, ends, side='right')]
+        # pods whose series lies entirely before or entirely after the window have nothing in it
+        overlaps = (up_to_end > 0) & (before_start < counts[:, -1:])
+        lower = np.maximum(up_to_start - 1, 0)
+        for i, (position, pod) in enumerate(store_pods):
+            samples = values[i][valid[i]]
+            for w in np.flatnonzero(overlaps[i]):
+                windows_pods[w].append((position, pod, samples[lower[i, w]:up_to_end[i, w] + 1]))
+    return [[[pod, win_df] for _, pod, win_df in sorted(_pods, key=lambda x: x[0])] for _pods in windows_pods]
+
+
+def get_nodes_windows(node_data, node_names, metric, limit_attribute, threshold_fraction, min_window_diff,
+                      max_win_size):
+    # bad windows of all the nodes in one batch, yields (node name, node, windows)
+    node_names = list(node_names)
+    nodes = [node_data[node_name] for node_name in node_names]
+    series = []
+    thresholds = []
+    for node in nodes:
+        usage = getattr(node, metric)
+        limit = getattr(node, limit_attribute)
+        series.append(None if usage is None else (usage.timestamps, usage.values))
+        thresholds.append(float('nan') if limit is None else limit * threshold_fraction)
+    windows = get_windows_batch(series, thresholds, min_window_diff, max_win_size)
+    return zip(node_names, nodes, windows)
+
+
+def get_culprits(_pods, win_start, win_end, top_k=1):
+    # the top_k pods by avg, max and median usage in the window, ranked on the window statistics of all pods at once
     _culprits = []
-    max_avg_pod = max(_pods, key=lambda x: x[1].mean())
-    max_max_pod = max(_pods, key=lambda x: x[1].max())
-    max_median_pod = max(_pods, key=lambda x: x[1].median())
-    _culprits.append({'pod': max_avg_pod[0], 'win_df': max_avg_pod[1], "win_start": win_start, "win_end": win_end})
-    _culprits.append({'pod': max_max_pod[0], 'win_df': max_max_pod[1], "win_start": win_start, "win_end": win_end})
-    _culprits.append(
-        {'pod': max_median_pod[0], 'win_df': max_median_pod[1], "win_start": win_start, "win_end": win_end})
+    for _, pod, stats in rank_culprits(_pods, top_k):
+        _culprits.append({'pod': pod, 'stats': stats, "win_start": win_start, "win_end": win_end})
     return _culprits
 
 
@@ -32,43 +77,36 @@ def get_report_from_culprits(_culprits):
     _table = []
     for culprit in _culprits:
         pod = culprit['pod']
-        win_df = culprit['win_df']
+        stats = culprit['stats']
         _table.append([
             pod.node_name,
             pod.namespace,
             pod.pod_name,
-            win_df.mean(),
-            win_df.median(),
-            win_df.quantile(0.99),
-            win_df.max(),
+            stats['mean'],
+            stats['median'],
+            stats['p99'],
+            stats['max'],
             culprit['win_start'],
             culprit['win_end']
         ])
     return _table
 
 
+@profiled('culprits')
 def mark_culprit_pods_for_high_cpu(bad_nodes, node_pod_dict, node_data, min_window_diff, max_win_size,
-                                   threshold_fraction):
+                                   threshold_fraction, top_k=1):
     _culprits = []
-    for node_name in bad_nodes['node name']:
-        node_item = node_data[node_name]
-        threshold = threshold_fraction * node_item.cpu_limit
-        bad_windows = get_windows(node_item.cpu_usage['values'], node_item.cpu_usage['timestamp'], threshold,
-                                  min_window_diff, max_win_size)
-
-        for win in bad_windows:
+    bad_windows_by_node = get_nodes_windows(node_data, bad_nodes['node name'], 'cpu_usage',
+                                            'cpu_limit', threshold_fraction, min_window_diff,
+                                            max_win_size)
+    for node_name, node_item, bad_windows in bad_windows_by_node:
+        pods_by_window = get_pods_windows_batch(node_pod_dict[node_name], 'cpu_usage', bad_windows)
+        for win, _pods in zip(bad_windows, pods_by_window):
             win_start = str(datetime.datetime.fromtimestamp(win[0]))
             win_end = str(datetime.datetime.fromtimestamp(win[1]))
-            win_st_ts, win_end_ts = win
-
-            _pods = []
-            for pod in node_pod_dict[node_name]:
-                win_df = get_pods_windows(pod.cpu_usage, win_st_ts, win_end_ts)
-                if win_df is not None:
-                    _pods.append([pod, win_df])
             if len(_pods) == 0:
                 continue
-            curr_culprits = get_culprits(_pods, win_start, win_end)
+            curr_culprits = get_culprits(_pods, win_start, win_end, top_k)
             _culprits.extend(curr_culprits)
 
     df = pd.DataFrame(get_report_from_culprits(_culprits), columns=[
@@ -87,27 +125,21 @@ def mark_culprit_pods_for_high_cpu(bad_nodes, node_pod_dict, node_data, min_wind
     return df
 
 
+@profiled('culprits')
 def mark_culprit_pods_for_high_memory(bad_nodes, node_pod_dict, node_data, min_window_diff, max_win_size,
-                                      threshold_fraction):
+                                      threshold_fraction, top_k=1):
     _culprits = []
-    for node_name in bad_nodes['node name']:
-        node_item = node_data[node_name]
-        threshold = node_item.memory_limit * threshold_fraction
-        bad_windows = get_windows(node_item.memory_usage['values'], node_item.memory_usage['timestamp'], threshold,
-                                  min_window_diff, max_win_size)
-        for win in bad_windows:
+    bad_windows_by_node = get_nodes_windows(node_data, bad_nodes['node name'], 'memory_usage',
+                                            'memory_limit', threshold_fraction, min_window_diff,
+                                            max_win_size)
+    for node_name, node_item, bad_windows in bad_windows_by_node:
+        pods_by_window = get_pods_windows_batch(node_pod_dict[node_name], 'memory_usage', bad_windows)
+        for win, _pods in zip(bad_windows, pods_by_window):
             win_start = str(datetime.datetime.fromtimestamp(win[0]))
             win_end = str(datetime.datetime.fromtimestamp(win[1]))
-            win_st_ts, win_end_ts = win
-
-            _pods = []
-            for pod in node_pod_dict[node_name]:
-                win_df = get_pods_windows( pod.memory_usage, win_st_ts, win_end_ts)
-                if win_df is not None:
-                    _pods.append([pod, win_df])
             if len(_pods) == 0:
                 continue
-            curr_culprits = get_culprits(_pods, win_start, win_end)
+            curr_culprits = get_culprits(_pods, win_start, win_end, top_k)
             _culprits.extend(curr_culprits)
     df = pd.DataFrame(get_report_from_culprits(_culprits), columns=[
         "node name",
@@ -125,28 +157,21 @@ def mark_culprit_pods_for_high_memory(bad_nodes, node_pod_dict, node_data, min_w
     return df
 
 
+@profiled('culprits')
 def mark_culprit_pods_for_high_tx_bytes(bad_nodes, node_pod_dict, node_data, min_window_diff, max_win_size,
-                                        threshold_fraction):
+                                        threshold_fraction, top_k=1):
     _culprits = []
-    for node_name in bad_nodes['node name']:
-        node_item = node_data[node_name]
-        threshold = node_item.network_bandwidth_limit * threshold_fraction
-        bad_windows = get_windows(node_item.network_tx_bytes['values'], node_item.network_tx_bytes['timestamp'],
-                                  threshold,
-                                  min_window_diff, max_win_size)
-        for win in bad_windows:
+    bad_windows_by_node = get_nodes_windows(node_data, bad_nodes['node name'], 'network_tx_bytes',
+                                            'network_bandwidth_limit', threshold_fraction, min_window_diff,
+                                            max_win_size)
+    for node_name, node_item, bad_windows in bad_windows_by_node:
+        pods_by_window = get_pods_windows_batch(node_pod_dict[node_name], 'network_tx_bytes', bad_windows)
+        for win, _pods in zip(bad_windows, pods_by_window):
             win_start = str(datetime.datetime.fromtimestamp(win[0]))
             win_end = str(datetime.datetime.fromtimestamp(win[1]))
-            win_st_ts, win_end_ts = win
-
-            _pods = []
-            for pod in node_pod_dict[node_name]:
-                win_df = get_pods_windows(pod.network_tx_bytes, win_st_ts, win_end_ts)
-                if win_df is not None:
-                    _pods.append([pod, win_df])
             if len(_pods) == 0:
                 continue
-            curr_culprits = get_culprits(_pods, win_start, win_end)
+            curr_culprits = get_culprits(_pods, win_start, win_end, top_k)
             _culprits.extend(curr_culprits)
     df = pd.DataFrame(get_report_from_culprits(_culprits), columns=[
         "node name",
@@ -164,29 +189,21 @@ def mark_culprit_pods_for_high_tx_bytes(bad_nodes, node_pod_dict, node_data, min
     return df
 
 
+@profiled('culprits')
 def mark_culprit_pods_for_high_rx_bytes(bad_nodes, node_pod_dict, node_data, min_window_diff, max_win_size,
-                                        threshold_fraction):
+                                        threshold_fraction, top_k=1):
     _culprits = []
-    for node_name in bad_nodes['node name']:
-        node_item = node_data[node_name]
-        threshold = node_item.network_bandwidth_limit * threshold_fraction
-        bad_windows = get_windows(node_item.network_rx_bytes['values'], node_item.network_rx_bytes['timestamp'],
-                                  threshold,
-                                  min_window_diff, max_win_size)
-        for win in bad_windows:
+    bad_windows_by_node = get_nodes_windows(node_data, bad_nodes['node name'], 'network_rx_bytes',
+                                            'network_bandwidth_limit', threshold_fraction, min_window_diff,
+                                            max_win_size)
+    for node_name, node_item, bad_windows in bad_windows_by_node:
+        pods_by_window = get_pods_windows_batch(node_pod_dict[node_name], 'network_rx_bytes', bad_windows)
+        for win, _pods in zip(bad_windows, pods_by_window):
             win_start = str(datetime.datetime.fromtimestamp(win[0]))
             win_end = str(datetime.datetime.fromtimestamp(win[1]))
-            win_st_ts, win_end_ts = win
-
-            _pods = []
-            for pod in node_pod_dict[node_name]:
-
-                win_df = get_pods_windows(pod.network_rx_bytes, win_st_ts, win_end_ts)
-                if win_df is not None:
-                    _pods.append([pod, win_df])
             if len(_pods) == 0:
                 continue
-            curr_culprits = get_culprits(_pods, win_start, win_end)
+            curr_culprits = get_culprits(_pods, win_start, win_end, top_k)
             _culprits.extend(curr_culprits)
     df = pd.DataFrame(get_report_from_culprits(_culprits), columns=[
         "node name",
@@ -204,28 +221,21 @@ def mark_culprit_pods_for_high_rx_bytes(bad_nodes, node_pod_dict, node_data, min
     return df
 
 
+@profiled('culprits')
 def mark_culprit_pods_for_total_disk_bytes(bad_nodes, node_pod_dict, node_data, min_window_diff, max_win_size,
-                                           threshold_fraction):
+                                           threshold_fraction, top_k=1):
     _culprits = []
-    for node_name in bad_nodes['node name']:
-        node_item = node_data[node_name]
-        threshold = node_item.ebs_baseline_bandwidth * threshold_fraction
-        bad_windows = get_windows(node_item.disk_total_bytes['values'], node_item.disk_total_bytes['timestamp'],
-                                  threshold,
-                                  min_window_diff, max_win_size)
-        for win in bad_windows:
+    bad_windows_by_node = get_nodes_windows(node_data, bad_nodes['node name'], 'disk_total_bytes',
+                                            'ebs_baseline_bandwidth', threshold_fraction, min_window_diff,
+                                            max_win_size)
+    for node_name, node_item, bad_windows in bad_windows_by_node:
+        pods_by_window = get_pods_windows_batch(node_pod_dict[node_name], 'disk_total_bytes', bad_windows)
+        for win, _pods in zip(bad_windows, pods_by_window):
             win_start = str(datetime.datetime.fromtimestamp(win[0]))
             win_end = str(datetime.datetime.fromtimestamp(win[1]))
-            win_st_ts, win_end_ts = win
-
-            _pods = []
-            for pod in node_pod_dict[node_name]:
-                win_df = get_pods_windows(pod.disk_total_bytes, win_st_ts, win_end_ts)
-                if win_df is not None:
-                    _pods.append([pod, win_df])
             if len(_pods) == 0:
                 continue
-            curr_culprits = get_culprits(_pods, win_start, win_end)
+            curr_culprits = get_culprits(_pods, win_start, win_end, top_k)
             _culprits.extend(curr_culprits)
     df = pd.DataFrame(get_report_from_culprits(_culprits), columns=[
         "node name",
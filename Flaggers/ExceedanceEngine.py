@@ -0,0 +1,48 @@
+import numpy as np
+
+from Flaggers.utils import NODE_RESOURCES, get_node_limit
+from profiling import profiled
+
+
+def get_node_limits_by_row(node_data, metric_store, resource):
+    # limits of the nodes aligned with the rows of metric_store, NaN where the limit is not known
+    limits = np.full(len(metric_store.entities), np.nan)
+    for node in node_data.values():
+        limit = get_node_limit(node, resource)
+        if limit is not None:
+            limits[node.row] = limit
+    return limits
+
+
+@profiled('flagger')
+def compute_node_exceedances(node_data, thresholds):
+    """
+    Exceedance counts of the node probability flaggers for every resource in thresholds (resource -> threshold as a
+    fraction of the node limit) at once. Each usage matrix is compared with the thresholds of all of its rows in one
+    vectorized step instead of a python loop per sample. Nodes that only have a summary computed by prometheus take
+    their counts from it.
+
+    Returns resource -> {node name: (samples above threshold * limit, samples)}, nodes without usage are left out.
+    """
+    exceedances = {resource: {} for resource in thresholds}
+    # nodes normally share one store, group them in case they do not
+    stores = {}
+    for node_name, node in node_data.items():
+        stores.setdefault(id(node.metric_store), (node.metric_store, {}))[1][node_name] = node
+    for metric_store, nodes in stores.values():
+        for resource, threshold in thresholds.items():
+            metric = NODE_RESOURCES[resource][0]
+            matrix = metric_store.matrix(metric)
+            if matrix is not None:
+                node_thresholds = threshold * get_node_limits_by_row(nodes, metric_store, resource)
+                with np.errstate(invalid='ignore'):
+                    above = (matrix > node_thresholds[:, None]).sum(axis=1)
+                samples = (~np.isnan(matrix)).sum(axis=1)
+                present = metric_store.present(metric)
+            for node_name, node in nodes.items():
+                summary = metric_store.get_fetched_summary(metric, node.row)
+                if summary is not None and threshold in summary.exceedances:
+                    exceedances[resource][node_name] = (summary.exceedances[threshold], summary.count)
+                elif matrix is not None and present[node.row]:
+                    exceedances[resource][node_name] = (int(above[node.row]), int(samples[node.row]))
+    return exceedances
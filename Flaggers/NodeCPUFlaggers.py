@@ -1,29 +1,35 @@
 import pandas as pd
 
+from Flaggers.ExceedanceEngine import compute_node_exceedances
+from Flaggers.utils import get_usage_summary
+from profiling import profiled
 
-def get_node_cpu_stats(node):
+
+def get_node_cpu_stats(node, summary):
 
     row = [
         node.node_name,
         node.instance_type,
         node.cpu_limit,
-        (node.cpu_usage['values'].mean() / node.cpu_limit)*100,
-        (node.cpu_usage['values'].median() / node.cpu_limit)*100,
-        (node.cpu_usage['values'].quantile(0.95) / node.cpu_limit)*100,
-        (node.cpu_usage['values'].quantile(0.99) / node.cpu_limit)*100,
-        (node.cpu_usage['values'].max() / node.cpu_limit)*100,
+        (summary.mean / node.cpu_limit)*100,
+        (summary.median / node.cpu_limit)*100,
+        (summary.p95 / node.cpu_limit)*100,
+        (summary.p99 / node.cpu_limit)*100,
+        (summary.max / node.cpu_limit)*100,
     ]
     return row
 
 
+@profiled('flagger')
 def flag_nodes_by_high_avg_cpu_utilization(logger ,node_data, threshold):
     _table = []
     for _, node in node_data.items():
         try:
-            if node.cpu_usage is None:
+            summary = get_usage_summary(node, 'cpu_usage')
+            if summary is None:
                 continue
-            if node.cpu_usage['values'].mean() > node.cpu_limit * threshold:
-                _table.append(get_node_cpu_stats(node))
+            if summary.mean > node.cpu_limit * threshold:
+                _table.append(get_node_cpu_stats(node, summary))
         except Exception as e:
             logger.error(f"Error flagging nodes for high avg cpu util node:{node.node_name}", e)
 
@@ -39,17 +45,20 @@ def flag_nodes_by_high_avg_cpu_utilization(logger ,node_data, threshold):
     return df
 
 
-def flag_nodes_by_high_probability_of_high_cpu_utilization(logger,node_data, cpu_util_threshold, prob_limit):
+@profiled('flagger')
+def flag_nodes_by_high_probability_of_high_cpu_utilization(logger,node_data, cpu_util_threshold, prob_limit,
+                                                           exceedances=None):
     _table = []
-    for _, node in node_data.items():
+    # the exceedances of node_data, computed once for all resources by the caller when given
+    if exceedances is None:
+        exceedances = compute_node_exceedances(node_data, {'cpu': cpu_util_threshold})['cpu']
+    for node_name, node in node_data.items():
         try:
-            if node.cpu_usage is None:
+            if node_name not in exceedances:
                 continue
-            high_usage_freq = 0
-            for cpu_usage in node.cpu_usage['values']:
-                high_usage_freq += cpu_usage > cpu_util_threshold * node.cpu_limit
-            if high_usage_freq > prob_limit * len(node.cpu_usage['values']):
-                _table.append(get_node_cpu_stats(node))
+            high_usage_freq, samples = exceedances[node_name]
+            if high_usage_freq > prob_limit * samples:
+                _table.append(get_node_cpu_stats(node, get_usage_summary(node, 'cpu_usage')))
         except Exception as e:
             logger.error(f"Error flagging nodes for more frequent high cpu util node:{node.node_name}", e)
     df = pd.DataFrame(_table, columns=['node name',
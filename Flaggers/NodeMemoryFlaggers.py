@@ -1,27 +1,33 @@
 import pandas as pd
 
+from Flaggers.ExceedanceEngine import compute_node_exceedances
+from Flaggers.utils import get_usage_summary
+from profiling import profiled
 
-def get_node_memory_stats(node):
+
+def get_node_memory_stats(node, summary):
     return [
         node.node_name,
         node.instance_type,
         node.memory_limit,
-        (node.memory_usage['values'].mean() / node.memory_limit)*100,
-        (node.memory_usage['values'].median() / node.memory_limit)*100,
-        (node.memory_usage['values'].quantile(0.95) / node.memory_limit)*100,
-        (node.memory_usage['values'].quantile(0.99) / node.memory_limit)*100,
-        (node.memory_usage['values'].max() / node.memory_limit)*100,
+        (summary.mean / node.memory_limit)*100,
+        (summary.median / node.memory_limit)*100,
+        (summary.p95 / node.memory_limit)*100,
+        (summary.p99 / node.memory_limit)*100,
+        (summary.max / node.memory_limit)*100,
     ]
 
 
+@profiled('flagger')
 def flag_nodes_by_high_avg_memory_utilization(logger, node_data, threshold):
     _table = []
     for _, node in node_data.items():
         try:
-            if node.memory_usage is None:
+            summary = get_usage_summary(node, 'memory_usage')
+            if summary is None:
                 continue
-            if node.memory_usage['values'].mean() > threshold * node.memory_limit:
-                _table.append(get_node_memory_stats(node))
+            if summary.mean > threshold * node.memory_limit:
+                _table.append(get_node_memory_stats(node, summary))
         except Exception as e:
             logger.error(f"Error flagging nodes for high avg memory utilization node:{node.node_name}", e)
     df = pd.DataFrame(_table, columns=['node name',
@@ -35,17 +41,20 @@ def flag_nodes_by_high_avg_memory_utilization(logger, node_data, threshold):
     return df
 
 
-def flag_nodes_by_high_probability_of_high_memory_utilization(logger,node_data, memory_util_threshold, prob_limit):
+@profiled('flagger')
+def flag_nodes_by_high_probability_of_high_memory_utilization(logger,node_data, memory_util_threshold, prob_limit,
+                                                              exceedances=None):
     _table = []
-    for _, node in node_data.items():
+    # the exceedances of node_data, computed once for all resources by the caller when given
+    if exceedances is None:
+        exceedances = compute_node_exceedances(node_data, {'memory': memory_util_threshold})['memory']
+    for node_name, node in node_data.items():
         try:
-            high_usage_freq = 0
-            if node.memory_usage is None:
+            if node_name not in exceedances:
                 continue
-            for mem_use in node.memory_usage['values']:
-                high_usage_freq += mem_use > memory_util_threshold * node.memory_limit
-            if high_usage_freq > prob_limit * len(node.memory_usage['values']):
-                _table.append(get_node_memory_stats(node))
+            high_usage_freq, samples = exceedances[node_name]
+            if high_usage_freq > prob_limit * samples:
+                _table.append(get_node_memory_stats(node, get_usage_summary(node, 'memory_usage')))
         except Exception as e:
             logger.error(f"Error flagging nodes for more frequent high memory utilization node:{node.node_name}", e)
     df = pd.DataFrame(_table, columns=['node name',
@@ -1,19 +1,24 @@
 import pandas as pd
 
+from Flaggers.ExceedanceEngine import compute_node_exceedances
+from Flaggers.utils import get_usage_summary
+from profiling import profiled
 
-def get_node_tx_bytes_stats(node):
+
+def get_node_tx_bytes_stats(node, summary):
     return [
         node.node_name,
         node.instance_type,
         node.network_bandwidth_limit,
-        node.network_tx_bytes['values'].mean(),
-        node.network_tx_bytes['values'].median(),
-        node.network_tx_bytes['values'].quantile(0.95),
-        node.network_tx_bytes['values'].quantile(0.99),
-        node.network_tx_bytes['values'].max()
+        summary.mean,
+        summary.median,
+        summary.p95,
+        summary.p99,
+        summary.max
     ]
 
 
+@profiled('flagger')
 def flag_nodes_by_high_avg_network_tx_bytes(logger,node_data, threshold):
     bad_node_list = []
 
@@ -21,10 +26,11 @@ def flag_nodes_by_high_avg_network_tx_bytes(logger,node_data, threshold):
         try:
             if node.network_bandwidth_limit is None:
                 continue
-            if node.network_tx_bytes is None:
+            summary = get_usage_summary(node, 'network_tx_bytes')
+            if summary is None:
                 continue
-            if node.network_tx_bytes['values'].mean() > threshold * node.network_bandwidth_limit * 1.25 * 1E8:
-                bad_node_list.append(get_node_tx_bytes_stats(node))
+            if summary.mean > threshold * node.network_bandwidth_limit * 1.25 * 1E8:
+                bad_node_list.append(get_node_tx_bytes_stats(node, summary))
         except Exception as e:
             logger.error(f"Error flagging nodes for high avg tx bytes node:{node.node_name}", e)
     df = pd.DataFrame(bad_node_list, columns=[
@@ -40,20 +46,21 @@ def flag_nodes_by_high_avg_network_tx_bytes(logger,node_data, threshold):
     return df
 
 
-def flag_nodes_by_high_probability_of_high_network_tx_bytes(logger,node_data, threshold, prob_limit):
+@profiled('flagger')
+def flag_nodes_by_high_probability_of_high_network_tx_bytes(logger,node_data, threshold, prob_limit, exceedances=None):
     bad_node_list = []
-    for _, node in node_data.items():
+    # the exceedances of node_data, computed once for all resources by the caller when given
+    if exceedances is None:
+        exceedances = compute_node_exceedances(node_data, {'tx bytes': threshold})['tx bytes']
+    for node_name, node in node_data.items():
         try:
             if node.network_bandwidth_limit is None:
                 continue
-            if node.network_tx_bytes is None:
+            if node_name not in exceedances:
                 continue
-            node_bandwidth_limit = node.network_bandwidth_limit * 1.25 * 1E8  # conversion from Gbps to bytes/sec
-            high_usage_freq = 0
-            for tx_bytes in node.network_tx_bytes['values']:
-                high_usage_freq += tx_bytes > threshold * node_bandwidth_limit
-            if high_usage_freq > prob_limit * len(node.network_tx_bytes):
-                bad_node_list.append(get_node_tx_bytes_stats(node))
+            high_usage_freq, samples = exceedances[node_name]
+            if high_usage_freq > prob_limit * samples:
+                bad_node_list.append(get_node_tx_bytes_stats(node, get_usage_summary(node, 'network_tx_bytes')))
         except Exception as e:
             logger.error(f"Error flagging nodes for frequent high tx bytes node:{node.node_name}", e)
     df = pd.DataFrame(bad_node_list, columns=[
@@ -1,94 +1,116 @@
 import pandas as pd
 
+from Flaggers.utils import get_usage_summary
+from profiling import profiled
 
-def calculate_exp_request(usage, margin):
-    avg = usage['values'].mean()
-    stddev = usage['values'].std()
+
+def calculate_exp_request(summary, margin):
+    avg = summary.mean
+    stddev = summary.std
     exp_request = avg + margin * stddev
     return exp_request
 
 
-def flag_pods_for_wrong_cpu_requests(logger, pod_data, margin=1, threshold=0.7):
-    _table = []
+POD_CPU_REQUEST_COLUMNS = [
+    "Namespace",
+    "Pod Name",
+    "CPU Request",
+    "CPU Limit",
+    "Avg CPU Usage(Cores)",
+    "Median Usage",
+    "95%tile CPU Usage",
+    "99%tile CPU Usage",
+    "Max CPU Usage",
+    "Suggested Request"
+]
+POD_MEMORY_REQUEST_COLUMNS = ["Namespace",
+                              "Pod Name",
+                              "Memory Request(MB)",
+                              "Memory Limit(MB)",
+                              "Avg Memory Usage(MB)",
+                              "Median(MB)"
+                              "90%tile Memory Usage(MB)",
+                              "95%tile Memory Usage(MB)",
+                              "99%tile Memory Usage(MB)",
+                              "Max Memory Usage(MB)",
+                              "Suggested Request(MB)"
+                              ]
+
+
+def pods_with_wrong_cpu_requests(logger, pod_data, margin=1, threshold=0.7):
+    # rows of POD_CPU_REQUEST_COLUMNS, yielded one pod at a time so that a report sink can write them as they come
     for (namespace, pod_name), pod in pod_data.items():
         try:
-            if pod.cpu_usage is None:
+            summary = get_usage_summary(pod, 'cpu_usage')
+            if summary is None:
                 logger.info(f"Cpu usage not available for pod:{pod_name}, namespace:{namespace}")
                 continue
-            exp_cpu_req = calculate_exp_request(pod.cpu_usage, margin)
+            exp_cpu_req = calculate_exp_request(summary, margin)
             bad_cpu_request = (abs(pod.cpu_request - exp_cpu_req) / exp_cpu_req > threshold)
 
-            if bad_cpu_request:
-                _table.append(
-                    [
-                        namespace,
-                        pod_name,
-                        pod.cpu_request,
-                        pod.cpu_limit,
-                        pod.cpu_usage['values'].mean(),
-                        pod.cpu_usage['values'].median(),
-                        pod.cpu_usage['values'].quantile(0.95),
-                        pod.cpu_usage['values'].quantile(0.99),
-                        pod.cpu_usage['values'].max(),
-                        exp_cpu_req
-                    ])
+            if not bad_cpu_request:
+                continue
+            row = (
+                namespace,
+                pod_name,
+                pod.cpu_request,
+                pod.cpu_limit,
+                summary.mean,
+                summary.median,
+                summary.p95,
+                summary.p99,
+                summary.max,
+                exp_cpu_req
+            )
         except Exception as e:
             logger.error(f"Error flagging pods for wrong cpu requests for namespace:{namespace},pod:{pod_name}", e)
-    df = pd.DataFrame(_table, columns=[
-        "Namespace",
-        "Pod Name",
-        "CPU Request",
-        "CPU Limit",
-        "Avg CPU Usage(Cores)",
-        "Median Usage",
-        "95%tile CPU Usage",
-        "99%tile CPU Usage",
-        "Max CPU Usage",
-        "Suggested Request"
-    ])
+            continue
+        yield row
+
+
+@profiled('flagger')
+def flag_pods_for_wrong_cpu_requests(logger, pod_data, margin=1, threshold=0.7):
+    df = pd.DataFrame(list(pods_with_wrong_cpu_requests(logger, pod_data, margin, threshold)),
+                      columns=POD_CPU_REQUEST_COLUMNS)
     df.sort_values(['Namespace'])
     return df
 
 
-def flag_pods_for_wrong_memory_requests(logger, pod_data, margin=1, threshold=0.7):
-    _table = []
+def pods_with_wrong_memory_requests(logger, pod_data, margin=1, threshold=0.7):
+    # rows of POD_MEMORY_REQUEST_COLUMNS, yielded one pod at a time like pods_with_wrong_cpu_requests
     for (namespace, pod_name), pod in pod_data.items():
         try:
-            if pod.memory_usage is None:
+            summary = get_usage_summary(pod, 'memory_usage')
+            if summary is None:
                 logger.info(f"Memory usage not available for pod:{pod_name}, namespace:{namespace}")
                 continue
-            exp_memory_req = calculate_exp_request(pod.memory_usage, margin)
+            exp_memory_req = calculate_exp_request(summary, margin)
             bad_memory_request = abs(pod.memory_request - exp_memory_req) / exp_memory_req > threshold
 
-            if bad_memory_request:
-                _table.append(
-                    [
-                        namespace,
-                        pod_name,
-                        pod.memory_request,
-                        pod.memory_limit,
-                        pod.memory_usage['values'].mean(),
-                        pod.memory_usage['values'].median(),
-                        pod.memory_usage['values'].quantile(0.95),
-                        pod.memory_usage['values'].quantile(0.99),
-                        pod.memory_usage['values'].max(),
-                        exp_memory_req
-                    ])
+            if not bad_memory_request:
+                continue
+            row = (
+                namespace,
+                pod_name,
+                pod.memory_request,
+                pod.memory_limit,
+                summary.mean,
+                summary.median,
+                summary.p95,
+                summary.p99,
+                summary.max,
+                exp_memory_req
+            )
         except Exception as e:
             logger.error(f"Error flagging pods for wrong memory requests for namespace:{namespace},pod:{pod_name}", e)
+            continue
+        yield row
 
-    df = pd.DataFrame(_table, columns=["Namespace",
-                                       "Pod Name",
-                                       "Memory Request(MB)",
-                                       "Memory Limit(MB)",
-                                       "Avg Memory Usage(MB)",
-                                       "Median(MB)"
-                                       "90%tile Memory Usage(MB)",
-                                       "95%tile Memory Usage(MB)",
-                                       "99%tile Memory Usage(MB)",
-                                       "Max Memory Usage(MB)",
-                                       "Suggested Request(MB)"
-                                       ])
+
+@profiled('flagger')
+def flag_pods_for_wrong_memory_requests(logger, pod_data, margin=1, threshold=0.7):
+    df = pd.DataFrame(list(pods_with_wrong_memory_requests(logger, pod_data, margin, threshold)),
+                      columns=POD_MEMORY_REQUEST_COLUMNS)
     df.sort_values(['Namespace'])
     return df
 
@@ -106,6 +128,7 @@ def get_approximate_ratio(ratio):
         return None
 
 
+@profiled('flagger')
 def flag_pods_by_wrong_node_placement_by_requests(logger,pod_data, node_data, threshold):
     _table = []
     for _, pod in pod_data.items():
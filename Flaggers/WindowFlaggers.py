@@ -0,0 +1,54 @@
+import numpy as np
+
+from Flaggers.ExceedanceEngine import get_node_limits_by_row
+from Flaggers.utils import NODE_RESOURCES
+from profiling import profiled
+
+# metric and request attribute of the pod request flaggers
+POD_RESOURCES = {
+    'cpu': ('cpu_usage', 'cpu_request'),
+    'memory': ('memory_usage', 'memory_request'),
+}
+
+# the running aggregates can differ from a fresh computation by rounding, candidates are selected with this relative
+# tolerance so that no entity the flaggers would flag is missed
+TOLERANCE = 1E-6
+
+
+def _attribute_by_row(entities, metric_store, attribute):
+    values = np.full(len(metric_store.entities), np.nan)
+    for entity in entities.values():
+        value = getattr(entity, attribute)
+        if value is not None:
+            values[entity.row] = value
+    return values
+
+
+@profiled('flagger')
+def select_nodes_by_window_stats(node_data, metric_store, resource, threshold, prob_limit):
+    """
+    Nodes that the high avg or the high probability flagger of resource may flag, decided from the running window
+    aggregates of the metric store instead of a scan over every series. The flaggers only have to run on the result.
+    """
+    metric = NODE_RESOURCES[resource][0]
+    thresholds = threshold * get_node_limits_by_row(node_data, metric_store, resource)
+    metric_store.track_exceedance(metric, thresholds)
+    count = metric_store.window_count(metric)
+    mean = metric_store.window_mean(metric)
+    exceed = metric_store.exceedance_count(metric)
+    with np.errstate(invalid='ignore'):
+        selected = (mean > thresholds - TOLERANCE * (np.abs(thresholds) + 1)) | (exceed > prob_limit * count)
+    return {node_name: node for node_name, node in node_data.items() if selected[node.row]}
+
+
+@profiled('flagger')
+def select_pods_by_window_stats(pod_data, metric_store, resource, margin, threshold):
+    """Pods whose request the request flagger of resource may flag, see select_nodes_by_window_stats."""
+    metric, request_attribute = POD_RESOURCES[resource]
+    requests = _attribute_by_row(pod_data, metric_store, request_attribute)
+    exp_requests = metric_store.window_mean(metric) + margin * metric_store.window_std(metric)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        selected = np.abs(requests - exp_requests) / exp_requests > threshold - TOLERANCE * (abs(threshold) + 1)
+    # pods without a request are left to the flagger, which logs them
+    selected |= np.isnan(requests) & (metric_store.window_count(metric) > 0)
+    return {key: pod for key, pod in pod_data.items() if selected[pod.row]}
@@ -0,0 +1,153 @@
+import numpy as np
+
+from benchmarks.SyntheticCluster import SyntheticCluster
+from data_providers.MetricStore import MetricStore
+from Flaggers.CupritIdentifiers import get_pods_windows_batch
+from Flaggers.utils import get_windows
+
+STEP = 30
+
+
+class _Pod:
+    # the attributes get_pods_windows_batch reads from a PodData
+    def __init__(self, name, metric_store, row):
+        self.name = name
+        self.metric_store = metric_store
+        self.row = row
+
+
+def _search_lb(timestamps, val):
+    tl = -1
+    tr = len(timestamps)
+
+    while tr - tl > 1:
+        tm = (tl + tr) // 2
+        if timestamps[tm] > val:
+            tr = tm
+        else:
+            tl = tm
+    return tl
+
+
+def _search_rb(timestamps, val):
+    tl = -1
+    tr = len(timestamps)
+
+    while tr - tl > 1:
+        tm = (tl + tr) // 2
+        if timestamps[tm] > val:
+            tr = tm
+        else:
+            tl = tm
+    return tr
+
+
+def baseline_pod_window_bounds(timestamps, win_st_ts, win_end_ts):
+    # (l_idx, r_idx) of the binary searches get_pods_windows_batch replaced, None if the series misses the window.
+    # The samples of the window were values[l_idx:r_idx + 1]
+    if len(timestamps) == 0 or timestamps[0] > win_end_ts or timestamps[-1] < win_st_ts:
+        return None
+    return _search_lb(timestamps, win_st_ts), _search_rb(timestamps, win_end_ts)
+
+
+def _store_pods(timestamps, usage, metric='cpu_usage'):
+    metric_store = MetricStore(timestamps, STEP)
+    pods = []
+    for i, values in enumerate(usage):
+        row = metric_store.add_entity(f"pod-{i}")
+        metric_store.set_series(metric, row, timestamps, values)
+        pods.append(_Pod(f"pod-{i}", metric_store, row))
+    return pods
+
+
+def _assert_like_baseline(pods, usage, timestamps, windows):
+    result = get_pods_windows_batch(pods, 'cpu_usage', windows)
+    assert len(result) == len(windows)
+    for (win_st_ts, win_end_ts), window_pods in zip(windows, result):
+        expected = []
+        for pod, values in zip(pods, usage):
+            valid = ~np.isnan(values)
+            pod_timestamps = timestamps[valid].tolist()
+            bounds = baseline_pod_window_bounds(pod_timestamps, win_st_ts, win_end_ts)
+            if bounds is None:
+                continue
+            l_idx, r_idx = bounds
+            # the baseline sliced from the last sample (l_idx -1) when the window started before the first sample,
+            # the window now starts at the first sample
+            expected.append((pod.name, values[valid][max(l_idx, 0):r_idx + 1]))
+        assert [pod.name for pod, _ in window_pods] == [name for name, _ in expected]
+        for (_, samples), (_, expected_samples) in zip(window_pods, expected):
+            assert np.array_equal(samples, expected_samples)
+
+
+def test_batch_matches_the_baseline_searches():
+    cluster = SyntheticCluster(4, 25, 3 * 60, STEP, seed=5)
+    timestamps = cluster.timestamps
+    usage = cluster.pod_usage['cpu_usage']
+    # some pods only start part way into the window
+    assert np.isnan(usage).any()
+    pods = _store_pods(timestamps, usage)
+
+    windows = []
+    for node_usage in cluster.node_usage['cpu_usage']:
+        windows.extend(get_windows(node_usage, timestamps.astype(float), float(np.quantile(node_usage, 0.7)), 0, 600))
+    # windows off the time axis, before the first and after the last sample
+    rng = np.random.default_rng(5)
+    for _ in range(50):
+        start, end = sorted(rng.uniform(timestamps[0] - 600, timestamps[-1] + 600, 2))
+        windows.append([float(start), float(end)])
+    _assert_like_baseline(pods, usage, timestamps, windows)
+
+
+def test_window_starting_before_the_first_sample():
+    timestamps = np.arange(0, 10 * STEP, STEP, dtype=np.int64)
+    late = np.full(10, np.nan)
+    late[4:] = np.arange(6, dtype=float)
+    pods = _store_pods(timestamps, [np.arange(10, dtype=float), late])
+    [window_pods] = get_pods_windows_batch(pods, 'cpu_usage', [[60, 150]])
+    # from the last sample at or before the start to the first sample after the end, or from the first sample
+    assert window_pods[0][1].tolist() == [2, 3, 4, 5, 6]
+    assert window_pods[1][1].tolist() == [0, 1, 2]
+    [window_pods] = get_pods_windows_batch(pods, 'cpu_usage', [[-100, 15]])
+    assert [pod.name for pod, _ in window_pods] == ['pod-0']
+    assert window_pods[0][1].tolist() == [0, 1]
+
+
+def test_window_ending_after_the_last_sample():
+    timestamps = np.arange(0, 10 * STEP, STEP, dtype=np.int64)
+    early = np.full(10, np.nan)
+    early[:3] = [7, 8, 9]
+    pods = _store_pods(timestamps, [np.arange(10, dtype=float), early])
+    [window_pods, after] = get_pods_windows_batch(pods, 'cpu_usage', [[200, 1000], [280, 1000]])
+    assert [pod.name for pod, _ in window_pods] == ['pod-0']
+    assert window_pods[0][1].tolist() == [6, 7, 8, 9]
+    # both series end before the window starts
+    assert after == []
+    [window_pods] = get_pods_windows_batch(pods, 'cpu_usage', [[45, 1000]])
+    assert window_pods[1][1].tolist() == [8, 9]
+
+
+def test_nan_gaps_are_skipped():
+    timestamps = np.arange(0, 10 * STEP, STEP, dtype=np.int64)
+    values = np.arange(10, dtype=float)
+    values[[3, 4, 7]] = np.nan
+    pods = _store_pods(timestamps, [values])
+    # the samples around the window are the nearest ones the pod has
+    [window_pods] = get_pods_windows_batch(pods, 'cpu_usage', [[100, 190]])
+    assert window_pods[0][1].tolist() == [2, 5, 6, 8]
+    # a window inside a gap still gets the samples on both sides of it
+    [window_pods] = get_pods_windows_batch(pods, 'cpu_usage', [[95, 125]])
+    assert window_pods[0][1].tolist() == [2, 5]
+
+
+def test_pods_without_the_metric_or_in_other_stores():
+    timestamps = np.arange(0, 5 * STEP, STEP, dtype=np.int64)
+    pods = _store_pods(timestamps, [np.arange(5, dtype=float)])
+    no_usage = _Pod('no-usage', pods[0].metric_store, pods[0].metric_store.add_entity('no-usage'))
+    other = _store_pods(timestamps + STEP, [np.arange(5, dtype=float) + 10])[0]
+    [window_pods] = get_pods_windows_batch([other, no_usage, pods[0]], 'cpu_usage', [[60, 90]])
+    assert [pod.name for pod, _ in window_pods] == ['pod-0', 'pod-0']
+    assert window_pods[0][0] is other
+    assert window_pods[0][1].tolist() == [11, 12, 13]
+    assert window_pods[1][1].tolist() == [2, 3, 4]
+    assert get_pods_windows_batch(pods, 'cpu_usage', []) == []
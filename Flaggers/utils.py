@@ -1,55 +1,105 @@
+import numpy as np
+
+
+def bandwidth_to_bytes(bandwidth):
+    return bandwidth * 1.25 * 1E8  # conversion from Gbps to bytes/sec
+
+
+# usage metric, attribute holding the node limit the flagger thresholds are fractions of, and the conversion the
+# flaggers apply to that limit (None if it is used as is)
+NODE_RESOURCES = {
+    'cpu': ('cpu_usage', 'cpu_limit', None),
+    'memory': ('memory_usage', 'memory_limit', None),
+    'rx bytes': ('network_rx_bytes', 'network_bandwidth_limit', bandwidth_to_bytes),
+    'tx bytes': ('network_tx_bytes', 'network_bandwidth_limit', bandwidth_to_bytes),
+    'disk total bytes': ('disk_total_bytes', 'ebs_baseline_bandwidth', bandwidth_to_bytes),
+}
+
+
 def get_windows(data, timestamps, threshold, min_diff, max_win_size):
-    all_windows = []
-    i = 0
-    while i < len(data):
-        l = timestamps.iloc[i]
-        if data.iloc[i] < threshold:
-            i += 1
-            continue
-
-        while i < len(data) and data.iloc[i] > threshold:
-            if timestamps.iloc[i] - l > max_win_size:
-                break
-            i += 1
-
-        r = timestamps.iloc[i - 1]
-        all_windows.append([l, r])
-    if len(all_windows) == 0:
-        return []
-    compressed_windows = [all_windows[0]]
-    for i in range(1, len(all_windows)):
-        if (all_windows[i][0] - compressed_windows[-1][1]) / 1000 < min_diff:
-            compressed_windows[-1][1] = all_windows[i][1]
-        else:
-            compressed_windows.append(all_windows[i])
-    return compressed_windows
-
-
-def search_lb(df, val):
-    tl = -1
-    tr = len(df)
-
-    while tr - tl > 1:
-        tm = (tl + tr) // 2
-        if df.iloc[tm] > val:
-            tr = tm
-        else:
-            tl = tm
-    return tl
-
-
-def search_rb(df, val):
-    tl = -1
-    tr = len(df)
-
-    while tr - tl > 1:
-        tm = (tl + tr) // 2
-        if df.iloc[tm] > val:
-            tr = tm
-        else:
-            tl = tm
-    return tr
+    return get_windows_batch([(timestamps, data)], [threshold], min_diff, max_win_size)[0]
+
+
+def get_windows_batch(series, thresholds, min_diff, max_win_size):
+    """
+    Windows in which each of many series stays above its threshold, computed for all series at once with array
+    operations. series is a list of (timestamps, values) pairs (None for a series that is missing) and thresholds holds
+    one threshold per series.
+
+    A window is a run of consecutive samples above the threshold. Runs are split into windows spanning at most
+    max_win_size seconds, and a window that starts less than min_diff * 1000 seconds after the previous one ended is
+    merged into it. Returns one list of [start, end] timestamp pairs per series.
+    """
+    parts = [(np.asarray(s[0]), np.asarray(s[1], dtype=float)) for s in series if s is not None]
+    rows = np.array([i for i, s in enumerate(series) if s is not None], dtype=np.int64)
+    windows = [[] for _ in series]
+    if len(parts) == 0:
+        return windows
+    lengths = np.array([len(v) for _, v in parts], dtype=np.int64)
+    t = np.concatenate([ts for ts, _ in parts])
+    v = np.concatenate([vs for _, vs in parts])
+    row = np.repeat(rows, lengths)
+    if len(v) == 0:
+        return windows
+    with np.errstate(invalid='ignore'):
+        above = v > np.asarray(thresholds, dtype=float)[row]
+
+    # runs of samples above the threshold, a run never crosses from one series into the next
+    new_row = np.ones(len(v), dtype=bool)
+    new_row[1:] = row[1:] != row[:-1]
+    last_of_row = np.ones(len(v), dtype=bool)
+    last_of_row[:-1] = new_row[1:]
+    run_starts = np.flatnonzero(above & (new_row | ~np.roll(above, 1)))
+    run_ends = np.flatnonzero(above & (last_of_row | ~np.roll(above, -1)))
+    if len(run_starts) == 0:
+        return windows
+
+    # split the runs into windows of at most max_win_size seconds. the series are laid out on one increasing time axis
+    # with more than max_win_size seconds between them, so a single searchsorted finds the end of every window
+    offsets = np.zeros(len(parts))
+    spans = np.array([ts[-1] - ts[0] if len(ts) else 0.0 for ts, _ in parts])
+    firsts = np.array([ts[0] if len(ts) else 0.0 for ts, _ in parts])
+    offsets[1:] = np.cumsum(spans + abs(max_win_size) + 1)[:-1]
+    axis = t + np.repeat(offsets - firsts, lengths)
+    win_starts = []
+    win_ends = []
+    starts, ends = run_starts, run_ends
+    while len(starts) > 0:
+        cuts = np.minimum(np.searchsorted(axis, axis[starts] + max_win_size, side='right') - 1, ends)
+        win_starts.append(starts)
+        win_ends.append(cuts)
+        more = cuts < ends
+        starts, ends = cuts[more] + 1, ends[more]
+    win_starts = np.concatenate(win_starts)
+    order = np.argsort(win_starts, kind='stable')
+    win_starts = win_starts[order]
+    win_ends = np.concatenate(win_ends)[order]
+
+    # merge every window into the previous window of the same series if the gap between them is below min_diff
+    merge = np.zeros(len(win_starts), dtype=bool)
+    merge[1:] = (row[win_starts[1:]] == row[win_ends[:-1]]) & \
+                ((t[win_starts[1:]] - t[win_ends[:-1]]) / 1000 < min_diff)
+    first = np.flatnonzero(~merge)
+    last = np.append(first[1:] - 1, len(win_starts) - 1)
+    for r, l_ts, r_ts in zip(row[win_starts[first]], t[win_starts[first]].tolist(), t[win_ends[last]].tolist()):
+        windows[r].append([l_ts, r_ts])
+    return windows
 
 
 def bytes_to_MB(bytes):
-    return bytes*1E-6
\ No newline at end of file
+    return bytes*1E-6
+
+
+def get_usage_summary(entity, metric):
+    # mean, median, 95%tile, 99%tile, max, std and sample count of a usage metric, computed once per series and shared
+    # by every flagger and report, or taken from the summary prometheus computed if the raw series was not fetched
+    return entity.metric_store.get_summary(metric, entity.row)
+
+
+def get_node_limit(node, resource):
+    # limit of the node the thresholds of resource are fractions of, converted like the flaggers do
+    _, limit_attribute, conversion = NODE_RESOURCES[resource]
+    limit = getattr(node, limit_attribute)
+    if limit is None or conversion is None:
+        return limit
+    return conversion(limit)
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+import pytest
+
+from benchmarks.SyntheticCluster import SyntheticCluster
+from Flaggers.utils import get_windows, get_windows_batch
+
+STEP = 30
+
+
+def baseline_get_windows(data, timestamps, threshold, min_diff, max_win_size):
+    # the sample by sample loop get_windows_batch replaced, ported from pandas iloc to lists. It never ends on a
+    # sample equal to the threshold or NaN, so it is only compared on series without them
+    all_windows = []
+    i = 0
+    while i < len(data):
+        l = timestamps[i]
+        if data[i] < threshold:
+            i += 1
+            continue
+
+        while i < len(data) and data[i] > threshold:
+            if timestamps[i] - l > max_win_size:
+                break
+            i += 1
+
+        r = timestamps[i - 1]
+        all_windows.append([l, r])
+    if len(all_windows) == 0:
+        return []
+    compressed_windows = [all_windows[0]]
+    for i in range(1, len(all_windows)):
+        if (all_windows[i][0] - compressed_windows[-1][1]) / 1000 < min_diff:
+            compressed_windows[-1][1] = all_windows[i][1]
+        else:
+            compressed_windows.append(all_windows[i])
+    return compressed_windows
+
+
+@pytest.mark.parametrize('min_diff, max_win_size', [(0, 120), (0.05, 120), (0, 10 ** 6), (300, 30)])
+def test_batch_matches_the_baseline_loop(min_diff, max_win_size):
+    cluster = SyntheticCluster(20, 5, 6 * 60, STEP, seed=3)
+    timestamps = cluster.timestamps.astype(float)
+    series = []
+    thresholds = []
+    for usage in cluster.node_usage['cpu_usage']:
+        series.append((timestamps, usage))
+        # between two samples, the baseline loop never ends on a sample equal to the threshold
+        threshold = float(np.quantile(usage, 0.6)) * (1 + 1E-9)
+        assert threshold not in usage
+        thresholds.append(threshold)
+    windows = get_windows_batch(series, thresholds, min_diff, max_win_size)
+    for (ts, values), threshold, node_windows in zip(series, thresholds, windows):
+        expected = baseline_get_windows(values.tolist(), ts.tolist(), threshold, min_diff, max_win_size)
+        assert node_windows == expected
+        assert node_windows == get_windows(values, ts, threshold, min_diff, max_win_size)
+    assert sum(len(node_windows) for node_windows in windows) > 0
+
+
+def test_missing_series_have_no_windows():
+    timestamps = np.arange(0, 300, STEP, dtype=float)
+    windows = get_windows_batch([None, (timestamps, np.full(len(timestamps), 2.0)), (timestamps[:0], [])],
+                                [1.0, 1.0, 1.0], 0, 10 ** 6)
+    assert windows == [[], [[0.0, 270.0]], []]
+
+
+def test_samples_equal_to_the_threshold_are_not_above_it():
+    timestamps = np.arange(0, 8 * STEP, STEP, dtype=float)
+    values = [2, 2, 1, 1, 2, 1, 2, 2]
+    assert get_windows(values, timestamps, 1, 0, 10 ** 6) == [[0.0, 30.0], [120.0, 120.0], [180.0, 210.0]]
+
+
+def test_nan_samples_split_the_windows():
+    timestamps = np.arange(0, 7 * STEP, STEP, dtype=float)
+    values = [2, 2, math.nan, 2, math.nan, math.nan, 2]
+    assert get_windows(values, timestamps, 1, 0, 10 ** 6) == [[0.0, 30.0], [90.0, 90.0], [180.0, 180.0]]
+    # gaps shorter than min_diff * 1000 seconds are merged like gaps below the threshold
+    assert get_windows(values, timestamps, 1, 0.1, 10 ** 6) == [[0.0, 180.0]]
+
+
+def test_runs_longer_than_max_win_size_are_split():
+    timestamps = np.arange(0, 10 * STEP, STEP, dtype=float)
+    values = np.full(10, 5.0)
+    # every window spans at most max_win_size seconds from its first sample
+    assert get_windows(values, timestamps, 1, 0, 2 * STEP) == [[0.0, 60.0], [90.0, 150.0], [180.0, 240.0],
+                                                               [270.0, 270.0]]
+    # the split windows are one step apart, a min_diff above that merges them back into one long window
+    assert get_windows(values, timestamps, 1, 0.05, 2 * STEP) == [[0.0, 270.0]]
+    assert baseline_get_windows(values.tolist(), timestamps.tolist(), 1, 0.05, 2 * STEP) == [[0.0, 270.0]]
+
+
+def test_windows_do_not_cross_series():
+    timestamps = np.arange(0, 4 * STEP, STEP, dtype=float)
+    high = np.full(4, 5.0)
+    windows = get_windows_batch([(timestamps, high), (timestamps + 4 * STEP, high)], [1, 1], 10 ** 6, 10 ** 6)
+    assert windows == [[[0.0, 90.0]], [[120.0, 210.0]]]
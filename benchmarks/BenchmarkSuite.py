@@ -0,0 +1,203 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import config
+import profiling
+from benchmarks.MockPrometheus import MockPrometheusServer
+from benchmarks.SyntheticCluster import SyntheticCluster, SyntheticEC2
+from data_providers.InstanceCatalog import InstanceCatalog
+from data_providers.NodeDataProvider import NodeDataProvider
+from data_providers.PodDataProvider import PodDataProvider
+from data_providers.QueryExecutor import QueryExecutor
+from main import create_report, get_prometheus_client
+
+# cluster shapes -> (nodes, pods per node, minutes of usage)
+SHAPES = {
+    'small': (100, 50, 30),
+    'wide': (1000, 50, 30),
+    'xl': (5000, 50, 30),
+    'day': (100, 10, 24 * 60),
+    'week': (100, 2, 7 * 24 * 60),
+}
+# profiled phases timed as stages, see profiling.profiled
+STAGE_CATEGORIES = ('provider', 'flagger', 'culprits', 'report', 'sheet')
+# a stage regresses when it is slower than its baseline by more than the tolerance (a fraction of the baseline) and
+# by more than this many seconds, shorter differences are timer noise
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def run_stages(prometheus_api, start_time, end_time, logger, output_dir):
+    """
+    Runs the data providers on prometheus_api (a SyntheticCluster, or a PrometheusConnect of a MockPrometheusServer)
+    for the window from start_time to end_time and writes the full report from their data with the profiler enabled.
+    All queries are answered before the providers parse them, so the parse stages do not include waiting on the
+    responses.
+
+    Returns stage -> seconds: the fetch of all queries, the node and pod data parsing, every profiled phase of
+    STAGE_CATEGORIES summed over its calls, and the whole report.
+    """
+    profiler = profiling.enable()
+    executor = QueryExecutor(prometheus_api, logger, config.MAX_CONCURRENT_QUERIES, config.MAX_POINTS_PER_QUERY)
+    ec2_client = SyntheticEC2()
+    instance_catalog = InstanceCatalog(ec2_client, logger, config.NETWORK_BANDWIDTH_FILE_PATH)
+    node_data_provider = NodeDataProvider(prometheus_api, ec2_client, start_time, end_time, config.STEP,
+                                          config.RATE_DELTA, logger, config.NETWORK_BANDWIDTH_FILE_PATH, executor,
+                                          config.INSTANT_STATIC_QUERIES, instance_catalog,
+                                          local_node_name_join=config.LOCAL_NODE_NAME_JOIN)
+    pod_data_provider = PodDataProvider(prometheus_api, start_time, end_time, config.STEP, config.RATE_DELTA, logger,
+                                        executor, config.INSTANT_STATIC_QUERIES,
+                                        node_names_by_instance=node_data_provider.node_names_by_instance)
+    stages = {}
+    try:
+        start = time.perf_counter()
+        node_data_provider.prefetch()
+        pod_data_provider.prefetch()
+        executor.wait()
+        stages['fetch queries'] = time.perf_counter() - start
+        start = time.perf_counter()
+        node_data = node_data_provider.get_data()
+        stages['parse node data'] = time.perf_counter() - start
+        start = time.perf_counter()
+        pod_data = pod_data_provider.get_data()
+        stages['parse pod data'] = time.perf_counter() - start
+        start = time.perf_counter()
+        create_report(os.path.join(output_dir, 'report.xlsx'), start_time, end_time, node_data, pod_data, logger)
+        stages['create report'] = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+        profiling.disable()
+    for phase in profiler.phases:
+        if phase['category'] in STAGE_CATEGORIES:
+            stages[phase['name']] = stages.get(phase['name'], 0.0) + phase['wall']
+    return stages
+
+
+def benchmark_shape(nodes, pods_per_node, minutes, repeat, logger, seed=0, server_options=None):
+    # fastest time of every stage over repeat runs on the same cluster. With server_options (keyword arguments of
+    # MockPrometheusServer), the cluster is queried over http through a local mock prometheus
+    cluster = SyntheticCluster(nodes, pods_per_node, minutes, config.STEP, seed=seed)
+    server = None
+    prometheus_api = cluster
+    if server_options is not None:
+        server = MockPrometheusServer(cluster, logger, **server_options)
+        server.start()
+        prometheus_api = get_prometheus_client(server.url, config.MAX_CONCURRENT_QUERIES,
+                                               config.PROMETHEUS_QUERY_TIMEOUT)
+    best = {}
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            for _ in range(repeat):
+                for stage, seconds in run_stages(prometheus_api, cluster.start_time, cluster.end_time, logger,
+                                                 output_dir).items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+    finally:
+        if server is not None:
+            server.shutdown()
+            print(f"mock prometheus: {server.requests} requests, {server.failures} failed")
+    return best
+
+
+def find_regressions(stages, baseline, tolerance):
+    # (stage, seconds, baseline seconds) of every stage slower than its baseline beyond the tolerance
+    regressions = []
+    for stage, seconds in stages.items():
+        base = baseline.get(stage)
+        if base is not None and seconds > base * (1 + tolerance) and seconds - base > MIN_REGRESSION_SECONDS:
+            regressions.append((stage, seconds, base))
+    return regressions
+
+
+def format_stages(stages, baseline):
+    lines = [f"{'stage':<70} {'seconds':>9} {'baseline':>9} {'change':>8}"]
+    for stage, seconds in sorted(stages.items(), key=lambda x: -x[1]):
+        base = baseline.get(stage)
+        change = f"{(seconds / base - 1) * 100:+.0f}%" if base else ''
+        base = '' if base is None else f"{base:.3f}"
+        lines.append(f"{stage[:70]:<70} {seconds:>9.3f} {base:>9} {change:>8}")
+    return '\n'.join(lines)
+
+
+def read_baseline(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_baseline(path, baseline):
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the data provider parsing, the flaggers, the culprit analysis "
+                                                 "and the sheet writes on synthetic clusters")
+    parser.add_argument('--shape', nargs='+', choices=list(SHAPES), default=['small'],
+                        help="cluster shapes to benchmark, small by default")
+    parser.add_argument('--nodes', type=int, help="benchmark a cluster of this many nodes instead of the shapes")
+    parser.add_argument('--pods-per-node', type=int, default=50, help="pods per node of --nodes, 50 by default")
+    parser.add_argument('--minutes', type=int, default=30, help="minutes of usage of --nodes, 30 by default")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per shape, the fastest time of every stage counts")
+    parser.add_argument('--baseline', metavar='PATH',
+                        help="json file of baseline stage times to compare with, the run fails when a stage is "
+                             "slower than its baseline by more than the tolerance")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="write the stage times of this run to the --baseline file instead of comparing")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown as a fraction of the baseline, {DEFAULT_TOLERANCE} by default")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic clusters")
+    parser.add_argument('--http', action='store_true',
+                        help="query the clusters over http through a local mock prometheus instead of in process, "
+                             "the shapes are keyed with an ' http' suffix in the baseline")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every mock prometheus response is delayed")
+    parser.add_argument('--padding-bytes', type=int, default=0, help="filler bytes added to every mock response")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="fraction of the mock prometheus requests that fail and are retried")
+    args = parser.parse_args()
+    if args.update_baseline and args.baseline is None:
+        parser.error("--update-baseline requires --baseline")
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('benchmark')
+    # reports one after the other, so the stage times do not include waiting on the other report threads
+    config.REPORT_WORKERS = 1
+
+    if args.nodes is not None:
+        shapes = {f"{args.nodes}x{args.pods_per_node}x{args.minutes}m": (args.nodes, args.pods_per_node, args.minutes)}
+    else:
+        shapes = {name: SHAPES[name] for name in args.shape}
+    server_options = None
+    if args.http:
+        server_options = {'latency': args.latency, 'padding_bytes': args.padding_bytes,
+                          'failure_rate': args.failure_rate, 'seed': args.seed}
+        shapes = {name + ' http': shape for name, shape in shapes.items()}
+    baseline = read_baseline(args.baseline)
+    regressions = []
+    for name, (nodes, pods_per_node, minutes) in shapes.items():
+        stages = benchmark_shape(nodes, pods_per_node, minutes, max(1, args.repeat), logger, args.seed,
+                                 server_options)
+        shape_baseline = baseline.get(name, {}).get('stages', {})
+        print(f"\n{name}: {nodes} nodes, {pods_per_node} pods per node, {minutes} minutes at {config.STEP}s steps")
+        print(format_stages(stages, {} if args.update_baseline else shape_baseline))
+        if args.update_baseline:
+            baseline[name] = {'nodes': nodes, 'pods_per_node': pods_per_node, 'minutes': minutes, 'step': config.STEP,
+                              'stages': stages}
+        else:
+            regressions.extend((name,) + regression
+                               for regression in find_regressions(stages, shape_baseline, args.tolerance))
+    if args.update_baseline:
+        write_baseline(args.baseline, baseline)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+    for name, stage, seconds, base in regressions:
+        print(f"REGRESSION {name} {stage}: {seconds:.3f}s, baseline {base:.3f}s")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
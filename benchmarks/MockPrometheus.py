@@ -0,0 +1,224 @@
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import config
+from benchmarks.SyntheticCluster import SyntheticCluster
+from data_providers.QueryRecording import QueryReplay
+
+# minutes of synthetic usage after the start of the server, so that runs started later still find their whole window
+SYNTHETIC_HEADROOM_MINUTES = 60
+
+
+def _format_sample_value(value):
+    # prometheus sends sample values as strings
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _format_timestamp(timestamp):
+    return int(timestamp) if float(timestamp).is_integer() else timestamp
+
+
+def _format_range_result(res):
+    # the backends may hold the samples as (samples x 2) float arrays, prometheus sends [timestamp, "value"] pairs
+    formatted = []
+    for _data in res:
+        values = _data['values']
+        if isinstance(values, np.ndarray):
+            values = [[_format_timestamp(t), _format_sample_value(v)] for t, v in values.tolist()]
+        formatted.append({'metric': _data['metric'], 'values': values})
+    return formatted
+
+
+def _parse_step(step):
+    # the query executor sends whole seconds, recordings are keyed by the step as it was sent
+    step = float(step)
+    return int(step) if step.is_integer() else step
+
+
+class MockPrometheusServer:
+    """
+    Serves /api/v1/query_range and /api/v1/query on http://host:port like prometheus does, answered by backend: a
+    SyntheticCluster, a QueryReplay or anything else with the custom_query_range and custom_query methods of a
+    PrometheusConnect. Point a PrometheusConnect (main.get_prometheus_client) at url to run the real fetch path without
+    prometheus.
+
+    Every response is delayed by latency seconds plus its size over bytes_per_second, if given. padding_bytes of
+    incompressible filler are added to every response to make it larger on the wire without changing its result, and
+    failure_rate of the requests are answered with failure_status instead, which the prometheus client retries.
+    Responses are gzip compressed when the client accepts it.
+    """
+
+    def __init__(self, backend, logger, port=0, host='127.0.0.1', latency=0.0, bytes_per_second=None,
+                 padding_bytes=0, failure_rate=0.0, failure_status=503, seed=0):
+        self.backend = backend
+        self.logger = logger
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.padding = base64.b64encode(os.urandom(padding_bytes))[:padding_bytes].decode() if padding_bytes else None
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, the prometheus session pools its connections
+            protocol_version = 'HTTP/1.1'
+
+            def _params(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if self.command == 'POST':
+                    length = int(self.headers.get('Content-Length', 0))
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+                return url.path, {key: values[-1] for key, values in params.items()}
+
+            def _answer(self):
+                path, params = self._params()
+                status, body = mock.handle(path, params)
+                mock.delay(len(body))
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_response(status)
+                    self.send_header('Content-Encoding', 'gzip')
+                else:
+                    self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._answer()
+
+            def do_POST(self):
+                self._answer()
+
+            def log_message(self, format, *args):
+                mock.logger.debug("mock prometheus: " + format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-prometheus", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _fails(self):
+        with self._lock:
+            self.requests += 1
+            failed = self.failure_rate > 0 and self._random.random() < self.failure_rate
+            self.failures += failed
+            return failed
+
+    def _response(self, status, body):
+        if self.padding is not None:
+            body['padding'] = self.padding
+        return status, json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+    def handle(self, path, params):
+        # (http status, json body) of a request to path
+        if path not in ('/api/v1/query_range', '/api/v1/query'):
+            return self._response(404, {'status': 'error', 'errorType': 'not_found', 'error': f"unknown path {path}"})
+        if self._fails():
+            return self._response(self.failure_status, {'status': 'error', 'errorType': 'unavailable',
+                                                        'error': "injected failure"})
+        try:
+            if path == '/api/v1/query_range':
+                res = _format_range_result(self.backend.custom_query_range(
+                    query=params['query'],
+                    start_time=datetime.datetime.fromtimestamp(float(params['start'])),
+                    end_time=datetime.datetime.fromtimestamp(float(params['end'])),
+                    step=_parse_step(params['step'])))
+                result_type = 'matrix'
+            else:
+                time_params = {'time': float(params['time'])} if 'time' in params else None
+                res = self.backend.custom_query(query=params['query'], params=time_params)
+                result_type = 'vector'
+        except (KeyError, ValueError, LookupError) as e:
+            return self._response(400, {'status': 'error', 'errorType': 'bad_data', 'error': str(e)})
+        return self._response(200, {'status': 'success', 'data': {'resultType': result_type, 'result': res}})
+
+    def delay(self, n_bytes):
+        delay = self.latency
+        if self.bytes_per_second:
+            delay += n_bytes / self.bytes_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self):
+        self._thread.start()
+        self.logger.info(f"Serving mock prometheus on {self.url}")
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the prometheus query api from a synthetic cluster or from a "
+                                                 "recording, e.g. to run main.py --prometheus-url against it")
+    parser.add_argument('--port', type=int, default=9090, help="port to listen on, 9090 by default")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on, 127.0.0.1 by default")
+    parser.add_argument('--replay', metavar='RECORDING_DIR',
+                        help="answer from the responses recorded with main.py --record instead of a synthetic "
+                             "cluster, only the recorded window can be queried")
+    parser.add_argument('--nodes', type=int, default=100, help="nodes of the synthetic cluster, 100 by default")
+    parser.add_argument('--pods-per-node', type=int, default=50, help="pods per node, 50 by default")
+    parser.add_argument('--minutes', type=int, default=config.TIMEDELTA,
+                        help=f"minutes of synthetic usage before the server starts, {config.TIMEDELTA} by default")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every response is delayed by")
+    parser.add_argument('--bandwidth', type=float, metavar='MB_PER_SECOND',
+                        help="additionally delay every response by its size over this bandwidth")
+    parser.add_argument('--padding-bytes', type=int, default=0, help="filler bytes added to every response")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="fraction of the requests answered with --failure-status")
+    parser.add_argument('--failure-status', type=int, default=503, help="http status of the failed requests")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic cluster and of the failures")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('mock-prometheus')
+
+    if args.replay:
+        backend = QueryReplay(args.replay)
+    else:
+        now = datetime.datetime.now()
+        backend = SyntheticCluster(args.nodes, args.pods_per_node, args.minutes + SYNTHETIC_HEADROOM_MINUTES,
+                                   config.STEP, now + datetime.timedelta(minutes=SYNTHETIC_HEADROOM_MINUTES),
+                                   seed=args.seed)
+    logger.info(f"Answering queries from {backend.start_time} to {backend.end_time}")
+    server = MockPrometheusServer(backend, logger, args.port, args.host, args.latency,
+                                  None if args.bandwidth is None else args.bandwidth * 1E6, args.padding_bytes,
+                                  args.failure_rate, args.failure_status, args.seed)
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logger.info(f"{server.requests} requests, {server.failures} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import datetime
+import re
+
+import numpy as np
+
+# instance types of the synthetic nodes -> (cpu cores, memory GiB, EBS baseline bandwidth in Mbps)
+INSTANCE_TYPES = {
+    'm5.2xlarge': (8, 32, 2880),
+    'm5.4xlarge': (16, 64, 4750),
+    'r5.2xlarge': (8, 64, 2880),
+    'c5.4xlarge': (16, 32, 4750),
+}
+
+# usage metrics of the node and pod queries, matched on the metric name in the query
+NODE_USAGE_METRICS = {
+    'node_cpu_seconds_total': 'cpu_usage',
+    'node_memory_MemTotal_bytes': 'memory_usage',
+    'node_network_receive_bytes_total': 'network_rx_bytes',
+    'node_network_transmit_bytes_total': 'network_tx_bytes',
+    'node_disk_written_bytes_total': 'disk_total_bytes',
+}
+POD_USAGE_METRICS = {
+    'container_cpu_usage_seconds_total': 'cpu_usage',
+    'container_memory_usage_bytes': 'memory_usage',
+    'container_network_receive_bytes_total': 'network_rx_bytes',
+    'container_network_transmit_bytes_total': 'network_tx_bytes',
+    'container_fs_reads_bytes_total': 'disk_total_bytes',
+}
+USAGE_METRICS = ('cpu_usage', 'memory_usage', 'network_rx_bytes', 'network_tx_bytes', 'disk_total_bytes')
+
+# instant queries of the static attributes, see NodeDataProvider._instant_static_queries
+INSTANT_QUERY = re.compile(r"^(last_over_time|changes)\(\((.*)\)\[[^\]]*\]\)$", re.DOTALL)
+NODE_NAME_FILTER = re.compile(r"nodename=~'([^']*)'")
+
+
+class SyntheticEC2:
+    """Answers DescribeInstanceTypes for the INSTANCE_TYPES of a synthetic cluster."""
+
+    def describe_instance_types(self, InstanceTypes, **kwargs):
+        return {'InstanceTypes': [{'InstanceType': instance_type,
+                                   'EbsInfo': {'EbsOptimizedInfo': {
+                                       'BaselineBandwidthInMbps': INSTANCE_TYPES[instance_type][2]}}}
+                                  for instance_type in InstanceTypes if instance_type in INSTANCE_TYPES]}
+
+
+class SyntheticCluster:
+    """
+    A generated cluster of nodes x pods_per_node pods with minutes of usage at step resolution that answers the range
+    and instant queries of the node and pod data providers in place of a PrometheusConnect. Every query result is
+    computed from usage matrices generated up front, the same seed gives the same cluster.
+
+    Pods use a fraction of their node that varies over the day with some noise, and a share of the pods only starts
+    part way into the window. On hot_node_fraction of the nodes, hot_windows windows of high usage are injected: for
+    each window one pod of the node uses most of the node's cpu and memory and a multiple of its usual network and
+    disk bandwidth, so the node flaggers flag the node and the culprit analysis finds the pod.
+
+    Range results hold their samples as (samples x 2) float arrays, like the merged results of the query executor.
+    """
+
+    def __init__(self, nodes=100, pods_per_node=50, minutes=30, step=30, end_time=None, hot_node_fraction=0.1,
+                 hot_windows=2, seed=0):
+        self.step = step
+        self.end_time = end_time if end_time is not None else datetime.datetime(2026, 1, 1)
+        self.start_time = self.end_time - datetime.timedelta(minutes=minutes)
+        self.timestamps = np.arange(round(self.start_time.timestamp()), round(self.end_time.timestamp()) + 1, step,
+                                    dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        self._generate_nodes(rng, nodes)
+        self._generate_pods(rng, pods_per_node)
+        self._generate_usage(rng, hot_node_fraction, hot_windows)
+
+    def _generate_nodes(self, rng, nodes):
+        self.node_names = [f"ip-10-{i // 65536}-{i // 256 % 256}-{i % 256}" for i in range(nodes)]
+        self.node_instances = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}:9100" for i in range(nodes)]
+        types = list(INSTANCE_TYPES)
+        self.instance_types = [types[i] for i in rng.integers(0, len(types), nodes)]
+        self.cpu_capacity = np.array([INSTANCE_TYPES[t][0] for t in self.instance_types], dtype=float)
+        # the memory queries are in MB
+        memory_gib = np.array([INSTANCE_TYPES[t][1] for t in self.instance_types], dtype=float)
+        self.memory_capacity = memory_gib * 2 ** 30 / 1E6
+
+    def _generate_pods(self, rng, pods_per_node):
+        n_pods = len(self.node_names) * pods_per_node
+        self.pod_nodes = np.repeat(np.arange(len(self.node_names)), pods_per_node)
+        self.pod_namespaces = [f"namespace-{i % 20}" for i in range(n_pods)]
+        self.pod_names = [f"app-{i % 20}-{i}" for i in range(n_pods)]
+        # typical usage of every pod, the cpu and memory of a node are about a third used on average
+        share = rng.lognormal(0, 0.5, n_pods) / max(pods_per_node, 1)
+        self.pod_base = {
+            'cpu_usage': self.cpu_capacity[self.pod_nodes] * 0.3 * share,
+            'memory_usage': self.memory_capacity[self.pod_nodes] * 0.4 * share,
+            'network_rx_bytes': rng.lognormal(np.log(0.5), 1, n_pods),
+            'network_tx_bytes': rng.lognormal(np.log(0.5), 1, n_pods),
+            'disk_total_bytes': rng.lognormal(np.log(0.2), 1, n_pods),
+        }
+        # requests are off from the usage by a random factor, so some of them are flagged
+        self.cpu_request = np.maximum(np.round(self.pod_base['cpu_usage'] * rng.uniform(0.5, 3, n_pods), 2), 0.01)
+        self.memory_request = np.round(self.pod_base['memory_usage'] * rng.uniform(0.8, 2.5, n_pods))
+        # a tenth of the pods has no limits
+        self.has_limits = rng.random(n_pods) >= 0.1
+
+    def _generate_usage(self, rng, hot_node_fraction, hot_windows):
+        n_pods = len(self.pod_names)
+        n_samples = len(self.timestamps)
+        day_phase = 2 * np.pi * (self.timestamps % 86400) / 86400
+        # five percent of the pods start within the window
+        first_sample = np.where(rng.random(n_pods) < 0.05, rng.integers(0, n_samples, n_pods), 0)
+        missing = np.arange(n_samples)[None, :] < first_sample[:, None]
+
+        hot_nodes = rng.choice(len(self.node_names), round(hot_node_fraction * len(self.node_names)), replace=False)
+        hot = []
+        for node in hot_nodes:
+            pods = np.flatnonzero(self.pod_nodes == node)
+            for _ in range(hot_windows if len(pods) else 0):
+                length = int(rng.integers(1, max(2, min(n_samples, 30))))
+                start = int(rng.integers(0, max(1, n_samples - length)))
+                hot.append((node, int(rng.choice(pods)), start, start + length))
+
+        self.pod_usage = {}
+        self.node_usage = {}
+        for metric in USAGE_METRICS:
+            base = self.pod_base[metric]
+            usage = base[:, None] * (1 + 0.3 * np.sin(day_phase[None, :] + rng.uniform(0, 2 * np.pi, n_pods)[:, None]))
+            usage += rng.normal(0, 0.05, (n_pods, n_samples)) * base[:, None]
+            np.maximum(usage, 0, out=usage)
+            for node, pod, start, end in hot:
+                if metric == 'cpu_usage':
+                    usage[pod, start:end] += 0.6 * self.cpu_capacity[node]
+                elif metric == 'memory_usage':
+                    usage[pod, start:end] += 0.5 * self.memory_capacity[node]
+                else:
+                    usage[pod, start:end] += 20 * base[pod]
+            usage[missing] = np.nan
+            # the node uses what its pods use and a little for the system
+            node_usage = np.zeros((len(self.node_names), n_samples))
+            np.add.at(node_usage, self.pod_nodes, np.nan_to_num(usage))
+            if metric == 'cpu_usage':
+                node_usage += 0.05 * self.cpu_capacity[:, None]
+            elif metric == 'memory_usage':
+                node_usage += 0.1 * self.memory_capacity[:, None]
+            self.pod_usage[metric] = usage
+            self.node_usage[metric] = node_usage
+        self.hot_windows = hot
+
+    def _node_labels(self, node, joined):
+        if joined:
+            return {'instance': self.node_instances[node], 'nodename': self.node_names[node]}
+        return {'instance': self.node_instances[node]}
+
+    def _static_series(self, query):
+        # (labels, value) of every series of a static attribute query, None if query is not one
+        if 'kube_node_status_capacity' in query:
+            capacity = self.cpu_capacity if "resource='cpu'" in query else self.memory_capacity
+            return [({'node': name + '.ec2.internal'}, capacity[i]) for i, name in enumerate(self.node_names)]
+        if 'kube_node_labels' in query:
+            return [({'node': name + '.ec2.internal', 'label_node_kubernetes_io_instance_type': self.instance_types[i]},
+                     1.0) for i, name in enumerate(self.node_names)]
+        if 'kube_pod_container_resource_' in query:
+            values = self.cpu_request if "resource='cpu'" in query else self.memory_request
+            with_value = np.ones(len(values), dtype=bool)
+            if 'kube_pod_container_resource_limits' in query:
+                values = values * 2
+                with_value = self.has_limits
+            return [({'namespace': self.pod_namespaces[i], 'pod': self.pod_names[i],
+                      'node': self.node_names[self.pod_nodes[i]] + '.ec2.internal'}, values[i])
+                    for i in np.flatnonzero(with_value)]
+        if query.strip() == 'node_uname_info':
+            return [(self._node_labels(i, True), 1.0) for i in range(len(self.node_names))]
+        return None
+
+    def _usage_series(self, query):
+        # (labels, row of the usage matrix) of every series of a usage query, None if query is not one
+        for metric_name, metric in NODE_USAGE_METRICS.items():
+            if metric_name in query:
+                joined = 'node_uname_info' in query
+                nodes = range(len(self.node_names))
+                node_filter = NODE_NAME_FILTER.search(query)
+                if node_filter is not None:
+                    names = set(node_filter.group(1).replace('\\\\.', '.').split('|'))
+                    nodes = [i for i in nodes if self.node_names[i] in names]
+                return [(self._node_labels(i, joined), self.node_usage[metric][i]) for i in nodes]
+        for metric_name, metric in POD_USAGE_METRICS.items():
+            if metric_name in query:
+                usage = self.pod_usage[metric]
+                return [({'namespace': self.pod_namespaces[i], 'pod': self.pod_names[i],
+                          'instance': self.node_names[self.pod_nodes[i]] + '.ec2.internal'}, usage[i])
+                        for i in range(len(self.pod_names))]
+        return None
+
+    def _evaluation_columns(self, start_time, end_time, step):
+        # like prometheus, a range query is evaluated at start + k * step of the request, whole seconds as sent by
+        # PrometheusConnect. Each evaluation time takes the last generated sample at or before it, times before the
+        # first or after the last generated sample have none
+        timestamps = np.arange(round(start_time.timestamp()), round(end_time.timestamp()) + 1, step, dtype=np.int64)
+        columns = (timestamps - self.timestamps[0]) // self.step
+        covered = (columns >= 0) & (columns < len(self.timestamps))
+        return timestamps[covered].astype(float), columns[covered]
+
+    def custom_query_range(self, query, start_time, end_time, step, params=None):
+        if int(step) != self.step:
+            raise ValueError(f"The synthetic cluster has samples every {self.step}s, not every {step}s")
+        timestamps, columns = self._evaluation_columns(start_time, end_time, int(step))
+        static = self._static_series(query)
+        if static is not None:
+            return [{'metric': labels, 'values': np.column_stack((timestamps, np.full(len(timestamps), value)))}
+                    for labels, value in static if len(timestamps)]
+        usage = self._usage_series(query)
+        if usage is None:
+            raise ValueError(f"Query not supported by the synthetic cluster: {query}")
+        res = []
+        for labels, row in usage:
+            values = np.column_stack((timestamps, row[columns]))
+            values = values[~np.isnan(values[:, 1])]
+            if len(values):
+                res.append({'metric': labels, 'values': values})
+        return res
+
+    def custom_query(self, query, params=None):
+        # only the last_over_time and changes queries of the static attributes, their values never change
+        time = float((params or {}).get('time', self.end_time.timestamp()))
+        match = INSTANT_QUERY.match(query)
+        static = self._static_series(match.group(2)) if match is not None else None
+        if static is None:
+            raise ValueError(f"Query not supported by the synthetic cluster: {query}")
+        if match.group(1) == 'changes':
+            return [{'metric': labels, 'value': [time, '0']} for labels, _ in static]
+        return [{'metric': labels, 'value': [time, repr(float(value))]} for labels, value in static]
@@ -0,0 +1,60 @@
+import datetime
+import logging
+
+import numpy as np
+
+import config
+from benchmarks.MockPrometheus import MockPrometheusServer
+from benchmarks.SyntheticCluster import SyntheticCluster, SyntheticEC2
+from data_providers.InstanceCatalog import InstanceCatalog
+from data_providers.NodeDataProvider import NodeDataProvider
+from data_providers.QueryExecutor import QueryExecutor
+from main import get_prometheus_client
+
+logger = logging.getLogger(__name__)
+
+STEP = 30
+
+
+def _node_data_provider(prometheus_api, start_time, end_time, tmp_path):
+    ec2_client = SyntheticEC2()
+    instance_catalog = InstanceCatalog(ec2_client, logger, cache_file=str(tmp_path / 'catalog.json'))
+    return NodeDataProvider(prometheus_api, ec2_client, start_time, end_time, STEP, config.RATE_DELTA, logger,
+                            None, QueryExecutor(prometheus_api, logger), False, instance_catalog)
+
+
+def test_range_queries_are_evaluated_on_the_requested_grid():
+    cluster = SyntheticCluster(2, 2, 30, STEP)
+    start_time = cluster.start_time + datetime.timedelta(seconds=23)
+    end_time = cluster.end_time - datetime.timedelta(seconds=7)
+    res = cluster.custom_query_range('node_cpu_seconds_total', start_time, end_time, STEP)
+    timestamps = res[0]['values'][:, 0]
+    assert timestamps[0] == round(start_time.timestamp())
+    assert np.all(np.diff(timestamps) == STEP)
+    # every evaluation time takes the last generated sample at or before it
+    assert np.array_equal(res[0]['values'][:, 1], cluster.node_usage['cpu_usage'][0][:len(timestamps)])
+
+    # times outside of the generated samples have none
+    before = cluster.start_time - datetime.timedelta(minutes=10)
+    res = cluster.custom_query_range('node_cpu_seconds_total', before, before + datetime.timedelta(minutes=5), STEP)
+    assert res == []
+
+
+def test_unaligned_window_over_http_fills_the_store(tmp_path):
+    cluster = SyntheticCluster(4, 3, 30, STEP)
+    server = MockPrometheusServer(cluster, logger)
+    server.start()
+    try:
+        prometheus_api = get_prometheus_client(server.url, 2, 10)
+        # a window that is not on the grid the cluster was generated on, like the one of a default main.py run
+        start_time = cluster.start_time + datetime.timedelta(seconds=23)
+        end_time = cluster.end_time - datetime.timedelta(minutes=1, seconds=7)
+        provider = _node_data_provider(prometheus_api, start_time, end_time, tmp_path)
+        node_data = provider.get_data()
+        provider.query_executor.shutdown()
+    finally:
+        server.shutdown()
+    assert len(node_data) == 4
+    matrix = provider.metric_store.matrix('cpu_usage')
+    assert matrix is not None
+    assert np.count_nonzero(~np.isnan(matrix)) == 4 * len(provider.metric_store.timestamps)
@@ -10,6 +10,30 @@ RATE_DELTA = 5
 
 # minimum duration between two timestamps in seconds
 STEP = 30
+# maximum number of prometheus queries in flight at the same time
+MAX_CONCURRENT_QUERIES = 8
+# range queries longer than this many steps are split into parallel sub range queries
+# prometheus rejects queries with more than 11000 points per series
+MAX_POINTS_PER_QUERY = 11000
+# timeout in seconds for a single prometheus http request, None waits forever
+PROMETHEUS_QUERY_TIMEOUT = 120
+# fetch requests, limits, capacity and labels with instant queries instead of range queries, both read the last value
+# in the window
+INSTANT_STATIC_QUERIES = True
+# directory of the on disk range query cache, None disables the cache
+# with the cache enabled the analysed window is aligned to STEP so that consecutive runs share cached samples
+QUERY_CACHE_DIR = None
+QUERY_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# fetch the node usage series per instance and join them to their node names (node_uname_info) in the client instead of
+# in every usage query, the instance -> node name mapping is fetched once and only again for instances not seen before
+LOCAL_NODE_NAME_JOIN = False
+# compute node usage summaries (avg, median, 95/99%tile, max and threshold exceedances) in prometheus and only fetch the
+# raw node series of flagged nodes, for culprit analysis. The analysed window is aligned to STEP. Not used in daemon mode
+NODE_USAGE_SUMMARIES_IN_PROMETHEUS = False
+# seconds between two reports in daemon mode (main.py --daemon), rounded down to a multiple of STEP
+DAEMON_INTERVAL = 60
+# port of the /metrics endpoint in exporter mode (main.py --exporter)
+EXPORTER_PORT = 9188
 # Multiplication factor of stdev used to calculate expected cpu and memory request
 # expected request = avg usage + POD_REQUEST_MARGIN_FACTOR*stdev usage
 POD_REQUEST_MARGIN_FACTOR = 1
@@ -36,8 +60,18 @@ NODE_DISK_TOTAL_BYTES_PROB_LIMIT = 0.005
 
 MIN_WINDOW_DIFF = 300  # Minimum difference between two consecutive time windows of high usage in seconds
 MAX_WINDOW_SIZE = 30  # 30 min
+CULPRITS_PER_WINDOW = 1  # Pods reported per high usage window for each of highest avg, max and median usage
 
 NETWORK_BANDWIDTH_FILE_PATH = 'data_providers/network_bandwidths'  # Path to file containing
+# file the looked up ec2 instance types (ebs and network bandwidths) are kept in between runs, None keeps them in memory
+INSTANCE_CATALOG_FILE = './instance_catalog.json'
+# seconds after which an instance type is looked up in ec2 again
+INSTANCE_CATALOG_TTL = 7 * 24 * 3600
 OUTPUT_FILE_PATH = './report.xlsx'
+# format of the report, one of xlsx, csv, parquet or arrow (Arrow IPC). Except for xlsx every sheet is written to its own
+# file, in a directory named like OUTPUT_FILE_PATH without the extension. parquet and arrow need pyarrow installed
+REPORT_FORMAT = 'xlsx'
+# number of reports computed in parallel, their sheets are written in a fixed order once they are done
+REPORT_WORKERS = 5
 
 LOG_FILE_PATH = "./logs.log"
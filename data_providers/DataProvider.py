@@ -0,0 +1,93 @@
+import datetime
+
+from data_providers.MetricStore import MetricStore
+from data_providers.QueryExecutor import QueryExecutor
+from data_providers.utils import subquery_range, series_changed, instant_as_range_result, settle_margin
+from profiling import profiled
+
+
+class DataProvider:
+    """
+    Window, metric store and static attribute queries shared by the node and the pod data provider. Subclasses define
+    STATIC_ATTRIBUTES, _get_queries() and update_data(), which rebuilds the entities of the window from the queries.
+    """
+    # queries of attributes that are not expected to change within the window, mapped to the entity attribute whose
+    # changes are recorded in changed_attributes
+    STATIC_ATTRIBUTES = {}
+
+    def __init__(self, prometheus_api, start_time, end_time, step, rate_delta, logger, query_executor=None,
+                 instant_static_queries=False, query_names=None):
+        self.prometheus_api = prometheus_api
+        self.start_time = start_time
+        self.end_time = end_time
+        self.step = step
+        self.rate_delta = rate_delta
+        self.logger = logger
+        self.query_executor = query_executor if query_executor is not None else QueryExecutor(prometheus_api, logger)
+        self.instant_static_queries = instant_static_queries
+        # with query_names only those queries are fetched, see reports.ReportPlanner
+        self.queries = self._get_queries()
+        if query_names is not None:
+            self.queries = {name: query for name, query in self.queries.items() if name in query_names}
+        self.metric_store = MetricStore.from_time_range(start_time, end_time, step)
+        # usage series are fetched from fetch_start_time, which moves past start_time once the window is advanced
+        self.fetch_start_time = start_time
+        self._live_entities = 0
+
+    def _get_queries(self):
+        raise NotImplementedError
+
+    def update_data(self):
+        raise NotImplementedError
+
+    @profiled('provider')
+    def get_data(self):
+        self.metric_store = MetricStore.from_time_range(self.start_time, self.end_time, self.step)
+        self.fetch_start_time = self.start_time
+        return self.update_data()
+
+    @profiled('provider')
+    def advance(self, steps):
+        # slide the window forward by steps, update_data() then only fetches the usage of the new steps
+        # and of the last steps before them, whose samples may have changed since they were fetched
+        old_end_time = self.end_time
+        self.start_time += datetime.timedelta(seconds=steps * self.step)
+        self.end_time += datetime.timedelta(seconds=steps * self.step)
+        if len(self.metric_store.entities) > 2 * max(self._live_entities, 1):
+            # most rows belong to entities that left the window, start over with a compact store
+            self.metric_store = MetricStore.from_time_range(self.start_time, self.end_time, self.step)
+            self.fetch_start_time = self.start_time
+            return
+        self.metric_store.advance(steps)
+        self.fetch_start_time = max(self.start_time, old_end_time - settle_margin(self.step, self.rate_delta))
+
+    def _store_samples(self, metric, row, samples):
+        # a full fetch replaces the series, after advance() only the newly fetched steps are written
+        if self.fetch_start_time == self.start_time:
+            self.metric_store.set_samples(metric, row, samples)
+        else:
+            self.metric_store.update_samples(metric, row, samples)
+
+    def _instant_static_queries(self, name):
+        # last value and number of value changes over the whole window, so series that ended before end_time are
+        # still found while only one sample per series is transferred
+        window = subquery_range(self.start_time, self.end_time, self.step)
+        value_query = f"last_over_time(({self.queries[name]}){window})"
+        changes_query = None
+        if self.STATIC_ATTRIBUTES[name] is not None:
+            changes_query = f"changes(({self.queries[name]}){window})"
+        return value_query, changes_query
+
+    def _prometheus_static_query(self, name):
+        # the getters read the last sample of every series, the value at the end of the window in both modes
+        if not self.instant_static_queries:
+            # static attributes always cover the whole window, an entity whose series ended before the newly
+            # fetched steps is still part of the window
+            res = self.query_executor.query_range(self.queries[name], self.start_time, self.end_time, self.step)
+            for _data in res:
+                _data['changed'] = series_changed(_data['values'])
+            return res
+        value_query, changes_query = self._instant_static_queries(name)
+        value_res = self.query_executor.query_instant(value_query, self.end_time)
+        changes_res = [] if changes_query is None else self.query_executor.query_instant(changes_query, self.end_time)
+        return instant_as_range_result(value_res, changes_res)
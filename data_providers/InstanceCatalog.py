@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import time
+
+from botocore.exceptions import ClientError
+
+from data_providers.utils import Gb_to_MB
+
+# DescribeInstanceTypes accepts at most 100 instance types per call
+MAX_INSTANCE_TYPES_PER_CALL = 100
+# error code of DescribeInstanceTypes for instance types EC2 does not know
+INVALID_INSTANCE_TYPE = 'InvalidInstanceType'
+
+
+class InstanceCatalog:
+    """
+    Network and EBS baseline bandwidths per EC2 instance type. Network bandwidths come from the network_bandwidths
+    file, EBS bandwidths (and network bandwidths of types missing from the file) from DescribeInstanceTypes. Types are
+    looked up in batches, every looked up type is remembered together with the time it was fetched, and the catalog
+    is persisted to cache_file so that runs only call EC2 for new types or for entries older than ttl_seconds.
+
+    Lookups are dict lookups, call ensure() with the instance types in use before reading bandwidths.
+    """
+
+    def __init__(self, ec2_client, logger, network_bandwidth_file=None, cache_file=None, ttl_seconds=7 * 24 * 3600):
+        self.ec2_client = ec2_client
+        self.logger = logger
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self.network_bandwidths = self._read_network_bandwidth_file(network_bandwidth_file)
+        # instance type -> {'fetched_at', 'ebs_baseline_bandwidth', 'network_bandwidth'}, bandwidths may be None
+        self.instance_types = self._load()
+
+    def _read_network_bandwidth_file(self, path):
+        bandwidth_map = {}
+        if path is None:
+            return bandwidth_map
+        try:
+            with open(path, 'r') as file:
+                file.readline()
+                for line in file:
+                    data = line.split(sep=',')
+                    if len(data) < 2:
+                        continue
+                    bandwidth_map[data[0]] = Gb_to_MB(float(data[1]))
+        except Exception as e:
+            self.logger.error(f"Error reading network bandwidth file {path}", e)
+        return bandwidth_map
+
+    def _load(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r') as file:
+                return json.load(file)
+        except Exception as e:
+            self.logger.error(f"Error reading instance catalog {self.cache_file}", e)
+            return {}
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(self.instance_types, file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.cache_file)
+        except Exception as e:
+            self.logger.error(f"Error writing instance catalog {self.cache_file}", e)
+
+    def _is_fresh(self, instance_type, now):
+        entry = self.instance_types.get(instance_type)
+        return entry is not None and now - entry['fetched_at'] < self.ttl_seconds
+
+    def ensure(self, instance_types):
+        # look up the instance types that are not in the catalog or whose entry expired
+        now = time.time()
+        missing = sorted({t for t in instance_types if t is not None and not self._is_fresh(t, now)})
+        if not missing:
+            return
+        self.logger.info(f"Looking up {len(missing)} instance types in EC2")
+        stored = False
+        for i in range(0, len(missing), MAX_INSTANCE_TYPES_PER_CALL):
+            stored |= self._fetch(missing[i:i + MAX_INSTANCE_TYPES_PER_CALL], now)
+        if stored:
+            self._save()
+
+    def _fetch(self, instance_types, now):
+        # True if any of the instance types was stored in the catalog
+        try:
+            found = self._describe_instance_types(instance_types)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != INVALID_INSTANCE_TYPE:
+                # throttling, expired credentials, ... leave the types uncached so that the next run asks again
+                self.logger.error(f"Error getting instance types {', '.join(instance_types)}: {e}")
+                return False
+            if len(instance_types) > 1:
+                # one invalid type fails the whole call, look the batch up one type at a time
+                stored = False
+                for instance_type in instance_types:
+                    stored |= self._fetch([instance_type], now)
+                return stored
+            # unknown to EC2, remember that until the entry expires instead of asking on every run
+            self.logger.error(f"Error getting instance type {instance_types[0]}: {e}")
+            found = {}
+        except Exception as e:
+            # network errors, leave the types uncached so that the next run asks again
+            self.logger.error(f"Error getting instance types {', '.join(instance_types)}: {e}")
+            return False
+        for instance_type in instance_types:
+            entry = found.get(instance_type, {'ebs_baseline_bandwidth': None, 'network_bandwidth': None})
+            entry['fetched_at'] = now
+            self.instance_types[instance_type] = entry
+        return True
+
+    def _describe_instance_types(self, instance_types):
+        found = {}
+        kwargs = {'InstanceTypes': instance_types}
+        while True:
+            res = self.ec2_client.describe_instance_types(**kwargs)
+            for e in res['InstanceTypes']:
+                ebs_bandwidth = None
+                if 'EbsInfo' in e and 'EbsOptimizedInfo' in e['EbsInfo']:
+                    ebs_bandwidth = e['EbsInfo']['EbsOptimizedInfo']['BaselineBandwidthInMbps']
+                network_bandwidth = None
+                network_cards = e.get('NetworkInfo', {}).get('NetworkCards', [])
+                if network_cards and 'BaselineBandwidthInGbps' in network_cards[0]:
+                    network_bandwidth = Gb_to_MB(float(network_cards[0]['BaselineBandwidthInGbps']))
+                found[e['InstanceType']] = {'ebs_baseline_bandwidth': ebs_bandwidth,
+                                            'network_bandwidth': network_bandwidth}
+            if not res.get('NextToken'):
+                return found
+            kwargs['NextToken'] = res['NextToken']
+
+    def ebs_baseline_bandwidth(self, instance_type):
+        entry = self.instance_types.get(instance_type)
+        return None if entry is None else entry['ebs_baseline_bandwidth']
+
+    def network_bandwidth(self, instance_type):
+        # the network_bandwidths file takes precedence over EC2
+        if instance_type in self.network_bandwidths:
+            return self.network_bandwidths[instance_type]
+        entry = self.instance_types.get(instance_type)
+        return None if entry is None else entry['network_bandwidth']
@@ -0,0 +1,316 @@
+import numpy as np
+import pandas as pd
+
+
+class MetricSeries:
+    """
+    Read only view of the samples of one metric of one entity. It is indexed like the two column frames the data
+    classes used to hold: series['timestamp'] and series['values'] return pandas Series without copying the samples.
+    """
+    __slots__ = ('timestamps', 'values')
+
+    def __init__(self, timestamps, values):
+        self.timestamps = timestamps
+        self.values = values
+
+    def __getitem__(self, column):
+        if column == 'timestamp':
+            return pd.Series(self.timestamps, copy=False)
+        if column == 'values':
+            return pd.Series(self.values, copy=False)
+        raise KeyError(column)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class SeriesSummary:
+    """
+    Summary statistics of one series. exceedances maps a threshold, as a fraction of the entity's limit, to the number
+    of samples above it.
+    """
+    __slots__ = ('mean', 'median', 'p95', 'p99', 'max', 'count', 'std', 'exceedances')
+
+    def __init__(self, mean=None, median=None, p95=None, p99=None, max=None, count=0, std=None):
+        self.mean = mean
+        self.median = median
+        self.p95 = p95
+        self.p99 = p99
+        self.max = max
+        self.count = count
+        self.std = std
+        self.exceedances = {}
+
+    @classmethod
+    def from_values(cls, values):
+        # all order statistics from one sort, each value equal to what the pandas method of the same name returns
+        n = len(values)
+        if n == 0:
+            return cls(np.nan, np.nan, np.nan, np.nan, np.nan, 0, np.nan)
+        ordered = np.sort(values)
+        median = ordered[n // 2] if n % 2 else np.mean(ordered[n // 2 - 1:n // 2 + 1])
+        p95, p99 = np.percentile(ordered, np.array([0.95, 0.99]) * 100.0)
+        std = np.std(values, ddof=1) if n > 1 else np.nan
+        return cls(np.mean(values), median, p95, p99, ordered[-1], n, std)
+
+
+class _WindowStats:
+    """Running per entity count, sum, sum of squares and threshold exceedances of the samples of one metric."""
+
+    def __init__(self, n_rows):
+        self.count = np.zeros(n_rows)
+        self.sum = np.zeros(n_rows)
+        self.sum_sq = np.zeros(n_rows)
+        self.thresholds = None
+        self.exceed = None
+
+    def grow(self, extra):
+        self.count = np.concatenate([self.count, np.zeros(extra)])
+        self.sum = np.concatenate([self.sum, np.zeros(extra)])
+        self.sum_sq = np.concatenate([self.sum_sq, np.zeros(extra)])
+        if self.thresholds is not None:
+            self.thresholds = np.concatenate([self.thresholds, np.full(extra, np.nan)])
+            self.exceed = np.concatenate([self.exceed, np.zeros(extra)])
+
+    def add(self, rows, values, sign):
+        # add (sign=1) or remove (sign=-1) the samples in values, a rows x samples block of the matrix
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        self.count[rows] += sign * valid.sum(axis=1)
+        self.sum[rows] += sign * filled.sum(axis=1)
+        self.sum_sq[rows] += sign * (filled * filled).sum(axis=1)
+        if self.thresholds is not None:
+            self.exceed[rows] += sign * (values > self.thresholds[rows, None]).sum(axis=1)
+
+
+class MetricStore:
+    """
+    Columnar store for the usage series of a group of entities (all nodes or all pods). Every metric is a single float
+    matrix of shape entities x time steps, aligned on one shared timestamp axis and one entity index. Samples that
+    prometheus did not return are NaN.
+
+    The store also keeps running per entity aggregates of every metric (sample count, mean, standard deviation and
+    optionally the number of samples above a per entity threshold). They are updated as samples are written and as
+    advance() slides the window forward, so a long running process never has to rescan the whole window.
+
+    If no timestamp axis is given, the timestamps of the first series added become the axis.
+    """
+
+    def __init__(self, timestamps=None, step=None):
+        self.timestamps = None if timestamps is None else np.asarray(timestamps, dtype=np.int64)
+        self.step = step
+        self.entity_index = {}
+        self.entities = []
+        self._matrices = {}
+        self._present = {}
+        self._stats = {}
+        # metric -> {row: SeriesSummary} of entities whose statistics were computed by prometheus
+        self._summaries = {}
+        # metric -> {row: SeriesSummary} computed from the series, dropped whenever the row is written
+        self._summary_cache = {}
+
+    @classmethod
+    def from_time_range(cls, start_time, end_time, step):
+        start = round(start_time.timestamp())
+        end = round(end_time.timestamp())
+        return cls(np.arange(start, end + 1, step, dtype=np.int64), step)
+
+    def add_entity(self, key):
+        row = self.entity_index.get(key)
+        if row is None:
+            row = len(self.entities)
+            self.entity_index[key] = row
+            self.entities.append(key)
+        return row
+
+    def _ensure_rows(self, metric):
+        n_rows = len(self.entities)
+        matrix = self._matrices.get(metric)
+        if matrix is None:
+            matrix = np.full((n_rows, len(self.timestamps)), np.nan)
+            present = np.zeros(n_rows, dtype=bool)
+            self._stats[metric] = _WindowStats(n_rows)
+        elif matrix.shape[0] < n_rows:
+            # grow geometrically so that adding entities one by one stays amortised O(1)
+            extra = max(n_rows, 2 * matrix.shape[0]) - matrix.shape[0]
+            matrix = np.vstack([matrix, np.full((extra, matrix.shape[1]), np.nan)])
+            present = np.concatenate([self._present[metric], np.zeros(extra, dtype=bool)])
+            self._stats[metric].grow(extra)
+        else:
+            return matrix, self._present[metric]
+        self._matrices[metric] = matrix
+        self._present[metric] = present
+        return matrix, present
+
+    def _columns(self, timestamps, values):
+        # matrix columns of the samples that fall on the timestamp axis
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        if self.timestamps is None:
+            self.timestamps = timestamps.copy()
+        cols = np.searchsorted(self.timestamps, timestamps)
+        on_axis = cols < len(self.timestamps)
+        on_axis[on_axis] = self.timestamps[cols[on_axis]] == timestamps[on_axis]
+        return cols[on_axis], values[on_axis]
+
+    def set_series(self, metric, row, timestamps, values):
+        self._summary_cache.get(metric, {}).pop(row, None)
+        cols, values = self._columns(timestamps, values)
+        matrix, present = self._ensure_rows(metric)
+        stats = self._stats[metric]
+        stats.add([row], matrix[row][None, :], -1)
+        matrix[row, :] = np.nan
+        matrix[row, cols] = values
+        stats.add([row], matrix[row][None, :], 1)
+        present[row] = True
+
+    def update_series(self, metric, row, timestamps, values):
+        # like set_series but only overwrites the given samples, the rest of the row is kept
+        self._summary_cache.get(metric, {}).pop(row, None)
+        cols, values = self._columns(timestamps, values)
+        matrix, present = self._ensure_rows(metric)
+        stats = self._stats[metric]
+        stats.add([row], matrix[row, cols][None, :], -1)
+        matrix[row, cols] = values
+        stats.add([row], values[None, :], 1)
+        present[row] = True
+
+    def set_samples(self, metric, row, samples):
+        # samples is the [[timestamp, 'value'], ...] list of a prometheus range query result
+        samples = np.asarray(samples, dtype=float).reshape(-1, 2)
+        self.set_series(metric, row, samples[:, 0], samples[:, 1])
+
+    def update_samples(self, metric, row, samples):
+        samples = np.asarray(samples, dtype=float).reshape(-1, 2)
+        self.update_series(metric, row, samples[:, 0], samples[:, 1])
+
+    def clear_series(self, metric, row):
+        self._summary_cache.get(metric, {}).pop(row, None)
+        present = self._present.get(metric)
+        if present is not None and row < len(present):
+            matrix = self._matrices[metric]
+            self._stats[metric].add([row], matrix[row][None, :], -1)
+            present[row] = False
+            matrix[row, :] = np.nan
+
+    def advance(self, steps):
+        # slide the window forward by steps, samples that leave the window are dropped from the matrices and the
+        # running aggregates, the new steps start out empty
+        if steps <= 0:
+            return
+        self._summary_cache = {}
+        n_cols = len(self.timestamps)
+        shift = min(steps, n_cols)
+        for metric, matrix in self._matrices.items():
+            self._stats[metric].add(slice(None), matrix[:, :shift], -1)
+            matrix[:, :n_cols - shift] = matrix[:, shift:]
+            matrix[:, n_cols - shift:] = np.nan
+            # entities without any sample left in the window no longer have a series
+            self._present[metric] &= self._stats[metric].count > 0
+        self.timestamps = self.timestamps + steps * self.step
+
+    def track_exceedance(self, metric, thresholds):
+        # keep a running count of the samples above thresholds, one threshold per entity (NaN never exceeds)
+        matrix, _ = self._ensure_rows(metric)
+        stats = self._stats[metric]
+        padded = np.full(matrix.shape[0], np.nan)
+        padded[:len(thresholds)] = thresholds
+        if stats.thresholds is not None and np.array_equal(stats.thresholds, padded, equal_nan=True):
+            return
+        stats.thresholds = padded
+        stats.exceed = (matrix > padded[:, None]).sum(axis=1).astype(float)
+
+    def set_summary(self, metric, row, summary):
+        self._summaries.setdefault(metric, {})[row] = summary
+
+    def get_fetched_summary(self, metric, row):
+        # only the summary computed by prometheus
+        return self._summaries.get(metric, {}).get(row)
+
+    def get_summary(self, metric, row):
+        # summary of the series, the one computed by prometheus if set, otherwise computed once from the samples and
+        # reused until the row is written again
+        summary = self._summaries.get(metric, {}).get(row)
+        if summary is not None:
+            return summary
+        cache = self._summary_cache.setdefault(metric, {})
+        if row not in cache:
+            series = self.get_series(metric, row)
+            cache[row] = None if series is None else SeriesSummary.from_values(series.values)
+        return cache[row]
+
+    def get_series(self, metric, row):
+        present = self._present.get(metric)
+        if present is None or row >= len(present) or not present[row]:
+            return None
+        values = self._matrices[metric][row]
+        mask = ~np.isnan(values)
+        if mask.all():
+            return MetricSeries(self.timestamps, values)
+        return MetricSeries(self.timestamps[mask], values[mask])
+
+    def matrix(self, metric):
+        # entities x time steps view of a metric, rows follow the entity index
+        if metric not in self._matrices:
+            return None
+        matrix, _ = self._ensure_rows(metric)
+        return matrix[:len(self.entities)]
+
+    def present(self, metric):
+        # boolean mask of the entities that have a series for the metric
+        if metric not in self._present:
+            return np.zeros(len(self.entities), dtype=bool)
+        _, present = self._ensure_rows(metric)
+        return present[:len(self.entities)]
+
+    def metrics(self):
+        return list(self._matrices.keys())
+
+    def window_count(self, metric):
+        if metric not in self._matrices:
+            return np.zeros(len(self.entities))
+        self._ensure_rows(metric)
+        return self._stats[metric].count[:len(self.entities)]
+
+    def window_mean(self, metric):
+        count = self.window_count(metric)
+        if metric not in self._matrices:
+            return np.full(len(self.entities), np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # count is exact, the sums may keep a rounding residue after all samples of an entity are removed
+            return np.where(count > 0, self._stats[metric].sum[:len(self.entities)] / count, np.nan)
+
+    def window_std(self, metric):
+        # sample standard deviation (ddof=1) like pandas
+        count = self.window_count(metric)
+        if metric not in self._matrices:
+            return np.full(len(self.entities), np.nan)
+        stats = self._stats[metric]
+        n_rows = len(self.entities)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = (stats.sum_sq[:n_rows] - stats.sum[:n_rows] ** 2 / count) / (count - 1)
+        return np.where(count > 1, np.sqrt(np.maximum(var, 0)), np.nan)
+
+    def exceedance_count(self, metric):
+        if metric not in self._matrices or self._stats[metric].exceed is None:
+            return None
+        self._ensure_rows(metric)
+        return self._stats[metric].exceed[:len(self.entities)]
+
+
+class MetricField:
+    """Attribute of a data class that reads and writes one metric of the entity's row in its MetricStore."""
+
+    def __set_name__(self, owner, name):
+        self.metric = name
+
+    def __get__(self, entity, owner=None):
+        if entity is None:
+            return self
+        return entity.metric_store.get_series(self.metric, entity.row)
+
+    def __set__(self, entity, frame):
+        if frame is None:
+            entity.metric_store.clear_series(self.metric, entity.row)
+        else:
+            entity.metric_store.set_series(self.metric, entity.row, frame['timestamp'], frame['values'])
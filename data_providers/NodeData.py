@@ -1,13 +1,29 @@
+from data_providers.MetricStore import MetricStore, MetricField
+
+# changed_attributes of entities without changes, one shared instance
+NO_CHANGES = frozenset()
+
+
 class NodeData:
-    def __init__(self, node_name):
+    # no per instance __dict__, clusters have thousands of nodes and every refresh rebuilds them
+    __slots__ = ('node_name', 'instance_type', 'cpu_limit', 'memory_limit', 'changed_attributes', 'metric_store', 'row',
+                 'network_bandwidth_limit', 'ebs_baseline_bandwidth')
+
+    cpu_usage = MetricField()
+    memory_usage = MetricField()
+    network_rx_bytes = MetricField()
+    network_tx_bytes = MetricField()
+    disk_total_bytes = MetricField()
+
+    def __init__(self, node_name, metric_store=None):
         self.node_name = node_name
         self.instance_type = None
         self.cpu_limit = None
         self.memory_limit = None
-        self.cpu_usage = None
-        self.memory_usage = None
-        self.network_rx_bytes = None
-        self.network_tx_bytes = None
-        self.disk_total_bytes = None
+        # static attributes whose value changed within the analysed window
+        self.changed_attributes = NO_CHANGES
+        # usage series live in a matrix shared by all nodes, the node only keeps its row
+        self.metric_store = metric_store if metric_store is not None else MetricStore()
+        self.row = self.metric_store.add_entity(node_name)
         self.network_bandwidth_limit = None
         self.ebs_baseline_bandwidth = None
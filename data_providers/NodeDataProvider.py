@@ -1,80 +1,221 @@
-import re
-import pandas as pd
+import threading
 
+from data_providers.DataProvider import DataProvider
+from data_providers.InstanceCatalog import InstanceCatalog
+from data_providers.MetricStore import SeriesSummary
 from data_providers.NodeData import NodeData
-from data_providers.utils import Gb_to_MB
+from data_providers.utils import subquery_range, normalize_node_name
+from profiling import profiled
 
 
-class NodeDataProvider:
+class NodeDataProvider(DataProvider):
+    # queries of attributes that are not expected to change within the window, mapped to the node attribute whose
+    # changes are recorded in changed_attributes
+    STATIC_ATTRIBUTES = {
+        'cpu_capacity': 'cpu_limit',
+        'memory_capacity': 'memory_limit',
+        'instance_type': None,
+    }
+
+    # statistics of the usage summaries computed by prometheus, see get_node_usage_summaries
+    SUMMARY_QUERIES = {
+        'mean': "avg_over_time(({query}){window})",
+        'median': "quantile_over_time(0.5, ({query}){window})",
+        'p95': "quantile_over_time(0.95, ({query}){window})",
+        'p99': "quantile_over_time(0.99, ({query}){window})",
+        'max': "max_over_time(({query}){window})",
+        'count': "count_over_time(({query}){window})",
+    }
+
+    # join of the usage queries that labels every series with the name of its node, see local_node_name_join
+    NODE_NAME_JOIN = "*on(instance)group_left(nodename) node_uname_info"
+    NODE_NAMES_QUERY = "node_uname_info"
+
     def __init__(self, prometheus_api, ec2_client, start_time, end_time, step, rate_deta, logger,
-                 network_band_width_file):
-        self.prometheus_api = prometheus_api
+                 network_band_width_file, query_executor=None, instant_static_queries=False, instance_catalog=None,
+                 summary_thresholds=None, query_names=None, local_node_name_join=False):
         self.ec2_client = ec2_client
-        self.start_time = start_time
-        self.end_time = end_time
-        self.step = step
-        self.rate_delta = rate_deta
-        self.logger = logger
         self.network_bandwidth_file = network_band_width_file
+        if instance_catalog is None:
+            instance_catalog = InstanceCatalog(ec2_client, logger, network_band_width_file)
+        self.instance_catalog = instance_catalog
+        # nodes are created from the cpu capacity query, with query_names none are found without it
+        super().__init__(prometheus_api, start_time, end_time, step, rate_deta, logger, query_executor,
+                         instant_static_queries, query_names)
+        # with summary_thresholds, usage metrics are summarized by prometheus instead of downloaded. It maps a usage
+        # metric to the threshold whose exceedances are counted, as a fraction of the limit returned by a function of
+        # the node
+        self.summary_thresholds = summary_thresholds
+        if query_names is not None and summary_thresholds is not None:
+            self.summary_thresholds = {name: threshold for name, threshold in summary_thresholds.items()
+                                       if name in self.queries}
+        # with local_node_name_join the usage series are fetched per instance without the node_uname_info join and
+        # matched to their nodes with node_names_by_instance, an index fetched again on every update since node IPs are
+        # reused by new nodes. The pod provider reads the same index
+        self.local_node_name_join = local_node_name_join
+        self.node_names_by_instance = {}
+        self._load_lock = threading.Lock()
+
+    def _get_queries(self):
+        return {
+            'cpu_capacity': "kube_node_status_capacity{resource='cpu'}",
+            'memory_capacity': "(kube_node_status_capacity{resource='memory'})/1000000",
+            'instance_type': "kube_node_labels",
+            'cpu_usage': f"sum(rate(node_cpu_seconds_total{{mode!='idle',mode!='iowait',mode!='steal'}}[{self.rate_delta}m]))by(instance)*on(instance)group_left(nodename) node_uname_info",
+            'memory_usage': "((node_memory_MemTotal_bytes - node_memory_MemFree_bytes- node_memory_Buffers_bytes - node_memory_Cached_bytes)*on(instance)group_left(nodename) node_uname_info)/1000000",
+            'network_rx_bytes': f"(sum(rate(node_network_receive_bytes_total[{self.rate_delta}m])) by (instance)*on(instance)group_left(nodename) node_uname_info)/1000000",
+            'network_tx_bytes': f"(sum(rate(node_network_transmit_bytes_total[{self.rate_delta}m])) by (instance)*on(instance)group_left(nodename) node_uname_info)/1000000",
+            'disk_total_bytes': f"(sum(rate(node_disk_written_bytes_total{{device=~'nvme...'}}[{self.rate_delta}m]) + rate(node_disk_read_bytes_total{{device=~'nvme...'}}[{self.rate_delta}m]))by(instance)*on(instance)group_left(nodename) node_uname_info)/1000000",
+        }
 
     def _prometheus_query(self, query):
-        res = self.prometheus_api.custom_query_range(
-            query=query,
-            start_time=self.start_time,
-            end_time=self.end_time,
-            step=self.step
-        )
+        res = self.query_executor.query_range(query, self.fetch_start_time, self.end_time, self.step)
+        if self.local_node_name_join:
+            self._ensure_node_names(res)
         return res
 
+    def _usage_query(self, name):
+        if self.local_node_name_join:
+            return self.queries[name].replace(self.NODE_NAME_JOIN, '')
+        return self.queries[name]
+
+    def _node_names_query(self):
+        # the last nodename of every instance within the window
+        window = subquery_range(self.start_time, self.end_time, self.step)
+        return f"last_over_time(({self.NODE_NAMES_QUERY}){window})"
+
+    def _fetches_node_names(self):
+        # the index is fetched along with the usage series of every update, one instant query
+        return (self.local_node_name_join and self.summary_thresholds is None
+                and any(name not in self.STATIC_ATTRIBUTES for name in self.queries))
+
+    def _fetch_node_names(self, instances=()):
+        res = self.query_executor.query_instant(self._node_names_query(), self.end_time)
+        if not instances:
+            # a full fetch replaces the index, an instance may now belong to another node. Cleared in place, the pod
+            # provider holds the same dict
+            self.node_names_by_instance.clear()
+        for _data in res:
+            instance = _data['metric'].get('instance')
+            if instance is not None and 'nodename' in _data['metric']:
+                self.node_names_by_instance[instance] = _data['metric']['nodename']
+        # instances without node_uname_info are kept as well, so that they do not trigger another fetch
+        for instance in instances:
+            self.node_names_by_instance.setdefault(instance, None)
+
+    def _ensure_node_names(self, res):
+        # nodes that joined since the index was fetched in this update show up as unknown instances
+        instances = {_data['metric'].get('instance') for _data in res} - {None}
+        missing = instances - self.node_names_by_instance.keys()
+        if missing:
+            self._fetch_node_names(missing)
+
+    def _usage_node_name(self, _data):
+        if self.local_node_name_join:
+            return self.node_names_by_instance.get(_data['metric'].get('instance'))
+        return _data['metric'].get('nodename')
+
+    def _summary_queries(self, name):
+        window = subquery_range(self.start_time, self.end_time, self.step)
+        return {stat: query.format(query=self.queries[name], window=window)
+                for stat, query in self.SUMMARY_QUERIES.items()}
+
+    def _exceedance_query(self, name, threshold):
+        window = subquery_range(self.start_time, self.end_time, self.step)
+        return f"sum_over_time((({self.queries[name]}) > bool {threshold!r}){window})"
+
+    @profiled('provider')
+    def prefetch(self):
+        # send every query up front, the get_* methods below then only wait for their own result
+        if self._fetches_node_names():
+            self.query_executor.submit_instant(self._node_names_query(), self.end_time)
+        for name, query in self.queries.items():
+            if self.instant_static_queries and name in self.STATIC_ATTRIBUTES:
+                for instant_query in self._instant_static_queries(name):
+                    if instant_query is not None:
+                        self.query_executor.submit_instant(instant_query, self.end_time)
+                continue
+            if self.summary_thresholds is not None and name in self.summary_thresholds:
+                for summary_query in self._summary_queries(name).values():
+                    self.query_executor.submit_instant(summary_query, self.end_time)
+                continue
+            if name in self.STATIC_ATTRIBUTES:
+                self.query_executor.submit_range(query, self.start_time, self.end_time, self.step)
+            else:
+                self.query_executor.submit_range(self._usage_query(name), self.fetch_start_time, self.end_time,
+                                                 self.step)
+
     def _parse_node_name(self, _data):
         if 'node' not in _data['metric']:
             return None
-        node_name = re.sub(".ec2.internal", "", _data['metric']['node'])
+        node_name = normalize_node_name(_data['metric']['node'])
         return node_name
 
-    def get_data(self):
+    @profiled('provider')
+    def update_data(self):
+        # node objects are rebuilt on every call, the usage series they read live in the metric store
         node_data = {}
-        self.get_node_cpu_capacity(node_data)
-        self.get_node_memory_capacity(node_data)
-        self.get_node_instance_type(node_data)
-        self.get_node_network_bandwidths(node_data)
-        self.get_node_ebs_bandwidths(node_data)
-        self.get_cpu_usage_data(node_data)
-        self.get_memory_usage_data(node_data)
-        self.get_node_network_rx_bytes(node_data)
-        self.get_node_network_tx_bytes(node_data)
-        self.get_node_disk_total_bytes(node_data)
+        self.prefetch()
+        if 'cpu_capacity' in self.queries:
+            self.get_node_cpu_capacity(node_data)
+        if 'memory_capacity' in self.queries:
+            self.get_node_memory_capacity(node_data)
+        if 'instance_type' in self.queries:
+            self.get_node_instance_type(node_data)
+            self.instance_catalog.ensure(self._get_instance_types_list(node_data))
+            self.get_node_network_bandwidths(node_data)
+            self.get_node_ebs_bandwidths(node_data)
+        if self.summary_thresholds is not None:
+            self.get_node_usage_summaries(node_data)
+        else:
+            if self._fetches_node_names():
+                self._fetch_node_names()
+            for name, get_usage in (('cpu_usage', self.get_cpu_usage_data),
+                                    ('memory_usage', self.get_memory_usage_data),
+                                    ('network_rx_bytes', self.get_node_network_rx_bytes),
+                                    ('network_tx_bytes', self.get_node_network_tx_bytes),
+                                    ('disk_total_bytes', self.get_node_disk_total_bytes)):
+                if name in self.queries:
+                    get_usage(node_data)
+        self._live_entities = len(node_data)
         return node_data
 
+    @profiled('provider')
     def get_node_cpu_capacity(self, node_data):
         try:
-            node_cpu_cap_res = self._prometheus_query("kube_node_status_capacity{resource='cpu'}")
+            node_cpu_cap_res = self._prometheus_static_query('cpu_capacity')
             for _data in node_cpu_cap_res:
                 node_name = self._parse_node_name(_data)
                 if node_name is None:
                     continue
                 if node_name not in node_data:
-                    node_data[node_name] = NodeData(node_name)
+                    node_data[node_name] = NodeData(node_name, self.metric_store)
                 node = node_data[node_name]
-                node.cpu_limit = float(_data['values'][0][1])
+                node.cpu_limit = float(_data['values'][-1][1])
+                if _data['changed']:
+                    node.changed_attributes |= {'cpu_limit'}
         except Exception as e:
             self.logger.error("Error getting node cpu capacity", e)
 
+    @profiled('provider')
     def get_node_memory_capacity(self, node_data):
         try:
-            node_cpu_cap_res = self._prometheus_query("(kube_node_status_capacity{resource='memory'})/1000000")
+            node_cpu_cap_res = self._prometheus_static_query('memory_capacity')
             for _data in node_cpu_cap_res:
                 node_name = self._parse_node_name(_data)
-                if node_name is None:
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node = node_data[node_name]
-                node.memory_limit = float(_data['values'][0][1])
+                node.memory_limit = float(_data['values'][-1][1])
+                if _data['changed']:
+                    node.changed_attributes |= {'memory_limit'}
         except Exception as e:
             self.logger.error("Error getting node memory capacity", e)
 
+    @profiled('provider')
     def get_node_instance_type(self, node_data):
         try:
-            node_instance_type_res = self._prometheus_query("kube_node_labels")
+            node_instance_type_res = self._prometheus_static_query('instance_type')
             for _data in node_instance_type_res:
                 node_name = self._parse_node_name(_data)
                 if node_name is None:
@@ -87,45 +228,27 @@ class NodeDataProvider:
         except Exception as e:
             self.logger.error("Error getting  instance type", e)
 
+    @profiled('provider')
     def get_node_network_bandwidths(self, node_data):
         try:
-            bandwidth_map = self.get_network_bandwidth_map()
             for _, node in node_data.items():
-                if node.instance_type not in bandwidth_map:
+                network_bandwidth = self.instance_catalog.network_bandwidth(node.instance_type)
+                if network_bandwidth is None:
                     self.logger.info(f"Network bandwidth not availabe for instance type: {node.instance_type}")
                     continue
-                node.network_bandwidth_limit = bandwidth_map[node.instance_type]
-        except Exception as e:
-            self.logger.error("Error getting network bandwidth for node", e)
-
-    def get_network_bandwidth_map(self):
-        try:
-            bandwidth_map = {}
-            file = open(
-                "/Users/abhishek.patare/PycharmProjects/prometheus_monitoring_v2/data_providers/network_bandwidths",
-                'r')
-            file.readline()
-            while True:
-                line = file.readline()
-                if line:
-                    data = line.split(sep=',')
-                    bandwidth_map[data[0]] = Gb_to_MB(float(data[1]))
-                else:
-                    break
-            return bandwidth_map
+                node.network_bandwidth_limit = network_bandwidth
         except Exception as e:
             self.logger.error("Error getting network bandwidth for node", e)
-            return {}
 
+    @profiled('provider')
     def get_node_ebs_bandwidths(self, node_data):
         try:
-            instance_types_list = self._get_instance_types_list(node_data)
-            ebs_bandwidth_map = self._get_ebs_bandwidth_map(instance_types_list)
             for _, node in node_data.items():
-                if node.instance_type not in ebs_bandwidth_map:
+                ebs_bandwidth = self.instance_catalog.ebs_baseline_bandwidth(node.instance_type)
+                if ebs_bandwidth is None:
                     self.logger.info(f"EBS bandwidth not available for instance type: {node.instance_type}")
                     continue
-                node.ebs_baseline_bandwidth = ebs_bandwidth_map[node.instance_type]
+                node.ebs_baseline_bandwidth = ebs_bandwidth
         except Exception as e:
             self.logger.error("Error getting node ebs bandwidth", e)
 
@@ -138,100 +261,129 @@ class NodeDataProvider:
             instance_type_set.add(node.instance_type)
         return list(instance_type_set)
 
-    def _get_ebs_bandwidth_map(self, instance_type_list):
-        try:
-            res = self.ec2_client.describe_instance_types(InstanceTypes=instance_type_list)
-            ebs_bandwidth_map = {}
-            for e in res['InstanceTypes']:
-                if 'EbsInfo' in e and 'EbsOptimizedInfo' in e['EbsInfo']:
-                    ebs_bandwidth_map[e['InstanceType']] = e['EbsInfo']['EbsOptimizedInfo']['BaselineBandwidthInMbps']
-            return ebs_bandwidth_map
-        except Exception as e:
-            self.logger.error("Error getting ebs bandwidths", e)
-            return {}
-
+    @profiled('provider')
     def get_cpu_usage_data(self, node_data):
         try:
-            node_cpu_usage_res = self._prometheus_query(
-                f"sum(rate(node_cpu_seconds_total{{mode!='idle',mode!='iowait',mode!='steal'}}[{self.rate_delta}m]))by(instance)*on(instance)group_left(nodename) node_uname_info")
+            node_cpu_usage_res = self._prometheus_query(self._usage_query('cpu_usage'))
             for _data in node_cpu_usage_res:
-                # node_name = self._parse_node_name(_data,'instance')
-                if 'nodename' not in _data['metric']:
+                node_name = self._usage_node_name(_data)
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node_name = _data['metric']['nodename']
-                if node_name is None:
-                    continue
-
-                node = node_data[node_name]
-                node.cpu_usage = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                node.cpu_usage = node.cpu_usage.astype({'timestamp': int, 'values': float})
+                self._store_samples('cpu_usage', node.row, _data['values'])
 
         except Exception as e:
             self.logger.error("Error getting node cpu usage", e)
 
+    @profiled('provider')
     def get_memory_usage_data(self, node_data):
         try:
-            node_memory_usage_res = self._prometheus_query(
-                "((node_memory_MemTotal_bytes - node_memory_MemFree_bytes- node_memory_Buffers_bytes - node_memory_Cached_bytes)*on(instance)group_left(nodename) node_uname_info)/1000000")
+            node_memory_usage_res = self._prometheus_query(self._usage_query('memory_usage'))
             for _data in node_memory_usage_res:
-                # node_name = self._parse_node_name(_data)
-                if 'nodename' not in _data['metric']:
-                    continue
-                node_name = _data['metric']['nodename']
-                if node_name is None:
+                node_name = self._usage_node_name(_data)
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node = node_data[node_name]
-                node.memory_usage = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                node.memory_usage = node.memory_usage.astype({'timestamp': int, 'values': float})
+                self._store_samples('memory_usage', node.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting node memory usage", e)
 
+    @profiled('provider')
     def get_node_network_rx_bytes(self, node_data):
         try:
-            node_network_rx_bytes_res = self._prometheus_query(
-                f"(sum(rate(node_network_receive_bytes_total[{self.rate_delta}m])) by (instance)*on(instance)group_left(nodename) node_uname_info)/1000000")
+            node_network_rx_bytes_res = self._prometheus_query(self._usage_query('network_rx_bytes'))
             for _data in node_network_rx_bytes_res:
-                # node_name = self._parse_node_name(_data)
-                if 'nodename' not in _data['metric']:
-                    continue
-                node_name = _data['metric']['nodename']
-                if node_name is None:
+                node_name = self._usage_node_name(_data)
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node = node_data[node_name]
-                node.network_rx_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                node.network_rx_bytes = node.network_rx_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('network_rx_bytes', node.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting node rx bytes", e)
 
+    @profiled('provider')
     def get_node_network_tx_bytes(self, node_data):
         try:
-            node_network_tx_bytes_res = self._prometheus_query(
-                f"(sum(rate(node_network_transmit_bytes_total[{self.rate_delta}m])) by (instance)*on(instance)group_left(nodename) node_uname_info)/1000000")
+            node_network_tx_bytes_res = self._prometheus_query(self._usage_query('network_tx_bytes'))
             for _data in node_network_tx_bytes_res:
-                # node_name = self._parse_node_name(_data)
-                if 'nodename' not in _data['metric']:
-                    continue
-                node_name = _data['metric']['nodename']
-                if node_name is None:
+                node_name = self._usage_node_name(_data)
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node = node_data[node_name]
-                node.network_tx_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                node.network_tx_bytes = node.network_tx_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('network_tx_bytes', node.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting node tx bytes", e)
 
+    @profiled('provider')
     def get_node_disk_total_bytes(self, node_data):
         try:
-            node_disk_total_bytes_res = self._prometheus_query(
-                f"(sum(rate(node_disk_written_bytes_total{{device=~'nvme...'}}[{self.rate_delta}m]) + rate(node_disk_read_bytes_total{{device=~'nvme...'}}[{self.rate_delta}m]))by(instance)*on(instance)group_left(nodename) node_uname_info)/1000000")
+            node_disk_total_bytes_res = self._prometheus_query(self._usage_query('disk_total_bytes'))
             for _data in node_disk_total_bytes_res:
-                if 'nodename' not in _data['metric']:
-                    continue
-                node_name = _data['metric']['nodename']
-                if node_name is None:
+                node_name = self._usage_node_name(_data)
+                node = node_data.get(node_name)
+                if node is None:
                     continue
-                node = node_data[node_name]
-                node.disk_total_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                node.disk_total_bytes = node.disk_total_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('disk_total_bytes', node.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting node disk total bytes", e)
+
+    @profiled('provider')
+    def get_node_usage_summaries(self, node_data):
+        # mean, quantiles, max, sample count and threshold exceedances of every usage metric computed by prometheus,
+        # only a handful of numbers per node are transferred instead of the raw series
+        try:
+            exceedance_queries = []
+            for name, (threshold, get_limit) in self.summary_thresholds.items():
+                # nodes with the same limit share one query
+                node_thresholds = {}
+                for node_name, node in node_data.items():
+                    limit = get_limit(node)
+                    if limit is not None:
+                        node_thresholds.setdefault(threshold * limit, set()).add(node_name)
+                for node_threshold, node_names in node_thresholds.items():
+                    query = self._exceedance_query(name, node_threshold)
+                    self.query_executor.submit_instant(query, self.end_time)
+                    exceedance_queries.append((name, threshold, query, node_names))
+
+            summaries = {}
+            for name in self.summary_thresholds:
+                for stat, query in self._summary_queries(name).items():
+                    for _data in self.query_executor.query_instant(query, self.end_time):
+                        node_name = _data['metric'].get('nodename')
+                        if node_name not in node_data:
+                            continue
+                        summary = summaries.setdefault((name, node_name), SeriesSummary())
+                        value = float(_data['value'][1])
+                        setattr(summary, stat, int(value) if stat == 'count' else value)
+            for name, threshold, query, node_names in exceedance_queries:
+                for _data in self.query_executor.query_instant(query, self.end_time):
+                    node_name = _data['metric'].get('nodename')
+                    if node_name in node_names and (name, node_name) in summaries:
+                        summaries[(name, node_name)].exceedances[threshold] = int(float(_data['value'][1]))
+            for (name, node_name), summary in summaries.items():
+                if summary.count > 0:
+                    self.metric_store.set_summary(name, node_data[node_name].row, summary)
+        except Exception as e:
+            self.logger.error("Error getting node usage summaries", e)
+
+    @profiled('provider')
+    def load_usage_series(self, node_data, name, node_names):
+        # raw series of the given nodes, for the analysis that needs more than the summary statistics. Reports running
+        # in parallel may ask for the same series, loads are serialized so that each series is written only once
+        with self._load_lock:
+            self._load_usage_series(node_data, name, node_names)
+
+    def _load_usage_series(self, node_data, name, node_names):
+        node_names = [node_name for node_name in node_names
+                      if node_name in node_data and getattr(node_data[node_name], name) is None]
+        if not node_names:
+            return
+        try:
+            node_regex = '|'.join(node_name.replace('.', '\\\\.') for node_name in node_names)
+            query = self.queries[name].replace("node_uname_info", f"node_uname_info{{nodename=~'{node_regex}'}}")
+            for _data in self.query_executor.query_range(query, self.start_time, self.end_time, self.step):
+                node_name = _data['metric'].get('nodename')
+                if node_name in node_names:
+                    self.metric_store.set_samples(name, node_data[node_name].row, _data['values'])
+        except Exception as e:
+            self.logger.error(f"Error getting node {name} series", e)
@@ -1,4 +1,20 @@
+from data_providers.MetricStore import MetricStore, MetricField
+
+# changed_attributes of entities without changes, one shared instance
+NO_CHANGES = frozenset()
+
+
 class PodData:
+    # no per instance __dict__, a cluster can have a hundred thousand pods
+    __slots__ = ('pod_name', 'namespace', 'node_name', 'cpu_request', 'memory_request', 'metric_store', 'row',
+                 'cpu_limit', 'memory_limit', 'changed_attributes')
+
+    cpu_usage = MetricField()
+    memory_usage = MetricField()
+    network_rx_bytes = MetricField()
+    network_tx_bytes = MetricField()
+    disk_total_bytes = MetricField()
+
     def __init__(self,
                  pod_name=None,
                  namespace=None,
@@ -6,7 +22,8 @@ class PodData:
                  memory_request=0,
                  cpu_request=0,
                  cpu_limit=float('inf'),
-                 memory_limit=float("inf")):
+                 memory_limit=float("inf"),
+                 metric_store=None):
 
         self.pod_name = pod_name
         self.namespace = namespace
@@ -14,10 +31,10 @@ class PodData:
 
         self.cpu_request = cpu_request
         self.memory_request = memory_request
-        self.cpu_usage = None
-        self.memory_usage = None
-        self.network_rx_bytes = None
-        self.network_tx_bytes = None
-        self.disk_total_bytes = None
+        # usage series live in a matrix shared by all pods, the pod only keeps its row
+        self.metric_store = metric_store if metric_store is not None else MetricStore()
+        self.row = self.metric_store.add_entity((namespace, pod_name))
         self.cpu_limit = cpu_limit
         self.memory_limit = memory_limit
+        # static attributes whose value changed within the analysed window
+        self.changed_attributes = NO_CHANGES
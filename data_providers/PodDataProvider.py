@@ -1,40 +1,79 @@
-import pandas as pd
-import re
+import sys
 import config
+from data_providers.DataProvider import DataProvider
 from data_providers.PodData import PodData
-
-
-class PodDataProvider:
-    def __init__(self, prometheus_api, start_time, end_time, step, rate_delta, logger):
-        self.prometheus_api = prometheus_api
-        self.start_time = start_time
-        self.end_time = end_time
-        self.step = step
-        self.rate_delta = rate_delta
-        self.logger = logger
-
-    def get_data(self):
+from data_providers.utils import normalize_node_name
+from profiling import profiled
+
+
+class PodDataProvider(DataProvider):
+    # queries of attributes that are not expected to change within the window, mapped to the pod attribute whose
+    # changes are recorded in changed_attributes
+    STATIC_ATTRIBUTES = {
+        'cpu_request': 'cpu_request',
+        'memory_request': 'memory_request',
+        'cpu_limit': 'cpu_limit',
+        'memory_limit': 'memory_limit',
+    }
+
+    def __init__(self, prometheus_api, start_time, end_time, step, rate_delta, logger, query_executor=None,
+                 instant_static_queries=False, query_names=None, node_names_by_instance=None):
+        super().__init__(prometheus_api, start_time, end_time, step, rate_delta, logger, query_executor,
+                         instant_static_queries, query_names)
+        # instance -> node name index of the node provider (see NodeDataProvider.local_node_name_join), the usage
+        # series of instances that are not in it are matched on the instance label itself
+        self.node_names_by_instance = node_names_by_instance if node_names_by_instance is not None else {}
+
+    @profiled('provider')
+    def update_data(self):
+        # pod objects are rebuilt on every call so that pods which left the window are dropped, the usage series
+        # they read live in the metric store
         pod_data = {}
-        self.get_pod_cpu_request(pod_data)
-        self.get_pod_memory_request(pod_data)
-        self.get_pod_cpu_limits(pod_data)
-        self.get_pod_memory_limits(pod_data)
-        self.get_pod_cpu_data(pod_data)
-        self.get_pod_memory_data(pod_data)
-        self.get_pod_network_rx_bytes(pod_data)
-        self.get_pod_network_tx_bytes(pod_data)
-        self.get_pod_disk_total_bytes(pod_data)
+        self.prefetch()
+        # pods are created by the first query they show up in, the getters run in a fixed order
+        for name, get in (('cpu_request', self.get_pod_cpu_request),
+                          ('memory_request', self.get_pod_memory_request),
+                          ('cpu_limit', self.get_pod_cpu_limits),
+                          ('memory_limit', self.get_pod_memory_limits),
+                          ('cpu_usage', self.get_pod_cpu_data),
+                          ('memory_usage', self.get_pod_memory_data),
+                          ('network_rx_bytes', self.get_pod_network_rx_bytes),
+                          ('network_tx_bytes', self.get_pod_network_tx_bytes),
+                          ('disk_total_bytes', self.get_pod_disk_total_bytes)):
+            if name in self.queries:
+                get(pod_data)
+        self._live_entities = len(pod_data)
         return pod_data
 
+    def _get_queries(self):
+        return {
+            'cpu_request': "sum(kube_pod_container_resource_requests{resource='cpu',pod!='POD'})by(pod,namespace,node)",
+            'memory_request': "(sum(kube_pod_container_resource_requests{resource='memory',pod!='POD'})by(pod,namespace,node))/1000000",
+            'cpu_limit': "sum(kube_pod_container_resource_limits{resource='cpu',pod!='POD'})by(pod,namespace,node)",
+            'memory_limit': "(sum(kube_pod_container_resource_limits{resource='memory',pod!='POD'})by(pod,namespace,node))/1000000",
+            'cpu_usage': f"sum(rate(container_cpu_usage_seconds_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m])) by(namespace,pod,instance)",
+            'memory_usage': "(sum(container_memory_usage_bytes{namespace!='',pod!='',pod!='POD',instance!=''}) by (pod,namespace,instance))/1000000",
+            'network_rx_bytes': f"(sum(rate(container_network_receive_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m]))by (namespace,pod,instance))/1000000",
+            'network_tx_bytes': f"(sum(rate(container_network_transmit_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m]))by (namespace,pod,instance))/1000000",
+            'disk_total_bytes': f"(sum(rate(container_fs_reads_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m])+rate(container_fs_writes_bytes_total{{namespace!='',pod!='',instance!=''}}[{self.rate_delta}m]))by (pod,namespace,instance))/1000000",
+        }
+
     def _prometheus_query(self, query):
-        res = self.prometheus_api.custom_query_range(
-            query=query,
-            start_time=self.start_time,
-            end_time=self.end_time,
-            step=self.step
-        )
+        res = self.query_executor.query_range(query, self.fetch_start_time, self.end_time, self.step)
         return res
 
+    @profiled('provider')
+    def prefetch(self):
+        # send every query up front, the get_* methods below then only wait for their own result
+        for name, query in self.queries.items():
+            if self.instant_static_queries and name in self.STATIC_ATTRIBUTES:
+                for instant_query in self._instant_static_queries(name):
+                    if instant_query is not None:
+                        self.query_executor.submit_instant(instant_query, self.end_time)
+                continue
+            start_time = self.start_time if name in self.STATIC_ATTRIBUTES else self.fetch_start_time
+            self.query_executor.submit_range(query, start_time, self.end_time, self.step)
+
     def _parse_pod_res(self, _data):
         # self.logger.debug(_data['metric'])
         if 'namespace' not in _data['metric']:
@@ -43,9 +82,10 @@ class PodDataProvider:
             return None, None, None
         if 'node' not in _data['metric']:
             return None, None, None
-        namespace = _data['metric']['namespace']
-        pod_name = _data['metric']['pod']
-        node_name = re.sub(".ec2.internal", "", _data['metric']['node'])
+        # every query repeats the labels of a pod, interned they are kept once and compare by identity
+        namespace = sys.intern(_data['metric']['namespace'])
+        pod_name = sys.intern(_data['metric']['pod'])
+        node_name = normalize_node_name(_data['metric']['node'])
         return namespace, pod_name, node_name
 
     def _parse_pod_res1(self, _data):
@@ -56,149 +96,153 @@ class PodDataProvider:
             return None, None, None
         if 'instance' not in _data['metric']:
             return None, None, None
-        namespace = _data['metric']['namespace']
-        pod_name = _data['metric']['pod']
-        node_name = re.sub(".ec2.internal", "", _data['metric']['instance'])
+        namespace = sys.intern(_data['metric']['namespace'])
+        pod_name = sys.intern(_data['metric']['pod'])
+        instance = _data['metric']['instance']
+        node_name = normalize_node_name(self.node_names_by_instance.get(instance) or instance)
         return namespace, pod_name, node_name
 
+    @profiled('provider')
     def get_pod_cpu_request(self, pod_data):
         try:
-            pod_cpu_request_res = self._prometheus_query(
-                "sum(kube_pod_container_resource_requests{resource='cpu',pod!='POD'})by(pod,namespace,node)")
+            pod_cpu_request_res = self._prometheus_static_query('cpu_request')
             for _data in pod_cpu_request_res:
                 namespace, pod_name, node_name = self._parse_pod_res(_data)
                 if namespace is None:
                     # self.logger.debug("Null namesace")
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.cpu_request = float(_data['values'][0][1])
+                pod.cpu_request = float(_data['values'][-1][1])
+                if _data['changed']:
+                    pod.changed_attributes |= {'cpu_request'}
         except Exception as e:
             self.logger.error("Error while getting pod cpu request", e)
 
+    @profiled('provider')
     def get_pod_memory_request(self, pod_data):
         try:
-            pod_memory_request_res = self._prometheus_query(
-                "(sum(kube_pod_container_resource_requests{resource='memory',pod!='POD'})by(pod,namespace,node))/1000000")
+            pod_memory_request_res = self._prometheus_static_query('memory_request')
             for _data in pod_memory_request_res:
                 namespace, pod_name, node_name = self._parse_pod_res(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.memory_request = float(_data['values'][0][1])
+                pod.memory_request = float(_data['values'][-1][1])
+                if _data['changed']:
+                    pod.changed_attributes |= {'memory_request'}
 
         except Exception as e:
             self.logger.error("Error getting pod memory request", e)
 
+    @profiled('provider')
     def get_pod_cpu_limits(self, pod_data):
         try:
-            pod_cpu_limit_res = self._prometheus_query(
-                "sum(kube_pod_container_resource_limits{resource='cpu',pod!='POD'})by(pod,namespace,node)")
+            pod_cpu_limit_res = self._prometheus_static_query('cpu_limit')
             for _data in pod_cpu_limit_res:
                 namespace, pod_name, node_name = self._parse_pod_res(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.cpu_limit = float(_data['values'][0][1])
+                pod.cpu_limit = float(_data['values'][-1][1])
+                if _data['changed']:
+                    pod.changed_attributes |= {'cpu_limit'}
         except Exception as e:
             self.logger.error("Error getting pod cpu limits", e)
 
+    @profiled('provider')
     def get_pod_memory_limits(self, pod_data):
         try:
-            pod_memory_limit_res = self._prometheus_query(
-                "(sum(kube_pod_container_resource_limits{resource='memory',pod!='POD'})by(pod,namespace,node))/1000000")
+            pod_memory_limit_res = self._prometheus_static_query('memory_limit')
             for _data in pod_memory_limit_res:
                 namespace, pod_name, node_name = self._parse_pod_res(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.memory_limit = float(_data['values'][0][1])
+                pod.memory_limit = float(_data['values'][-1][1])
+                if _data['changed']:
+                    pod.changed_attributes |= {'memory_limit'}
         except Exception as e:
             self.logger.error("Error getting pod memory limits", e)
 
+    @profiled('provider')
     def get_pod_cpu_data(self, pod_data):
         try:
-            pod_cpu_res = self._prometheus_query(
-                f"sum(rate(container_cpu_usage_seconds_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m])) by(namespace,pod,instance)")
+            pod_cpu_res = self._prometheus_query(self.queries['cpu_usage'])
             for _data in pod_cpu_res:
                 namespace, pod_name, node_name = self._parse_pod_res1(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.cpu_usage = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                pod.cpu_usage = pod.cpu_usage.astype({'timestamp': int, 'values': float})
+                self._store_samples('cpu_usage', pod.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting pod cpu usage", e)
 
+    @profiled('provider')
     def get_pod_memory_data(self, pod_data):
         try:
-            pod_memory_res = self._prometheus_query(
-                "(sum(container_memory_usage_bytes{namespace!='',pod!='',pod!='POD',instance!=''}) by (pod,namespace,instance))/1000000")
+            pod_memory_res = self._prometheus_query(self.queries['memory_usage'])
             for _data in pod_memory_res:
                 namespace, pod_name, node_name = self._parse_pod_res1(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.memory_usage = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                pod.memory_usage = pod.memory_usage.astype({'timestamp': int, 'values': float})
+                self._store_samples('memory_usage', pod.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting pod memory usage", e)
 
+    @profiled('provider')
     def get_pod_network_rx_bytes(self, pod_data):
         try:
-            pod_rx_bytes_res = self._prometheus_query(
-                f"(sum(rate(container_network_receive_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m]))by (namespace,pod,instance))/1000000")
+            pod_rx_bytes_res = self._prometheus_query(self.queries['network_rx_bytes'])
             for _data in pod_rx_bytes_res:
                 namespace, pod_name, node_name = self._parse_pod_res1(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.network_rx_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                pod.network_rx_bytes = pod.network_rx_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('network_rx_bytes', pod.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting pod rx bytes", e)
 
+    @profiled('provider')
     def get_pod_network_tx_bytes(self, pod_data):
         try:
-            pod_rx_bytes_res = self._prometheus_query(
-                f"(sum(rate(container_network_transmit_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m]))by (namespace,pod,instance))/1000000")
+            pod_rx_bytes_res = self._prometheus_query(self.queries['network_tx_bytes'])
             for _data in pod_rx_bytes_res:
                 namespace, pod_name, node_name = self._parse_pod_res1(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.network_tx_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                pod.network_tx_bytes = pod.network_tx_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('network_tx_bytes', pod.row, _data['values'])
         except:
             pass
 
+    @profiled('provider')
     def get_pod_disk_total_bytes(self, pod_data):
         try:
-            pod_disk_total_bytes_res = self._prometheus_query(
-                f"(sum(rate(container_fs_reads_bytes_total{{namespace!='',pod!='',pod!='POD',instance!=''}}[{self.rate_delta}m])+rate(container_fs_writes_bytes_total{{namespace!='',pod!='',instance!=''}}[{self.rate_delta}m]))by (pod,namespace,instance))/1000000")
+            pod_disk_total_bytes_res = self._prometheus_query(self.queries['disk_total_bytes'])
             for _data in pod_disk_total_bytes_res:
                 namespace, pod_name, node_name = self._parse_pod_res1(_data)
                 if namespace is None:
                     continue
                 if (namespace, pod_name) not in pod_data:
-                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name)
+                    pod_data[(namespace, pod_name)] = PodData(pod_name, namespace, node_name, metric_store=self.metric_store)
                 pod = pod_data[(namespace, pod_name)]
-                pod.disk_total_bytes = pd.DataFrame(_data['values'], columns=['timestamp', 'values'])
-                pod.disk_total_bytes = pod.disk_total_bytes.astype({'timestamp': int, 'values': float})
+                self._store_samples('disk_total_bytes', pod.row, _data['values'])
         except Exception as e:
             self.logger.error("Error getting pod disk total bytes", e)
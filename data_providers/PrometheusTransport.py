@@ -0,0 +1,75 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from prometheus_api_client.prometheus_connect import MAX_REQUEST_RETRIES, RETRY_BACKOFF_FACTOR, RETRY_ON_STATUS
+
+import profiling
+
+
+class TransportStats:
+    """Thread safe counters of the requests sent through a PrometheusTransport."""
+
+    def __init__(self):
+        self.requests = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wire_bytes, decoded_bytes, latency):
+        with self._lock:
+            self.requests += 1
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def summary(self):
+        with self._lock:
+            avg_latency = self.total_latency / self.requests if self.requests else 0.0
+            return (f"prometheus requests: {self.requests}, "
+                    f"received: {self.wire_bytes / 1E6:.2f} MB on wire / {self.decoded_bytes / 1E6:.2f} MB decoded, "
+                    f"avg latency: {avg_latency:.3f}s, max latency: {self.max_latency:.3f}s")
+
+
+class PrometheusTransport(HTTPAdapter):
+    """
+    HTTP adapter for prometheus traffic: keeps pool_size keep-alive connections open so that every concurrent query
+    reuses a connection, applies a default timeout to every request and records wire/decoded bytes and latency.
+    """
+
+    def __init__(self, pool_size, timeout=None, stats=None, max_retries=None):
+        if max_retries is None:
+            max_retries = Retry(
+                total=MAX_REQUEST_RETRIES,
+                backoff_factor=RETRY_BACKOFF_FACTOR,
+                status_forcelist=RETRY_ON_STATUS,
+            )
+        self.timeout = timeout
+        self.stats = stats
+        super().__init__(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries, pool_block=True)
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        start = time.perf_counter()
+        response = super().send(request, stream=stream, timeout=timeout, **kwargs)
+        if (self.stats is not None or profiling.get_profiler() is not None) and not stream:
+            # read the body here so the latency covers the full download, tell() is the compressed size on the wire
+            decoded_bytes = len(response.content)
+            wire_bytes = response.raw.tell() or decoded_bytes
+            if self.stats is not None:
+                self.stats.record(wire_bytes, decoded_bytes, time.perf_counter() - start)
+            profiling.add_response_bytes(wire_bytes)
+        return response
+
+
+def create_prometheus_session(prometheus_endpoint, pool_size, timeout=None, stats=None):
+    session = requests.Session()
+    session.mount(prometheus_endpoint, PrometheusTransport(pool_size, timeout, stats))
+    return session
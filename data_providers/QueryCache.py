@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from data_providers.utils import SETTLE_SECONDS
+
+
+class QueryCache:
+    """
+    On disk cache of range query results, one compressed numpy archive per (query, step). An entry covers a step
+    aligned [start, end] range and holds every sample of every series in it, so a later query over an overlapping
+    window only needs the tail that is not cached yet. Least recently used entries are evicted once the cache
+    directory grows beyond max_bytes.
+
+    Samples from the last settle_seconds of a window are never cached since prometheus may still be ingesting the
+    scrapes they are computed from.
+    """
+
+    def __init__(self, cache_dir, max_bytes, logger, settle_seconds=SETTLE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.settle_seconds = settle_seconds
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, query, step):
+        digest = hashlib.sha1(f"{step}|{query}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    def load(self, query, step):
+        # returns (start, end, result) of the cached entry or None
+        path = self._path(query, step)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as archive:
+                if str(archive['query']) != query:
+                    return None
+                labels = archive['labels']
+                offsets = archive['offsets']
+                samples = archive['samples']
+                start, end = int(archive['start']), int(archive['end'])
+            os.utime(path)
+        except Exception as e:
+            self.logger.error(f"Error reading query cache entry {path}", e)
+            return None
+        res = [{'metric': json.loads(labels[i]), 'values': samples[offsets[i]:offsets[i + 1]]}
+               for i in range(len(labels))]
+        return start, end, res
+
+    def store(self, query, step, start, end, res):
+        end = end - (end - start) % step
+        cache_end = end - step * (self.settle_seconds // step + (self.settle_seconds % step > 0))
+        if cache_end < start:
+            return
+        labels = []
+        parts = []
+        offsets = [0]
+        for _data in res:
+            values = np.asarray(_data['values'], dtype=float).reshape(-1, 2)
+            values = values[(values[:, 0] >= start) & (values[:, 0] <= cache_end)]
+            labels.append(json.dumps(_data['metric'], sort_keys=True))
+            parts.append(values)
+            offsets.append(offsets[-1] + len(values))
+        path = self._path(query, step)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                np.savez_compressed(file,
+                                    query=np.array(query),
+                                    labels=np.array(labels, dtype=str),
+                                    offsets=np.array(offsets, dtype=np.int64),
+                                    samples=np.concatenate(parts) if parts else np.empty((0, 2)),
+                                    start=np.int64(start),
+                                    end=np.int64(cache_end))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.error(f"Error writing query cache entry {path}", e)
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
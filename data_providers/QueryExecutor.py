@@ -0,0 +1,127 @@
+import datetime
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import profiling
+
+from data_providers.utils import split_time_range, merge_range_results
+
+
+class QueryExecutor:
+    """
+    Runs prometheus range queries on a bounded thread pool so that independent queries are in flight at the same
+    time. Queries can be submitted ahead of time with submit_range and collected later with query_range, which lets a
+    data provider send all of its queries at once and parse each result as soon as it arrives.
+
+    Ranges longer than max_points_per_query steps are split into shards which are fetched in parallel and merged back
+    into one result per series. Instant queries go through the same pool.
+
+    With a QueryCache, the part of a window that is already cached is served from disk and only the missing tail is
+    requested from prometheus.
+    """
+
+    def __init__(self, prometheus_api, logger, max_concurrency=1, max_points_per_query=config.MAX_POINTS_PER_QUERY,
+                 query_cache=None):
+        self.prometheus_api = prometheus_api
+        self.logger = logger
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_points_per_query = max_points_per_query
+        self.query_cache = query_cache
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="prometheus-query")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _fetch_range(self, query, start_time, end_time, step):
+        with profiling.query(query, 'range') as record:
+            res = self.prometheus_api.custom_query_range(
+                query=query,
+                start_time=start_time,
+                end_time=end_time,
+                step=step
+            )
+            if record is not None:
+                record.set_result(res)
+            return res
+
+    def _load_cached(self, query, start_time, end_time, step):
+        # cached samples inside [start_time, end_time] and the time from which the rest still has to be fetched
+        cached = self.query_cache.load(query, step) if self.query_cache is not None else None
+        if cached is None:
+            return None, start_time
+        cache_start, cache_end, res = cached
+        start = round(start_time.timestamp())
+        end = round(end_time.timestamp())
+        # only usable if the entry covers the start of the window and lies on the same timestamp grid
+        if cache_start > start or cache_end < start or (start - cache_start) % step != 0:
+            return None, start_time
+        cached_res = []
+        for _data in res:
+            values = _data['values']
+            values = values[(values[:, 0] >= start) & (values[:, 0] <= end)]
+            if len(values) > 0:
+                cached_res.append({'metric': _data['metric'], 'values': values})
+        self.logger.debug(f"Serving query from cache up to {cache_end}: {query}")
+        return cached_res, datetime.datetime.fromtimestamp(cache_end + step)
+
+    def submit_range(self, query, start_time, end_time, step):
+        key = (query, start_time, end_time, step)
+        with self._lock:
+            if key not in self._pending:
+                cached_res, fetch_start = self._load_cached(query, start_time, end_time, step)
+                shards = []
+                if fetch_start <= end_time:
+                    shards = split_time_range(fetch_start, end_time, step, self.max_points_per_query)
+                if len(shards) > 1:
+                    self.logger.debug(f"Splitting query into {len(shards)} shards: {query}")
+                self._pending[key] = (cached_res,
+                                      [self._pool.submit(self._fetch_range, query, shard_start, shard_end, step)
+                                       for shard_start, shard_end in shards])
+            return self._pending[key]
+
+    def query_range(self, query, start_time, end_time, step):
+        cached_res, futures = self.submit_range(query, start_time, end_time, step)
+        try:
+            results = [] if cached_res is None else [cached_res]
+            results.extend(future.result() for future in futures)
+            res = merge_range_results(results)
+            if self.query_cache is not None and len(futures) > 0:
+                self.query_cache.store(query, step, round(start_time.timestamp()), round(end_time.timestamp()), res)
+            return res
+        finally:
+            with self._lock:
+                # results are handed out once, drop the reference so the raw response can be freed after parsing
+                self._pending.pop((query, start_time, end_time, step), None)
+
+    def _fetch_instant(self, query, time):
+        with profiling.query(query, 'instant') as record:
+            res = self.prometheus_api.custom_query(query=query, params={'time': time.timestamp()})
+            if record is not None:
+                record.set_result(res)
+            return res
+
+    def submit_instant(self, query, time):
+        key = (query, time)
+        with self._lock:
+            if key not in self._pending:
+                self._pending[key] = [self._pool.submit(self._fetch_instant, query, time)]
+            return self._pending[key]
+
+    def query_instant(self, query, time):
+        futures = self.submit_instant(query, time)
+        try:
+            return futures[0].result()
+        finally:
+            with self._lock:
+                self._pending.pop((query, time), None)
+
+    def wait(self):
+        # blocks until every submitted query has its response, e.g. to time the parsing of the responses on its own
+        with self._lock:
+            pending = list(self._pending.values())
+        for entry in pending:
+            concurrent.futures.wait(entry[1] if isinstance(entry, tuple) else entry)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
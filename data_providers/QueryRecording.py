@@ -0,0 +1,118 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+# file in a recording directory holding the analysed window of the recorded run
+WINDOW_FILE = 'window.json'
+# file in a recording directory holding the instance catalog of the recorded run, see InstanceCatalog
+INSTANCE_CATALOG_FILE = 'instance_catalog.json'
+
+
+def _range_key(query, start_time, end_time, step):
+    # prometheus_api_client sends the range rounded to whole seconds
+    return f"range|{round(start_time.timestamp())}|{round(end_time.timestamp())}|{step}|{query}"
+
+
+def _instant_key(query, params):
+    time = (params or {}).get('time')
+    return f"instant|{'' if time is None else f'{float(time):.3f}'}|{query}"
+
+
+def _path(recording_dir, key):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(recording_dir, f"{digest}.json.gz")
+
+
+class QueryRecorder:
+    """
+    Stands in for a PrometheusConnect and passes every range and instant query on to it, saving each response to a
+    gzip compressed json file in recording_dir. A QueryReplay of the directory then answers the same queries without
+    prometheus. The analysed window is saved with the responses, so the replay covers the same window. The instance
+    catalog of the run is saved with record_instance_catalog once the node data is loaded.
+    """
+
+    def __init__(self, prometheus_api, recording_dir, start_time, end_time, logger):
+        self.prometheus_api = prometheus_api
+        self.recording_dir = recording_dir
+        self.logger = logger
+        os.makedirs(recording_dir, exist_ok=True)
+        with open(os.path.join(recording_dir, WINDOW_FILE), 'w') as file:
+            json.dump({'start': start_time.timestamp(), 'end': end_time.timestamp()}, file)
+
+    def _save(self, key, res):
+        path = _path(self.recording_dir, key)
+        try:
+            # responses are written from the query threads, each one to a file of its own
+            fd, tmp_path = tempfile.mkstemp(dir=self.recording_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', compresslevel=6) as file:
+                json.dump({'key': key, 'result': res}, file)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.error(f"Error recording query response {path}", e)
+
+    def record_instance_catalog(self, instance_catalog):
+        path = os.path.join(self.recording_dir, INSTANCE_CATALOG_FILE)
+        try:
+            with open(path, 'w') as file:
+                json.dump(instance_catalog.instance_types, file, indent=1, sort_keys=True)
+        except Exception as e:
+            self.logger.error(f"Error recording instance catalog {path}: {e}")
+
+    def custom_query_range(self, query, start_time, end_time, step, params=None):
+        res = self.prometheus_api.custom_query_range(query=query, start_time=start_time, end_time=end_time, step=step,
+                                                     params=params)
+        self._save(_range_key(query, start_time, end_time, step), res)
+        return res
+
+    def custom_query(self, query, params=None):
+        res = self.prometheus_api.custom_query(query=query, params=params)
+        self._save(_instant_key(query, params), res)
+        return res
+
+
+class QueryReplay:
+    """
+    Answers range and instant queries from the responses a QueryRecorder saved in recording_dir, in place of a
+    PrometheusConnect. Only queries that were recorded can be answered: the replayed run has to analyse the recorded
+    window (start_time, end_time) with the configuration it was recorded with. Other queries fail like an unreachable
+    prometheus would.
+
+    Instance types are looked up in the recorded instance catalog (instance_catalog_file) through a ReplayEC2 client,
+    so the replay neither calls EC2 nor depends on the state of the shared catalog.
+    """
+
+    def __init__(self, recording_dir):
+        self.recording_dir = recording_dir
+        with open(os.path.join(recording_dir, WINDOW_FILE)) as file:
+            window = json.load(file)
+        self.start_time = datetime.datetime.fromtimestamp(window['start'])
+        self.end_time = datetime.datetime.fromtimestamp(window['end'])
+        self.instance_catalog_file = os.path.join(recording_dir, INSTANCE_CATALOG_FILE)
+
+    def _load(self, key):
+        path = _path(self.recording_dir, key)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt') as file:
+                recorded = json.load(file)
+            if recorded['key'] == key:
+                return recorded['result']
+        raise LookupError(f"Query not in the recording {self.recording_dir}: {key}")
+
+    def custom_query_range(self, query, start_time, end_time, step, params=None):
+        return self._load(_range_key(query, start_time, end_time, step))
+
+    def custom_query(self, query, params=None):
+        return self._load(_instant_key(query, params))
+
+
+class ReplayEC2:
+    """EC2 client of a replay, the recorded instance catalog has to answer every lookup."""
+
+    def __init__(self, recording_dir):
+        self.recording_dir = recording_dir
+
+    def describe_instance_types(self, InstanceTypes, **kwargs):
+        raise LookupError(f"Instance types not in the recording {self.recording_dir}: {', '.join(InstanceTypes)}")
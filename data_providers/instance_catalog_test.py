@@ -0,0 +1,107 @@
+import logging
+import time
+
+from botocore.exceptions import ClientError
+
+from data_providers.InstanceCatalog import InstanceCatalog, MAX_INSTANCE_TYPES_PER_CALL
+
+logger = logging.getLogger(__name__)
+
+
+def _instance_type(name):
+    return {'InstanceType': name,
+            'EbsInfo': {'EbsOptimizedInfo': {'BaselineBandwidthInMbps': 1000}},
+            'NetworkInfo': {'NetworkCards': [{'BaselineBandwidthInGbps': 10.0}]}}
+
+
+def _client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'DescribeInstanceTypes')
+
+
+class StubEC2:
+    """Answers DescribeInstanceTypes for known_types, page_size types per page, and records every call."""
+
+    def __init__(self, known_types=(), page_size=None, error=None):
+        self.known_types = set(known_types)
+        self.page_size = page_size
+        self.error = error
+        self.calls = []
+
+    def describe_instance_types(self, InstanceTypes, NextToken=None):
+        self.calls.append((list(InstanceTypes), NextToken))
+        if self.error is not None:
+            raise self.error
+        unknown = [t for t in InstanceTypes if t not in self.known_types]
+        if unknown:
+            raise _client_error('InvalidInstanceType')
+        start = int(NextToken or 0)
+        end = len(InstanceTypes) if self.page_size is None else start + self.page_size
+        res = {'InstanceTypes': [_instance_type(t) for t in InstanceTypes[start:end]]}
+        if end < len(InstanceTypes):
+            res['NextToken'] = str(end)
+        return res
+
+
+def test_batches_of_at_most_100_types():
+    types = [f"t{i}.large" for i in range(250)]
+    ec2 = StubEC2(types)
+    catalog = InstanceCatalog(ec2, logger)
+    catalog.ensure(types)
+    assert [len(call[0]) for call in ec2.calls] == [MAX_INSTANCE_TYPES_PER_CALL, MAX_INSTANCE_TYPES_PER_CALL, 50]
+    assert all(catalog.ebs_baseline_bandwidth(t) == 1000 for t in types)
+
+
+def test_follows_next_token():
+    types = ['m5.large', 'm5.xlarge', 'm5.2xlarge']
+    ec2 = StubEC2(types, page_size=2)
+    catalog = InstanceCatalog(ec2, logger)
+    catalog.ensure(types)
+    assert [call[1] for call in ec2.calls] == [None, '2']
+    assert all(catalog.network_bandwidth(t) is not None for t in types)
+
+
+def test_invalid_type_splits_the_batch_and_is_cached(tmp_path):
+    cache_file = str(tmp_path / 'catalog.json')
+    ec2 = StubEC2(['m5.large'])
+    catalog = InstanceCatalog(ec2, logger, cache_file=cache_file)
+    catalog.ensure(['m5.large', 'x9.unknown'])
+    assert len(ec2.calls) == 3
+    assert catalog.ebs_baseline_bandwidth('m5.large') == 1000
+    assert catalog.ebs_baseline_bandwidth('x9.unknown') is None
+
+    ec2 = StubEC2(['m5.large'])
+    InstanceCatalog(ec2, logger, cache_file=cache_file).ensure(['m5.large', 'x9.unknown'])
+    assert ec2.calls == []
+
+
+def test_transient_errors_are_not_cached(tmp_path):
+    cache_file = str(tmp_path / 'catalog.json')
+    for error in (_client_error('RequestLimitExceeded'), _client_error('ExpiredToken'), ConnectionError()):
+        ec2 = StubEC2(['m5.large', 'm5.xlarge'], error=error)
+        catalog = InstanceCatalog(ec2, logger, cache_file=cache_file)
+        catalog.ensure(['m5.large', 'm5.xlarge'])
+        # no split into single type calls and nothing remembered
+        assert len(ec2.calls) == 1
+        assert catalog.instance_types == {}
+
+    ec2 = StubEC2(['m5.large', 'm5.xlarge'])
+    catalog = InstanceCatalog(ec2, logger, cache_file=cache_file)
+    catalog.ensure(['m5.large', 'm5.xlarge'])
+    assert len(ec2.calls) == 1
+    assert catalog.ebs_baseline_bandwidth('m5.large') == 1000
+
+
+def test_expired_entries_are_looked_up_again(tmp_path):
+    cache_file = str(tmp_path / 'catalog.json')
+    ec2 = StubEC2(['m5.large'])
+    InstanceCatalog(ec2, logger, cache_file=cache_file, ttl_seconds=60).ensure(['m5.large'])
+    assert len(ec2.calls) == 1
+
+    catalog = InstanceCatalog(ec2, logger, cache_file=cache_file, ttl_seconds=60)
+    catalog.ensure(['m5.large'])
+    assert len(ec2.calls) == 1
+
+    catalog.instance_types['m5.large']['fetched_at'] = time.time() - 61
+    catalog.ensure(['m5.large'])
+    assert len(ec2.calls) == 2
+    assert catalog.instance_types['m5.large']['fetched_at'] > time.time() - 60
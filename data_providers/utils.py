@@ -1,2 +1,100 @@
+import datetime
+import functools
+import math
+import re
+import sys
+
+import numpy as np
+
+
+# suffix of the node labels that is dropped from node names
+EC2_INTERNAL_SUFFIX = re.compile(".ec2.internal")
+# prometheus may still be ingesting the scrapes of the last settle seconds of a window, see QueryCache
+SETTLE_SECONDS = 60
+
+
 def Gb_to_MB(val):
-    return val*125
\ No newline at end of file
+    return val*125
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_node_name(node_name):
+    # node names repeat in the series of every pod of the node, they are normalized once and interned so that all pods
+    # of a node share one string
+    return sys.intern(EC2_INTERNAL_SUFFIX.sub("", node_name))
+
+
+def settle_margin(step, rate_delta, settle_seconds=SETTLE_SECONDS):
+    # recent part of a window that is fetched again when the window slides forward: late scrapes still change the
+    # samples of the last settle_seconds and the rates over rate_delta minutes that include them. Whole steps, so the
+    # refetch stays on the step grid
+    seconds = max(rate_delta * 60, settle_seconds)
+    return datetime.timedelta(seconds=math.ceil(seconds / step) * step)
+
+
+def split_time_range(start_time, end_time, step, max_points):
+    # consecutive step aligned sub ranges [start, end] with at most max_points samples each, the next range starts one
+    # step after the previous one ends so no sample is fetched twice
+    step_delta = datetime.timedelta(seconds=step)
+    shard_delta = step_delta * max(max_points - 1, 0)
+    shards = []
+    shard_start = start_time
+    while True:
+        shard_end = min(shard_start + shard_delta, end_time)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end + step_delta
+        if shard_start > end_time:
+            break
+    return shards
+
+
+def merge_range_results(results):
+    # stitch the per shard results of one range query back together, series are matched on their full label set and
+    # samples at or before the last seen timestamp are dropped to avoid duplicates at shard boundaries. Merged series
+    # hold their samples as a (samples x 2) float array of timestamp, value rows
+    if len(results) == 1:
+        return results[0]
+    merged = {}
+    for res in results:
+        for _data in res:
+            key = tuple(sorted(_data['metric'].items()))
+            if key not in merged:
+                merged[key] = (_data['metric'], [])
+            merged[key][1].append(np.asarray(_data['values'], dtype=float).reshape(-1, 2))
+    merged_res = []
+    for metric, parts in merged.values():
+        kept = []
+        last_ts = -np.inf
+        for part in parts:
+            part = part[part[:, 0] > last_ts]
+            if len(part) > 0:
+                kept.append(part)
+                last_ts = part[-1, 0]
+        merged_res.append({'metric': metric, 'values': np.concatenate(kept) if kept else np.empty((0, 2))})
+    return merged_res
+
+
+def subquery_range(start_time, end_time, step):
+    # range selector covering [start_time, end_time] at step resolution, for evaluating a range query as a subquery.
+    # half a step is added so that the sample at start_time is included whether the range is left open or closed
+    return f"[{round((end_time - start_time).total_seconds() * 1000 + step * 500)}ms:{step}s]"
+
+
+def series_changed(values):
+    return any(value[1] != values[0][1] for value in values)
+
+
+def instant_as_range_result(value_res, changes_res):
+    # shape instant query results like range results holding a single sample, with 'changed' set for the series that
+    # have a non zero count in the matching changes() result
+    changed = {tuple(sorted(_data['metric'].items())) for _data in changes_res if float(_data['value'][1]) > 0}
+    return [{'metric': _data['metric'],
+             'values': [_data['value']],
+             'changed': tuple(sorted(_data['metric'].items())) in changed} for _data in value_res]
+
+
+def align_time_range(start_time, end_time, step):
+    # snap both ends down to a multiple of step so that repeated runs query the same timestamp grid
+    start = math.floor(start_time.timestamp() / step) * step
+    end = math.floor(end_time.timestamp() / step) * step
+    return datetime.datetime.fromtimestamp(start), datetime.datetime.fromtimestamp(end)
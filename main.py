@@ -1,12 +1,14 @@
 import argparse
 import datetime
-import os
+import functools
+import math
 import time
 import prometheus_api_client
 import boto3
 import config
 import logging
 import pandas as pd
+import profiling
 
 from Flaggers.CupritIdentifiers import mark_culprit_pods_for_high_cpu, mark_culprit_pods_for_high_memory, \
     mark_culprit_pods_for_high_rx_bytes
@@ -20,10 +22,24 @@ from Flaggers.NodeRXBytesFlagger import flag_nodes_by_high_probability_of_high_n
     flag_nodes_by_high_avg_network_rx_bytes
 from Flaggers.NodeTXBytesFlagger import flag_nodes_by_high_probability_of_high_network_tx_bytes, \
     flag_nodes_by_high_avg_network_tx_bytes
+from Flaggers.ExceedanceEngine import compute_node_exceedances
 from Flaggers.PodFlaggers import flag_pods_by_wrong_node_placement_by_requests, flag_pods_for_wrong_cpu_requests, \
-    flag_pods_for_wrong_memory_requests
+    flag_pods_for_wrong_memory_requests, calculate_skewness, pods_with_wrong_cpu_requests, \
+    pods_with_wrong_memory_requests, POD_CPU_REQUEST_COLUMNS, POD_MEMORY_REQUEST_COLUMNS
+from Flaggers.WindowFlaggers import select_nodes_by_window_stats, select_pods_by_window_stats
+from Flaggers.utils import NODE_RESOURCES, get_node_limit, get_usage_summary
+from data_providers.InstanceCatalog import InstanceCatalog
 from data_providers.NodeDataProvider import NodeDataProvider
 from data_providers.PodDataProvider import PodDataProvider
+from data_providers.QueryCache import QueryCache
+from data_providers.PrometheusTransport import TransportStats, create_prometheus_session
+from data_providers.QueryExecutor import QueryExecutor
+from data_providers.QueryRecording import QueryRecorder, QueryReplay, ReplayEC2
+from data_providers.utils import align_time_range
+from reports.MetricsExporter import MetricsExporter, MetricsSnapshot
+from reports.ReportPlanner import REPORT_KINDS, RESOURCES, plan_queries, select_reports
+from reports.ReportScheduler import ReportScheduler
+from reports.ReportSinks import create_report_sink
 
 
 def get_logger(logs_output_file_path='./logs.log'):
@@ -51,9 +67,11 @@ def get_start_and_end_time(timeDelta):
     return start, end
 
 
-def get_prometheus_client(prometheus_endpoint):
+def get_prometheus_client(prometheus_endpoint, pool_size=1, timeout=None, transport_stats=None):
     try:
         prometheus_api = prometheus_api_client.PrometheusConnect(prometheus_endpoint)
+        # PrometheusConnect has no way to pass in a session, swap in the pooled and compressed one shared by all queries
+        prometheus_api._session = create_prometheus_session(prometheus_endpoint, pool_size, timeout, transport_stats)
         return prometheus_api
     except Exception as e:
         exit(0)
@@ -64,25 +82,76 @@ def get_ec2_client(region_name):
     return ec2_client
 
 
-def get_data_providers(start, end):
-    prometheus_api = get_prometheus_client(config.PROMETHEUS_URL)
-    ec2_client = get_ec2_client(config.AWS_REGION)
+def get_node_usage_thresholds():
+    # resource -> threshold of the node flaggers, as a fraction of the node limit
+    return {
+        'cpu': config.NODE_CPU_UTILIZATION_THRESHOLD,
+        'memory': config.NODE_MEMORY_UTILIZATION_THRESHOLD,
+        'rx bytes': config.NODE_RX_BYTES_USAGE_THRESHOLD,
+        'tx bytes': config.NODE_TX_BYTES_USAGE_THRESHOLD,
+        'disk total bytes': config.NODE_DISK_BYTES_USAGE_THRESHOLD,
+    }
+
+
+def get_node_summary_thresholds():
+    # usage metric -> (threshold, node limit function) of the node probability flaggers
+    return {NODE_RESOURCES[resource][0]: (threshold, functools.partial(get_node_limit, resource=resource))
+            for resource, threshold in get_node_usage_thresholds().items()}
+
+
+def get_data_providers(start, end, transport_stats=None, node_usage_summaries=False, reports=None, prometheus_api=None,
+                       instance_catalog=None):
+    # with reports, the providers only fetch the queries those reports read. prometheus_api replaces the client of
+    # config.PROMETHEUS_URL, e.g. with a QueryRecorder or a QueryReplay, and instance_catalog the catalog of
+    # config.INSTANCE_CATALOG_FILE
+    recording = prometheus_api is not None
+    if prometheus_api is None:
+        prometheus_api = get_prometheus_client(config.PROMETHEUS_URL,
+                                               config.MAX_CONCURRENT_QUERIES,
+                                               config.PROMETHEUS_QUERY_TIMEOUT,
+                                               transport_stats)
+    if instance_catalog is None:
+        instance_catalog = InstanceCatalog(get_ec2_client(config.AWS_REGION),
+                                           logger,
+                                           config.NETWORK_BANDWIDTH_FILE_PATH,
+                                           config.INSTANCE_CATALOG_FILE,
+                                           config.INSTANCE_CATALOG_TTL)
+    query_cache = None
+    # recorded and replayed runs send every query in full, a recording does not depend on the state of the cache
+    if config.QUERY_CACHE_DIR is not None and not recording:
+        query_cache = QueryCache(config.QUERY_CACHE_DIR, config.QUERY_CACHE_MAX_BYTES, logger)
+    query_executor = QueryExecutor(prometheus_api,
+                                   logger,
+                                   config.MAX_CONCURRENT_QUERIES,
+                                   config.MAX_POINTS_PER_QUERY,
+                                   query_cache)
+    node_queries, pod_queries = (None, None) if reports is None else plan_queries(reports)
     node_data_provider = NodeDataProvider(
         prometheus_api,
-        ec2_client,
+        instance_catalog.ec2_client,
         start,
         end,
         config.STEP,
         config.RATE_DELTA,
         logger,
-        config.NETWORK_BANDWIDTH_FILE_PATH)
+        config.NETWORK_BANDWIDTH_FILE_PATH,
+        query_executor,
+        config.INSTANT_STATIC_QUERIES,
+        instance_catalog,
+        get_node_summary_thresholds() if node_usage_summaries else None,
+        node_queries,
+        config.LOCAL_NODE_NAME_JOIN)
     pod_data_provider = PodDataProvider(
         prometheus_api,
         start,
         end,
         config.STEP,
         config.RATE_DELTA,
-        logger)
+        logger,
+        query_executor,
+        config.INSTANT_STATIC_QUERIES,
+        pod_queries,
+        node_data_provider.node_names_by_instance)
     return node_data_provider, pod_data_provider
 
 
@@ -94,25 +163,26 @@ def create_report_info(report_writer, start, end):
         ["end time", end]
     ]
     df = pd.DataFrame(info)
-    df.to_excel(report_writer, sheet_name="report info", index=False)
+    report_writer.write_sheet("report info", df)
 
 
 def create_wrong_pod_placement_report(report_writer, pod_data, node_data, logger):
     wrong_pod_placement_report = flag_pods_by_wrong_node_placement_by_requests(logger, pod_data, node_data,
                                                                                config.POD_SKEWNESS_THRESHOLD)
-    wrong_pod_placement_report.to_excel(report_writer, sheet_name="Pod placement report", index=False)
+    report_writer.write_sheet("Pod placement report", wrong_pod_placement_report)
 
 
 def create_pod_cpu_usage_vs_request_report(report_writer, pod_data, logger):
-    pod_cpu_report = flag_pods_for_wrong_cpu_requests(logger, pod_data, config.POD_REQUEST_MARGIN_FACTOR,
-                                                      config.REQUEST_DIFFERENCE_THRESHOLD)
-    pod_cpu_report.to_excel(report_writer, sheet_name="Pod CPU Usage vs Request", index=False)
+    # one row per flagged pod, written as the pods are flagged
+    pod_cpu_rows = pods_with_wrong_cpu_requests(logger, pod_data, config.POD_REQUEST_MARGIN_FACTOR,
+                                                config.REQUEST_DIFFERENCE_THRESHOLD)
+    report_writer.write_rows("Pod CPU Usage vs Request", POD_CPU_REQUEST_COLUMNS, pod_cpu_rows)
 
 
 def create_pod_memory_usage_vs_request_report(report_writer, pod_data, logger):
-    pod_memory_report = flag_pods_for_wrong_memory_requests(logger, pod_data, config.POD_REQUEST_MARGIN_FACTOR,
-                                                            config.REQUEST_DIFFERENCE_THRESHOLD)
-    pod_memory_report.to_excel(report_writer, sheet_name="Pod Memory Usage vs Request", index=False)
+    pod_memory_rows = pods_with_wrong_memory_requests(logger, pod_data, config.POD_REQUEST_MARGIN_FACTOR,
+                                                      config.REQUEST_DIFFERENCE_THRESHOLD)
+    report_writer.write_rows("Pod Memory Usage vs Request", POD_MEMORY_REQUEST_COLUMNS, pod_memory_rows)
 
 
 def group_pods_by_nodes(pod_data):
@@ -124,11 +194,13 @@ def group_pods_by_nodes(pod_data):
     return node_pod_dict
 
 
-def create_bad_nodes_by_high_cpu_report(report_writer, node_data, node_pod_dict, logger):
+def create_bad_nodes_by_high_cpu_report(report_writer, node_data, node_pod_dict, logger, load_node_series=None,
+                                        exceedances=None):
     bad_nodes_by_high_occurrence_of_high_cpu_usage = flag_nodes_by_high_probability_of_high_cpu_utilization(logger,
                                                                                                             node_data,
                                                                                                             config.NODE_CPU_UTILIZATION_THRESHOLD,
-                                                                                                            config.NODE_CPU_HIGH_UTIL_EXP_PROB)
+                                                                                                            config.NODE_CPU_HIGH_UTIL_EXP_PROB,
+                                                                                                            exceedances)
     bad_nodes_by_high_avg_cpu_usage = flag_nodes_by_high_avg_cpu_utilization(logger,
                                                                              node_data,
                                                                              config.NODE_CPU_UTILIZATION_THRESHOLD)
@@ -136,119 +208,381 @@ def create_bad_nodes_by_high_cpu_report(report_writer, node_data, node_pod_dict,
 
     bad_nodes.drop_duplicates(inplace=True)
 
-    bad_nodes.to_excel(report_writer, sheet_name="High CPU nodes", index=False)
+    report_writer.write_sheet("High CPU nodes", bad_nodes)
+    if load_node_series is not None:
+        load_node_series(node_data, 'cpu_usage', bad_nodes['node name'])
     possible_culprit_pods = mark_culprit_pods_for_high_cpu(bad_nodes,
                                                            node_pod_dict,
                                                            node_data,
                                                            config.MIN_WINDOW_DIFF,
                                                            config.MAX_WINDOW_SIZE,
-                                                           config.NODE_CPU_UTILIZATION_THRESHOLD)
-    possible_culprit_pods.to_excel(report_writer, sheet_name="Culprits for high cpu nodes", index=False)
+                                                           config.NODE_CPU_UTILIZATION_THRESHOLD,
+                                                           config.CULPRITS_PER_WINDOW)
+    report_writer.write_sheet("Culprits for high cpu nodes", possible_culprit_pods)
 
 
-def create_bad_nodes_by_high_memory_report(report_writer, node_data, node_pod_dict, logger):
+def create_bad_nodes_by_high_memory_report(report_writer, node_data, node_pod_dict, logger, load_node_series=None,
+                                           exceedances=None):
     bad_nodes_by_high_occurrence_of_high_memory_usage = flag_nodes_by_high_probability_of_high_memory_utilization(
         logger,
         node_data,
         config.NODE_MEMORY_UTILIZATION_THRESHOLD,
-        config.NODE_MEMORY_HIGH_UTIL_EXP_PROB)
+        config.NODE_MEMORY_HIGH_UTIL_EXP_PROB,
+        exceedances)
     bad_nodes_by_high_avg_memory_usage = flag_nodes_by_high_avg_memory_utilization(logger,
                                                                                    node_data,
                                                                                    config.NODE_MEMORY_UTILIZATION_THRESHOLD)
     bad_nodes = pd.concat([bad_nodes_by_high_occurrence_of_high_memory_usage, bad_nodes_by_high_avg_memory_usage])
     bad_nodes.drop_duplicates(inplace=True)
-    bad_nodes.to_excel(report_writer, sheet_name="High Memory Util Nodes", index=False)
+    report_writer.write_sheet("High Memory Util Nodes", bad_nodes)
 
+    if load_node_series is not None:
+        load_node_series(node_data, 'memory_usage', bad_nodes['node name'])
     possible_culprit_pods = mark_culprit_pods_for_high_memory(bad_nodes,
                                                               node_pod_dict,
                                                               node_data,
                                                               config.MIN_WINDOW_DIFF,
                                                               config.MAX_WINDOW_SIZE,
-                                                              config.NODE_MEMORY_UTILIZATION_THRESHOLD)
-    possible_culprit_pods.to_excel(report_writer, sheet_name="Culprits for high memory nodes", index=False)
+                                                              config.NODE_MEMORY_UTILIZATION_THRESHOLD,
+                                                              config.CULPRITS_PER_WINDOW)
+    report_writer.write_sheet("Culprits for high memory nodes", possible_culprit_pods)
 
 
-def create_bad_nodes_by_high_rx_bytes_report(report_writer, node_data, node_pod_dict, logger):
+def create_bad_nodes_by_high_rx_bytes_report(report_writer, node_data, node_pod_dict, logger, load_node_series=None,
+                                             exceedances=None):
     bad_nodes_by_high_occurrence_of_high_rx_bytes_usage = flag_nodes_by_high_probability_of_high_network_rx_bytes(
         logger,
         node_data,
         config.NODE_RX_BYTES_USAGE_THRESHOLD,
-        config.NODE_NETWORK_BYTES_PROB_LIMIT)
+        config.NODE_NETWORK_BYTES_PROB_LIMIT,
+        exceedances)
     bad_nodes_by_high_avg_rx_bytes_usage = flag_nodes_by_high_avg_network_rx_bytes(logger,
                                                                                    node_data,
                                                                                    config.NODE_RX_BYTES_USAGE_THRESHOLD)
     bad_nodes = pd.concat([bad_nodes_by_high_occurrence_of_high_rx_bytes_usage, bad_nodes_by_high_avg_rx_bytes_usage])
     bad_nodes.drop_duplicates(inplace=True)
-    bad_nodes.to_excel(report_writer, sheet_name="High RX bytes nodes", index=False)
+    report_writer.write_sheet("High RX bytes nodes", bad_nodes)
+    if load_node_series is not None:
+        load_node_series(node_data, 'network_rx_bytes', bad_nodes['node name'])
     possible_culprit_pods = mark_culprit_pods_for_high_rx_bytes(bad_nodes,
                                                                 node_pod_dict,
                                                                 node_data,
                                                                 config.MIN_WINDOW_DIFF,
                                                                 config.MAX_WINDOW_SIZE,
-                                                                config.NODE_RX_BYTES_USAGE_THRESHOLD)
-    possible_culprit_pods.to_excel(report_writer, sheet_name="Culprit pods for high rx bytes", index=False)
+                                                                config.NODE_RX_BYTES_USAGE_THRESHOLD,
+                                                                config.CULPRITS_PER_WINDOW)
+    report_writer.write_sheet("Culprit pods for high rx bytes", possible_culprit_pods)
 
 
-def create_bad_nodes_by_high_tx_bytes_report(report_writer, node_data, node_pod_dict, logger):
+def create_bad_nodes_by_high_tx_bytes_report(report_writer, node_data, node_pod_dict, logger, load_node_series=None,
+                                             exceedances=None):
     bad_nodes_by_high_occurrence_of_high_tx_bytes_usage = flag_nodes_by_high_probability_of_high_network_tx_bytes(
         logger,
         node_data,
         config.NODE_TX_BYTES_USAGE_THRESHOLD,
-        config.NODE_NETWORK_BYTES_PROB_LIMIT)
+        config.NODE_NETWORK_BYTES_PROB_LIMIT,
+        exceedances)
     bad_nodes_by_high_avg_tx_bytes_usage = flag_nodes_by_high_avg_network_tx_bytes(logger,
                                                                                    node_data,
                                                                                    config.NODE_TX_BYTES_USAGE_THRESHOLD)
     bad_nodes = pd.concat([bad_nodes_by_high_occurrence_of_high_tx_bytes_usage, bad_nodes_by_high_avg_tx_bytes_usage])
     bad_nodes.drop_duplicates(inplace=True)
-    bad_nodes.to_excel(report_writer, sheet_name="High TX bytes nodes", index=False)
+    report_writer.write_sheet("High TX bytes nodes", bad_nodes)
 
+    if load_node_series is not None:
+        # the culprit analysis below reads the rx series
+        load_node_series(node_data, 'network_rx_bytes', bad_nodes['node name'])
     possible_culprit_pods = mark_culprit_pods_for_high_rx_bytes(bad_nodes,
                                                                 node_pod_dict,
                                                                 node_data,
                                                                 config.MIN_WINDOW_DIFF,
                                                                 config.MAX_WINDOW_SIZE,
-                                                                config.NODE_TX_BYTES_USAGE_THRESHOLD)
-    possible_culprit_pods.to_excel(report_writer, sheet_name="Culprits for high tx bytes", index=False)
+                                                                config.NODE_TX_BYTES_USAGE_THRESHOLD,
+                                                                config.CULPRITS_PER_WINDOW)
+    report_writer.write_sheet("Culprits for high tx bytes", possible_culprit_pods)
 
 
-def create_bad_nodes_by_high_disk_total_report(report_writer, node_data, node_pod_dict, logger):
+def create_bad_nodes_by_high_disk_total_report(report_writer, node_data, node_pod_dict, logger, load_node_series=None,
+                                               exceedances=None):
     bad_nodes_by_high_occurrence_of_high_disk_total_bytes_usage = flag_nodes_by_high_probability_of_high_disk_total_bytes(
         logger,
         node_data,
         config.NODE_DISK_BYTES_USAGE_THRESHOLD,
-        config.NODE_DISK_TOTAL_BYTES_PROB_LIMIT)
+        config.NODE_DISK_TOTAL_BYTES_PROB_LIMIT,
+        exceedances)
     bad_nodes_by_high_avg_disk_total_bytes_usage = flag_nodes_by_high_avg_disk_total_bytes(logger,
                                                                                            node_data,
                                                                                            config.NODE_DISK_BYTES_USAGE_THRESHOLD)
     bad_nodes = pd.concat(
         [bad_nodes_by_high_occurrence_of_high_disk_total_bytes_usage, bad_nodes_by_high_avg_disk_total_bytes_usage])
     bad_nodes.drop_duplicates(inplace=True)
-    bad_nodes.to_excel(report_writer, sheet_name="High Disk total bytes nodes", index=False)
+    report_writer.write_sheet("High Disk total bytes nodes", bad_nodes)
 
+    if load_node_series is not None:
+        # the culprit analysis below reads the rx series
+        load_node_series(node_data, 'network_rx_bytes', bad_nodes['node name'])
     possible_culprit_pods = mark_culprit_pods_for_high_rx_bytes(bad_nodes,
                                                                 node_pod_dict,
                                                                 node_data,
                                                                 config.MIN_WINDOW_DIFF,
                                                                 config.MAX_WINDOW_SIZE,
-                                                                config.NODE_DISK_BYTES_USAGE_THRESHOLD)
-    possible_culprit_pods.to_excel(report_writer, sheet_name="Culprits for high disk bytes", index=False)
+                                                                config.NODE_DISK_BYTES_USAGE_THRESHOLD,
+                                                                config.CULPRITS_PER_WINDOW)
+    report_writer.write_sheet("Culprits for high disk bytes", possible_culprit_pods)
+
+
+# report (see reports.ReportPlanner) -> function creating it
+POD_REQUEST_REPORTS = {
+    'pod cpu': create_pod_cpu_usage_vs_request_report,
+    'pod memory': create_pod_memory_usage_vs_request_report,
+}
+NODE_USAGE_REPORTS = {
+    'cpu': create_bad_nodes_by_high_cpu_report,
+    'memory': create_bad_nodes_by_high_memory_report,
+    'rx bytes': create_bad_nodes_by_high_rx_bytes_report,
+    'tx bytes': create_bad_nodes_by_high_tx_bytes_report,
+    'disk total bytes': create_bad_nodes_by_high_disk_total_report,
+}
+
+
+def create_report(output_file_path, start, end, node_data, pod_data, logger, candidates=None, load_node_series=None,
+                  reports=None):
+    # candidates maps a usage report to the nodes or pods it has to check, by default every report checks all of them.
+    # load_node_series fetches the raw series of flagged nodes that only have usage summaries.
+    # reports restricts the report to those sheets (see reports.ReportPlanner), the report info is always written
+    candidates = candidates or {}
+    reports = select_reports() if reports is None else reports
+    node_pod_dict = group_pods_by_nodes(pod_data)
+    # the reports only read node_data and pod_data, they are computed in parallel and written in this order
+    scheduler = ReportScheduler(config.REPORT_WORKERS)
+    scheduler.submit(create_report_info, start, end)
+    if 'placement' in reports:
+        scheduler.submit(create_wrong_pod_placement_report, pod_data, node_data, logger)
+    for report, create_pod_report in POD_REQUEST_REPORTS.items():
+        if report in reports:
+            # a row per pod, streamed into the report writer instead of buffered
+            scheduler.stream(create_pod_report, candidates.get(report, pod_data), logger)
+    # the exceedance counts of all node reports in one pass over the usage matrices, each report reads its resource
+    thresholds = get_node_usage_thresholds()
+    exceedances = compute_node_exceedances(node_data, {report: thresholds[report]
+                                                       for report in NODE_USAGE_REPORTS if report in reports})
+    for report, create_node_report in NODE_USAGE_REPORTS.items():
+        if report in reports:
+            scheduler.submit(create_node_report, candidates.get(report, node_data), node_pod_dict, logger,
+                             load_node_series, exceedances[report])
+    report_writer = create_report_sink(config.REPORT_FORMAT, output_file_path)
+    scheduler.write_to(report_writer)
+    report_writer.close()
+
+
+def select_report_candidates(node_data, pod_data, node_metric_store, pod_metric_store, reports=None):
+    reports = select_reports() if reports is None else reports
+    # resource -> threshold and probability limit of the node flaggers
+    node_limits = {
+        'cpu': (config.NODE_CPU_UTILIZATION_THRESHOLD, config.NODE_CPU_HIGH_UTIL_EXP_PROB),
+        'memory': (config.NODE_MEMORY_UTILIZATION_THRESHOLD, config.NODE_MEMORY_HIGH_UTIL_EXP_PROB),
+        'rx bytes': (config.NODE_RX_BYTES_USAGE_THRESHOLD, config.NODE_NETWORK_BYTES_PROB_LIMIT),
+        'tx bytes': (config.NODE_TX_BYTES_USAGE_THRESHOLD, config.NODE_NETWORK_BYTES_PROB_LIMIT),
+        'disk total bytes': (config.NODE_DISK_BYTES_USAGE_THRESHOLD, config.NODE_DISK_TOTAL_BYTES_PROB_LIMIT),
+    }
+    candidates = {}
+    for report in POD_REQUEST_REPORTS:
+        if report in reports:
+            candidates[report] = select_pods_by_window_stats(pod_data, pod_metric_store, report[len('pod '):],
+                                                             config.POD_REQUEST_MARGIN_FACTOR,
+                                                             config.REQUEST_DIFFERENCE_THRESHOLD)
+    for report, (threshold, prob_limit) in node_limits.items():
+        if report in reports:
+            candidates[report] = select_nodes_by_window_stats(node_data, node_metric_store, report, threshold,
+                                                              prob_limit)
+    return candidates
+
+
+def create_metrics_snapshot(node_data, pod_data, logger, candidates=None, reports=None):
+    # the flag results as gauges for the exporter mode, candidates and reports restrict the flaggers like in
+    # create_report
+    candidates = candidates or {}
+    reports = select_reports() if reports is None else reports
+    snapshot = MetricsSnapshot()
+    node_flaggers = {
+        'cpu': (flag_nodes_by_high_avg_cpu_utilization, flag_nodes_by_high_probability_of_high_cpu_utilization,
+                config.NODE_CPU_UTILIZATION_THRESHOLD, config.NODE_CPU_HIGH_UTIL_EXP_PROB),
+        'memory': (flag_nodes_by_high_avg_memory_utilization, flag_nodes_by_high_probability_of_high_memory_utilization,
+                   config.NODE_MEMORY_UTILIZATION_THRESHOLD, config.NODE_MEMORY_HIGH_UTIL_EXP_PROB),
+        'rx bytes': (flag_nodes_by_high_avg_network_rx_bytes, flag_nodes_by_high_probability_of_high_network_rx_bytes,
+                     config.NODE_RX_BYTES_USAGE_THRESHOLD, config.NODE_NETWORK_BYTES_PROB_LIMIT),
+        'tx bytes': (flag_nodes_by_high_avg_network_tx_bytes, flag_nodes_by_high_probability_of_high_network_tx_bytes,
+                     config.NODE_TX_BYTES_USAGE_THRESHOLD, config.NODE_NETWORK_BYTES_PROB_LIMIT),
+        'disk total bytes': (flag_nodes_by_high_avg_disk_total_bytes,
+                             flag_nodes_by_high_probability_of_high_disk_total_bytes,
+                             config.NODE_DISK_BYTES_USAGE_THRESHOLD, config.NODE_DISK_TOTAL_BYTES_PROB_LIMIT),
+    }
+    node_flaggers = {resource: flaggers for resource, flaggers in node_flaggers.items() if resource in reports}
+    exceedances = compute_node_exceedances(node_data, {resource: flaggers[2]
+                                                       for resource, flaggers in node_flaggers.items()})
+    for resource, (avg_flagger, probability_flagger, threshold, prob_limit) in node_flaggers.items():
+        for node_name, (above, samples) in exceedances[resource].items():
+            snapshot.add('node_exceedance_ratio',
+                         "Share of the node's usage samples above the threshold of the node flaggers",
+                         {'resource': resource, 'node': node_name}, above / samples if samples else None)
+        for node_name, node in node_data.items():
+            summary = get_usage_summary(node, NODE_RESOURCES[resource][0])
+            limit = get_node_limit(node, resource)
+            if summary is not None and limit:
+                snapshot.add('node_avg_utilization_ratio', "Average usage of the node as a fraction of its limit",
+                             {'resource': resource, 'node': node_name}, summary.mean / limit)
+        nodes = candidates.get(resource, node_data)
+        for reason, table in (('high avg', avg_flagger(logger, nodes, threshold)),
+                              ('high probability', probability_flagger(logger, nodes, threshold, prob_limit,
+                                                                       exceedances[resource]))):
+            for row in table.itertuples(index=False, name=None):
+                snapshot.add('node_flagged', "1 for every node the node flaggers flagged",
+                             {'resource': resource, 'reason': reason, 'node': row[0], 'instance_type': row[1]}, 1)
+    for resource, flagger in (('cpu', flag_pods_for_wrong_cpu_requests),
+                              ('memory', flag_pods_for_wrong_memory_requests)):
+        if 'pod ' + resource not in reports:
+            continue
+        table = flagger(logger, candidates.get('pod ' + resource, pod_data), config.POD_REQUEST_MARGIN_FACTOR,
+                        config.REQUEST_DIFFERENCE_THRESHOLD)
+        for row in table.itertuples(index=False, name=None):
+            labels = {'resource': resource, 'namespace': row[0], 'pod': row[1]}
+            snapshot.add('pod_request', "Request of a pod flagged for a wrong request", labels, row[2])
+            snapshot.add('pod_suggested_request', "Suggested request of a pod flagged for a wrong request", labels,
+                         row[-1])
+    if 'placement' in reports:
+        placement = flag_pods_by_wrong_node_placement_by_requests(logger, pod_data, node_data,
+                                                                  config.POD_SKEWNESS_THRESHOLD)
+        for row in placement.itertuples(index=False, name=None):
+            snapshot.add('pod_placement_skewness',
+                         "Skewness of the cpu/memory request ratio of a flagged pod against the ratio of its node",
+                         {'namespace': row[0], 'pod': row[1], 'node': row[2]}, calculate_skewness(row[4], row[5]))
+    return snapshot
+
+
+def run_daemon(logger, interval, publish, reports=None):
+    # keeps the window in memory and slides it forward every interval seconds, each tick only fetches the new steps
+    # and only runs the flaggers on the nodes and pods the running window aggregates select.
+    # publish(start, end, node_data, pod_data, candidates) writes out the results of a tick, reports restricts the
+    # fetched queries and the candidates to those reports
+    steps_per_tick = max(1, interval // config.STEP)
+    start, end = align_time_range(*get_start_and_end_time(config.TIMEDELTA), config.STEP)
+    transport_stats = TransportStats()
+    node_data_provider, pod_data_provider = get_data_providers(start, end, transport_stats, reports=reports)
+    node_data_provider.prefetch()
+    pod_data_provider.prefetch()
+    node_data = node_data_provider.get_data()
+    pod_data = pod_data_provider.get_data()
+    while True:
+        candidates = select_report_candidates(node_data, pod_data, node_data_provider.metric_store,
+                                              pod_data_provider.metric_store, reports)
+        publish(node_data_provider.start_time, node_data_provider.end_time, node_data, pod_data, candidates)
+        logger.info(f"Results published for window ending at {node_data_provider.end_time}, "
+                    f"{transport_stats.summary()}")
+
+        next_end = node_data_provider.end_time + datetime.timedelta(seconds=steps_per_tick * config.STEP)
+        time.sleep(max(0.0, (next_end - datetime.datetime.now()).total_seconds()))
+        steps = int((datetime.datetime.now() - node_data_provider.end_time).total_seconds() // config.STEP)
+        if steps <= 0:
+            continue
+        node_data_provider.advance(steps)
+        pod_data_provider.advance(steps)
+        node_data_provider.prefetch()
+        pod_data_provider.prefetch()
+        node_data = node_data_provider.update_data()
+        pod_data = pod_data_provider.update_data()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and rewrite the report every DAEMON_INTERVAL seconds")
+    parser.add_argument('--exporter', action='store_true',
+                        help="instead of writing a report, serve the flag results on :EXPORTER_PORT/metrics and "
+                             "refresh them every DAEMON_INTERVAL seconds")
+    parser.add_argument('--profile', metavar='TRACE_FILE',
+                        help="record wall/cpu time and peak memory of every phase of a single run and the "
+                             "latency, size, series and sample count of every query, write them as a chrome trace "
+                             "(chrome://tracing, perfetto) to TRACE_FILE and log a summary table")
+    parser.add_argument('--record', metavar='RECORDING_DIR',
+                        help="save the response of every prometheus query of a single run to RECORDING_DIR")
+    parser.add_argument('--replay', metavar='RECORDING_DIR',
+                        help="run offline on the responses recorded in RECORDING_DIR instead of querying prometheus, "
+                             "the recorded window is analysed with the same configuration it was recorded with")
+    parser.add_argument('--prometheus-url', metavar='URL',
+                        help="query the prometheus at URL instead of PROMETHEUS_URL, e.g. a local "
+                             "benchmarks.MockPrometheus server")
+    parser.add_argument('--reports', nargs='+', choices=REPORT_KINDS, metavar='REPORT',
+                        help=f"only create these reports ({', '.join(REPORT_KINDS)}) and only fetch the queries they "
+                             "need, all of them by default")
+    # resources are written with dashes on the command line
+    resource_choices = [resource.replace(' ', '-') for resource in RESOURCES]
+    parser.add_argument('--resources', nargs='+', choices=resource_choices, metavar='RESOURCE',
+                        help=f"only create the pod request and node usage reports of these resources "
+                             f"({', '.join(resource_choices)}), all of them by default")
+    args = parser.parse_args()
+    if args.daemon and args.exporter:
+        # both modes run their own loop forever, the second one would never start
+        parser.error("--daemon and --exporter cannot be combined, run one process for each")
+    if args.profile and (args.daemon or args.exporter):
+        # the daemon modes never return, the trace of a single run would never be written
+        parser.error("--profile profiles a single run, it cannot be combined with --daemon or --exporter")
     logger = get_logger()
-    report_writer = pd.ExcelWriter(config.OUTPUT_FILE_PATH, engine='xlsxwriter')
+    if args.prometheus_url is not None:
+        config.PROMETHEUS_URL = args.prometheus_url
+    reports = None
+    if args.reports is not None or args.resources is not None:
+        reports = select_reports(args.reports,
+                                 None if args.resources is None else [r.replace('-', ' ') for r in args.resources])
+        logger.info(f"Creating the reports {', '.join(reports) or 'info only'}")
+    profiler = profiling.enable() if args.profile else None
+    if args.exporter:
+        exporter = MetricsExporter(config.EXPORTER_PORT, logger)
+        exporter.start()
+        run_daemon(logger, config.DAEMON_INTERVAL,
+                   lambda start, end, node_data, pod_data, candidates:
+                   exporter.publish(create_metrics_snapshot(node_data, pod_data, logger, candidates, reports)),
+                   reports)
+    if args.daemon:
+        # the report sinks swap every file in once it is complete, readers never see a half written report
+        run_daemon(logger, config.DAEMON_INTERVAL,
+                   lambda start, end, node_data, pod_data, candidates:
+                   create_report(config.OUTPUT_FILE_PATH, start, end, node_data, pod_data, logger, candidates,
+                                 reports=reports),
+                   reports)
     start, end = get_start_and_end_time(config.TIMEDELTA)
-    node_data_provider, pod_data_provider = get_data_providers(start, end)
+    if config.QUERY_CACHE_DIR is not None or config.NODE_USAGE_SUMMARIES_IN_PROMETHEUS:
+        start, end = align_time_range(start, end, config.STEP)
+    transport_stats = TransportStats()
+    prometheus_api = None
+    instance_catalog = None
+    if args.replay:
+        prometheus_api = QueryReplay(args.replay)
+        start, end = prometheus_api.start_time, prometheus_api.end_time
+        # the recorded catalog never expires, types missing from it stay unknown
+        instance_catalog = InstanceCatalog(ReplayEC2(args.replay), logger, config.NETWORK_BANDWIDTH_FILE_PATH,
+                                           prometheus_api.instance_catalog_file, math.inf)
+    elif args.record:
+        prometheus_api = QueryRecorder(get_prometheus_client(config.PROMETHEUS_URL,
+                                                             config.MAX_CONCURRENT_QUERIES,
+                                                             config.PROMETHEUS_QUERY_TIMEOUT,
+                                                             transport_stats),
+                                       args.record, start, end, logger)
+    node_data_provider, pod_data_provider = get_data_providers(start, end, transport_stats,
+                                                               config.NODE_USAGE_SUMMARIES_IN_PROMETHEUS, reports,
+                                                               prometheus_api, instance_catalog)
+    node_data_provider.prefetch()
+    pod_data_provider.prefetch()
     node_data = node_data_provider.get_data()
     pod_data = pod_data_provider.get_data()
-    create_report_info(report_writer,start,end)
-    create_wrong_pod_placement_report(report_writer, pod_data, node_data, logger)
-    create_pod_cpu_usage_vs_request_report(report_writer, pod_data, logger)
-    create_pod_memory_usage_vs_request_report(report_writer, pod_data, logger)
-    node_pod_dict = group_pods_by_nodes(pod_data)
-    create_bad_nodes_by_high_cpu_report(report_writer, node_data, node_pod_dict, logger)
-    create_bad_nodes_by_high_memory_report(report_writer, node_data, node_pod_dict, logger)
-    create_bad_nodes_by_high_rx_bytes_report(report_writer, node_data, node_pod_dict, logger)
-    create_bad_nodes_by_high_tx_bytes_report(report_writer, node_data, node_pod_dict, logger)
-    create_bad_nodes_by_high_disk_total_report(report_writer, node_data, node_pod_dict, logger)
-    report_writer.close()
+    if args.record:
+        prometheus_api.record_instance_catalog(node_data_provider.instance_catalog)
+    load_node_series = None
+    if config.NODE_USAGE_SUMMARIES_IN_PROMETHEUS:
+        load_node_series = node_data_provider.load_usage_series
+    with profiling.phase('create_report', 'report'):
+        create_report(config.OUTPUT_FILE_PATH, start, end, node_data, pod_data, logger,
+                      load_node_series=load_node_series, reports=reports)
+    logger.info(transport_stats.summary())
+    if profiler is not None:
+        profiler.write_trace(args.profile)
+        logger.info(f"Profile written to {args.profile}\n{profiler.summary()}")
@@ -0,0 +1,213 @@
+import functools
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is not recorded there
+    resource = None
+
+# the active Profiler, None unless profiling was enabled
+_profiler = None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak / 1E6 if sys.platform == 'darwin' else peak / 1E3
+
+
+def _count_series(res):
+    # series and samples of a range (values) or instant (value) query result
+    series = 0
+    samples = 0
+    for _data in res or []:
+        series += 1
+        samples += len(_data['values']) if 'values' in _data else 1
+    return series, samples
+
+
+class QueryRecord:
+    __slots__ = ('query', 'kind', 'start', 'latency', 'response_bytes', 'series', 'samples', 'thread')
+
+    def __init__(self, query, kind, start, thread):
+        self.query = query
+        self.kind = kind
+        self.start = start
+        self.latency = 0.0
+        self.response_bytes = 0
+        self.series = 0
+        self.samples = 0
+        self.thread = thread
+
+    def set_result(self, res):
+        self.series, self.samples = _count_series(res)
+
+
+class Profiler:
+    """
+    Records the wall time, cpu time (of the calling thread) and process peak RSS of every profiled phase, and the
+    latency, response size, series and sample count of every prometheus query. Phases may run on several threads at
+    once, each thread shows up as its own track in the trace.
+    """
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.phases = []
+        self.queries = []
+        self._thread_names = {}
+
+    def _thread(self):
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+        return thread.ident
+
+    @contextmanager
+    def phase(self, name, category):
+        thread = self._thread()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            phase = {
+                'name': name,
+                'category': category,
+                'start': start - self._t0,
+                'wall': time.perf_counter() - start,
+                'cpu': time.thread_time() - cpu_start,
+                'peak_rss_mb': _peak_rss_mb(),
+                'thread': thread,
+            }
+            with self._lock:
+                self.phases.append(phase)
+
+    @contextmanager
+    def query(self, query, kind):
+        record = QueryRecord(query, kind, time.perf_counter() - self._t0, self._thread())
+        self._local.query = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.latency = time.perf_counter() - start
+            self._local.query = None
+            with self._lock:
+                self.queries.append(record)
+
+    def add_response_bytes(self, n_bytes):
+        # bytes received by the http transport for the query running on this thread
+        record = getattr(self._local, 'query', None)
+        if record is not None:
+            record.response_bytes += n_bytes
+
+    def trace_events(self):
+        # chrome trace event format, loadable in chrome://tracing and https://ui.perfetto.dev
+        with self._lock:
+            phases = list(self.phases)
+            queries = list(self.queries)
+            thread_names = dict(self._thread_names)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': thread, 'args': {'name': name}}
+                  for thread, name in thread_names.items()]
+        for phase in phases:
+            events.append({'name': phase['name'], 'cat': phase['category'], 'ph': 'X', 'pid': 0,
+                           'tid': phase['thread'], 'ts': phase['start'] * 1E6, 'dur': phase['wall'] * 1E6,
+                           'args': {'cpu_ms': phase['cpu'] * 1E3, 'peak_rss_mb': phase['peak_rss_mb']}})
+        for record in queries:
+            events.append({'name': record.query[:120], 'cat': 'query ' + record.kind, 'ph': 'X', 'pid': 0,
+                           'tid': record.thread, 'ts': record.start * 1E6, 'dur': record.latency * 1E6,
+                           'args': {'query': record.query, 'response_bytes': record.response_bytes,
+                                    'series': record.series, 'samples': record.samples}})
+        return events
+
+    def write_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, file)
+
+    def summary(self, top_queries=10):
+        # phases aggregated by name, slowest first, and the slowest queries
+        with self._lock:
+            phases = list(self.phases)
+            queries = list(self.queries)
+        by_name = {}
+        for phase in phases:
+            calls, wall, cpu, peak = by_name.get(phase['name'], (0, 0.0, 0.0, None))
+            if phase['peak_rss_mb'] is not None:
+                peak = max(peak or 0.0, phase['peak_rss_mb'])
+            by_name[phase['name']] = (calls + 1, wall + phase['wall'], cpu + phase['cpu'], peak)
+        lines = [f"{'phase':<60} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'peak MB':>9}"]
+        for name, (calls, wall, cpu, peak) in sorted(by_name.items(), key=lambda x: -x[1][1]):
+            peak = '' if peak is None else f"{peak:.1f}"
+            lines.append(f"{name[:60]:<60} {calls:>6} {wall:>9.3f} {cpu:>9.3f} {peak:>9}")
+        lines.append(f"{len(queries)} queries, {sum(q.latency for q in queries):.3f}s total latency, "
+                     f"{sum(q.response_bytes for q in queries) / 1E6:.2f} MB received")
+        lines.append(f"{'latency s':>9} {'MB':>8} {'series':>7} {'samples':>9}  query")
+        for record in sorted(queries, key=lambda q: -q.latency)[:top_queries]:
+            lines.append(f"{record.latency:>9.3f} {record.response_bytes / 1E6:>8.2f} {record.series:>7} "
+                         f"{record.samples:>9}  {record.query[:100]}")
+        return '\n'.join(lines)
+
+
+def enable():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    return _profiler
+
+
+@contextmanager
+def phase(name, category):
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name, category):
+            yield
+
+
+@contextmanager
+def query(query_text, kind):
+    # yields the QueryRecord to attach the result to, or None when profiling is off
+    if _profiler is None:
+        yield None
+    else:
+        with _profiler.query(query_text, kind) as record:
+            yield record
+
+
+def add_response_bytes(n_bytes):
+    if _profiler is not None:
+        _profiler.add_response_bytes(n_bytes)
+
+
+def profiled(category):
+    # records every call of the decorated function as a phase named after it, a plain call when profiling is off.
+    # Methods are named after the class of the instance, so the phases of a shared base class method are told apart
+    def decorator(func):
+        is_method = '.' in func.__qualname__ and '<locals>' not in func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            name = f"{type(args[0]).__name__}.{func.__name__}" if is_method else func.__qualname__
+            with _profiler.phase(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# prefix of every exported metric name
+METRIC_PREFIX = 'prometheus_monitoring_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class MetricsSnapshot:
+    """Gauges of one refresh of the flag results, rendered in the prometheus text exposition format."""
+
+    def __init__(self):
+        # metric name -> (help text, [(labels, value), ...])
+        self._families = {}
+
+    def add(self, name, help_text, labels, value):
+        if value is None:
+            return
+        self._families.setdefault(METRIC_PREFIX + name, (help_text, []))[1].append((labels, value))
+
+    def render(self):
+        lines = []
+        for name, (help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class MetricsExporter:
+    """
+    Serves the latest MetricsSnapshot on http://host:port/metrics. The snapshot is rendered once when it is published
+    and scrapes only copy the rendered bytes, so a scrape never waits for the flaggers. The server runs on a daemon
+    thread, snapshots are published by whoever refreshes the flag results.
+    """
+
+    def __init__(self, port, logger, host=''):
+        self.logger = logger
+        self._body = b''
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter._body
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                exporter.logger.debug("metrics endpoint: " + format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-exporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self.logger.info(f"Serving metrics on port {self.server.server_address[1]}")
+
+    def publish(self, snapshot):
+        # replacing the reference is atomic, scrapes see either the previous or the new snapshot
+        self._body = snapshot.render()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,62 @@
+# kinds of reports that can be selected on the command line, in the order their sheets are written
+REPORT_KINDS = ('placement', 'pod-requests', 'node-usage')
+# resources of the node usage reports, the pod request reports only exist for cpu and memory
+RESOURCES = ('cpu', 'memory', 'rx bytes', 'tx bytes', 'disk total bytes')
+POD_REQUEST_RESOURCES = ('cpu', 'memory')
+
+# report -> (node provider queries, pod provider queries) the report reads. The reports are keyed like the candidates
+# of create_report, the pod request reports are prefixed with 'pod'. The culprit analysis of the tx bytes and disk
+# total bytes reports reads the rx bytes series
+REPORT_QUERIES = {
+    'placement': (('cpu_capacity', 'memory_capacity', 'instance_type'), ('cpu_request', 'memory_request')),
+    'pod cpu': ((), ('cpu_request', 'cpu_limit', 'cpu_usage')),
+    'pod memory': ((), ('memory_request', 'memory_limit', 'memory_usage')),
+    'cpu': (('cpu_capacity', 'instance_type', 'cpu_usage'), ('cpu_usage',)),
+    'memory': (('memory_capacity', 'instance_type', 'memory_usage'), ('memory_usage',)),
+    'rx bytes': (('instance_type', 'network_rx_bytes'), ('network_rx_bytes',)),
+    'tx bytes': (('instance_type', 'network_tx_bytes', 'network_rx_bytes'), ('network_rx_bytes',)),
+    'disk total bytes': (('instance_type', 'disk_total_bytes', 'network_rx_bytes'), ('network_rx_bytes',)),
+}
+
+# nodes are created from their cpu capacity and pods from their requests, so these queries are fetched whenever any
+# query of the provider is
+NODE_ENTITY_QUERIES = ('cpu_capacity',)
+POD_ENTITY_QUERIES = ('cpu_request', 'memory_request')
+
+
+def select_reports(report_kinds=None, resources=None):
+    """
+    Reports of the given kinds (REPORT_KINDS) restricted to the given resources (RESOURCES), None selects all of
+    them. The placement report does not belong to a resource and is selected by its kind alone.
+
+    Returns the selected reports in the order their sheets are written.
+    """
+    report_kinds = REPORT_KINDS if report_kinds is None else report_kinds
+    resources = RESOURCES if resources is None else resources
+    reports = []
+    if 'placement' in report_kinds:
+        reports.append('placement')
+    if 'pod-requests' in report_kinds:
+        reports.extend('pod ' + resource for resource in POD_REQUEST_RESOURCES if resource in resources)
+    if 'node-usage' in report_kinds:
+        reports.extend(resource for resource in RESOURCES if resource in resources)
+    return reports
+
+
+def plan_queries(reports):
+    """
+    Queries of the node and of the pod data provider the reports need, everything else is left out of the fetch.
+
+    Returns (node query names, pod query names), either is empty if no report reads that provider.
+    """
+    node_queries = set()
+    pod_queries = set()
+    for report in reports:
+        node_report_queries, pod_report_queries = REPORT_QUERIES[report]
+        node_queries.update(node_report_queries)
+        pod_queries.update(pod_report_queries)
+    if node_queries:
+        node_queries.update(NODE_ENTITY_QUERIES)
+    if pod_queries:
+        pod_queries.update(POD_ENTITY_QUERIES)
+    return node_queries, pod_queries
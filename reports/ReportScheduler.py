@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+
+
+class SheetBuffer:
+    """Report writer that keeps the sheets of one report in memory, in the order they were written."""
+
+    def __init__(self):
+        self.sheets = []
+
+    def write_sheet(self, sheet_name, df):
+        self.sheets.append((sheet_name, df))
+
+
+class ReportScheduler:
+    """
+    Computes independent reports on a thread pool. Each report function is called with a SheetBuffer in place of the
+    report writer, the buffered sheets are written to the real report writer by write_to, report by report in the order
+    the reports were submitted, so the sheet order does not depend on which report finishes first.
+
+    Reports added with stream are not buffered: they are called with the real report writer when their turn comes in
+    write_to, on the writing thread, so that their rows go to the report writer as they are computed.
+
+    Reports share the node and pod data, they must only read it (or serialize their writes to it).
+    """
+
+    def __init__(self, max_workers=1):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="report")
+        self._reports = []
+
+    def _run(self, report_function, args):
+        sheet_buffer = SheetBuffer()
+        with profiling.phase(report_function.__name__, 'report'):
+            report_function(sheet_buffer, *args)
+        return sheet_buffer
+
+    def submit(self, report_function, *args):
+        self._reports.append(self._pool.submit(self._run, report_function, args))
+
+    def stream(self, report_function, *args):
+        self._reports.append((report_function, args))
+
+    def write_to(self, report_writer):
+        try:
+            while self._reports:
+                # drop each report as soon as it is written so that its sheets can be freed
+                report = self._reports.pop(0)
+                if isinstance(report, tuple):
+                    report_function, args = report
+                    with profiling.phase(report_function.__name__, 'report'):
+                        report_function(report_writer, *args)
+                    continue
+                for sheet_name, df in report.result().sheets:
+                    with profiling.phase(f"write sheet {sheet_name}", 'sheet'):
+                        report_writer.write_sheet(sheet_name, df)
+        finally:
+            self._reports = []
+            self._pool.shutdown(wait=False, cancel_futures=True)
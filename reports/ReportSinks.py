@@ -0,0 +1,282 @@
+import csv
+import datetime
+import math
+import numbers
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# rows of an xlsx worksheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+# rows per record batch of the columnar sinks
+ROWS_PER_BATCH = 65536
+
+
+def _is_missing(value):
+    return value is None or value is pd.NaT or (isinstance(value, (float, np.floating)) and math.isnan(value))
+
+
+class ReportSink:
+    """
+    Destination of the sheets of a report. A sheet is written either as a whole DataFrame with write_sheet or row by
+    row from an iterable of row tuples with write_rows, sheets are written one after the other. Files only appear
+    under their final path once they are complete, so readers never see a half written report.
+    """
+
+    def write_rows(self, sheet_name, columns, rows):
+        raise NotImplementedError
+
+    def write_sheet(self, sheet_name, df):
+        self.write_rows(sheet_name, df.columns, df.itertuples(index=False, name=None))
+
+    def close(self):
+        pass
+
+
+class ExcelSink(ReportSink):
+    """
+    Writes every sheet of a report into one xlsx workbook. The workbook is opened in xlsxwriter's constant memory mode:
+    each row is flushed to a temporary file as soon as the next row is started, so the workbook does not hold the rows
+    written so far. Sheets written with write_rows from a generator are therefore never held in memory as a whole,
+    sheets written with write_sheet are as large as their DataFrame. Rows are written strictly in order, one sheet
+    after the other.
+
+    Cells are written the way pandas to_excel(index=False) writes them: a bold, bordered header row, NaN as an empty
+    cell, infinities as 'inf' and '-inf', dates with a date format and anything else that is not a number as a string.
+    """
+
+    def __init__(self, output_file_path):
+        self.output_file_path = output_file_path
+        self.workbook = xlsxwriter.Workbook(output_file_path + '.tmp', {'constant_memory': True})
+        self.header_format = self.workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        self.datetime_format = self.workbook.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'})
+        self.date_format = self.workbook.add_format({'num_format': 'YYYY-MM-DD'})
+
+    def _write_cell(self, worksheet, row, col, value):
+        if _is_missing(value):
+            return
+        if isinstance(value, (bool, np.bool_)):
+            worksheet.write_boolean(row, col, bool(value))
+        elif isinstance(value, numbers.Number):
+            if isinstance(value, (float, np.floating)) and math.isinf(value):
+                worksheet.write_string(row, col, 'inf' if value > 0 else '-inf')
+            else:
+                worksheet.write_number(row, col, value)
+        elif isinstance(value, datetime.datetime):
+            worksheet.write_datetime(row, col, value, self.datetime_format)
+        elif isinstance(value, datetime.date):
+            worksheet.write_datetime(row, col, value, self.date_format)
+        else:
+            worksheet.write_string(row, col, str(value))
+
+    def write_rows(self, sheet_name, columns, rows):
+        # rows is any iterable of row tuples, it is consumed as it is written and never held in memory as a whole
+        worksheet = self.workbook.add_worksheet(sheet_name)
+        for col, name in enumerate(columns):
+            worksheet.write(0, col, name, self.header_format)
+        row = 0
+        for row, values in enumerate(rows, start=1):
+            if row >= EXCEL_MAX_ROWS:
+                raise ValueError(f"Sheet {sheet_name} has more rows than an xlsx worksheet can hold "
+                                 f"({EXCEL_MAX_ROWS - 1}), write the report as csv, parquet or arrow instead")
+            for col, value in enumerate(values):
+                self._write_cell(worksheet, row, col, value)
+        return row
+
+    def close(self):
+        self.workbook.close()
+        os.replace(self.output_file_path + '.tmp', self.output_file_path)
+
+
+class _FilePerSheetSink(ReportSink):
+    """Writes each sheet of a report to its own file in output_dir, named after the sheet."""
+
+    extension = None
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._file_names = set()
+
+    def _sheet_path(self, sheet_name):
+        file_name = re.sub(r'[^0-9a-z]+', '_', sheet_name.lower()).strip('_')
+        # sheet names that only differ in case or punctuation still get files of their own
+        unique_name, i = file_name, 1
+        while unique_name in self._file_names:
+            i += 1
+            unique_name = f"{file_name}_{i}"
+        self._file_names.add(unique_name)
+        return os.path.join(self.output_dir, f"{unique_name}.{self.extension}")
+
+    def write_rows(self, sheet_name, columns, rows):
+        path = self._sheet_path(sheet_name)
+        try:
+            n_rows = self._write_file(path + '.tmp', [str(column) for column in columns], rows)
+        except Exception:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            raise
+        # files are complete once they get their final name
+        os.replace(path + '.tmp', path)
+        return n_rows
+
+    def _write_file(self, path, columns, rows):
+        raise NotImplementedError
+
+
+class CsvSink(_FilePerSheetSink):
+    """One csv file per sheet, with a header row, NaN written as an empty field like pandas to_csv."""
+
+    extension = 'csv'
+
+    def _write_file(self, path, columns, rows):
+        n_rows = 0
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(columns)
+            for values in rows:
+                writer.writerow(['' if _is_missing(value) else value for value in values])
+                n_rows += 1
+        return n_rows
+
+
+def _batches(columns, rows):
+    # DataFrames of up to ROWS_PER_BATCH rows, the last one may be empty
+    batch = []
+    for values in rows:
+        batch.append(values)
+        if len(batch) == ROWS_PER_BATCH:
+            yield pd.DataFrame(batch, columns=columns)
+            batch = []
+    yield pd.DataFrame(batch, columns=columns)
+
+
+def _to_record_batch(pyarrow, df, schema=None):
+    # object columns that do not only hold strings (sets, mixed types) are written as their string representation,
+    # and so are the values of any column the schema holds as strings
+    df = df.copy(deep=False)
+    string_columns = set()
+    if schema is not None:
+        string_columns = {field.name for field in schema if pyarrow.types.is_string(field.type)}
+    for column in df.columns:
+        if df[column].dtype != object and column not in string_columns:
+            continue
+        if pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty'):
+            df[column] = df[column].map(lambda value: None if _is_missing(value) else str(value))
+    if schema is not None:
+        return pyarrow.RecordBatch.from_pandas(df, schema=schema, preserve_index=False)
+    return pyarrow.RecordBatch.from_pandas(df, preserve_index=False)
+
+
+def _widened_schema(pyarrow, schema):
+    # the first batch of rows does not show every value of a column: columns without any value are held as strings,
+    # which any value can be written as, and integer columns as floats, which also hold missing values
+    fields = []
+    for field in schema:
+        if pyarrow.types.is_null(field.type):
+            field = field.with_type(pyarrow.string())
+        elif pyarrow.types.is_integer(field.type):
+            field = field.with_type(pyarrow.float64())
+        fields.append(field)
+    return pyarrow.schema(fields, metadata=schema.metadata)
+
+
+class _ArrowSink(_FilePerSheetSink):
+    """
+    Base of the sinks that write typed columns with pyarrow, an optional dependency that is only imported when such a
+    sink is created. Rows are converted in record batches of ROWS_PER_BATCH rows, the first batch of a sheet fixes its
+    schema. Row sheets are widened so that later batches fit it (see _widened_schema), a DataFrame is written in one
+    batch with the column types it has.
+    """
+
+    def __init__(self, output_dir):
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError(f"pyarrow is required to write {self.extension} reports") from e
+        self.pyarrow = pyarrow
+        super().__init__(output_dir)
+
+    def write_sheet(self, sheet_name, df):
+        # a whole DataFrame is converted in one go instead of going through row tuples
+        columns = [str(column) for column in df.columns]
+        return self._write_batches(sheet_name, [df.set_axis(columns, axis=1)], widen=False)
+
+    def write_rows(self, sheet_name, columns, rows):
+        return self._write_batches(sheet_name, _batches([str(column) for column in columns], rows), widen=True)
+
+    def _write_batches(self, sheet_name, batches, widen):
+        path = self._sheet_path(sheet_name)
+        writer = None
+        schema = None
+        n_rows = 0
+        try:
+            for batch in batches:
+                record_batch = _to_record_batch(self.pyarrow, batch, schema)
+                if writer is None:
+                    schema = record_batch.schema
+                    if widen:
+                        schema = _widened_schema(self.pyarrow, schema)
+                        record_batch = _to_record_batch(self.pyarrow, batch, schema)
+                    writer = self._open_writer(path + '.tmp', schema)
+                self._write_batch(writer, record_batch)
+                n_rows += record_batch.num_rows
+            writer.close()
+        except Exception:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            raise
+        os.replace(path + '.tmp', path)
+        return n_rows
+
+    def _open_writer(self, path, schema):
+        raise NotImplementedError
+
+    def _write_batch(self, writer, record_batch):
+        writer.write_batch(record_batch)
+
+
+class ParquetSink(_ArrowSink):
+    """One parquet file per sheet, every record batch becomes a row group."""
+
+    extension = 'parquet'
+
+    def _open_writer(self, path, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(path, schema)
+
+    def _write_batch(self, writer, record_batch):
+        writer.write_table(self.pyarrow.Table.from_batches([record_batch]))
+
+
+class ArrowSink(_ArrowSink):
+    """One Arrow IPC file (feather v2) per sheet."""
+
+    extension = 'arrow'
+
+    def _open_writer(self, path, schema):
+        return self.pyarrow.ipc.new_file(path, schema)
+
+
+# report format (config.REPORT_FORMAT) -> sink class and whether it writes one file or a directory of files
+REPORT_SINKS = {
+    'xlsx': (ExcelSink, False),
+    'csv': (CsvSink, True),
+    'parquet': (ParquetSink, True),
+    'arrow': (ArrowSink, True),
+}
+
+
+def create_report_sink(report_format, output_file_path):
+    # the file per sheet formats write into a directory named like output_file_path without its extension
+    if report_format not in REPORT_SINKS:
+        raise ValueError(f"Unknown report format {report_format}, expected one of {', '.join(REPORT_SINKS)}")
+    sink_class, per_sheet = REPORT_SINKS[report_format]
+    if per_sheet:
+        return sink_class(os.path.splitext(output_file_path)[0])
+    return sink_class(output_file_path)